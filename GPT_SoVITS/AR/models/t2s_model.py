@@ -1,7 +1,10 @@
 # modified from https://github.com/yangdongchao/SoundStorm/blob/master/soundstorm/s1/AR/models/t2s_model.py
 # reference: https://github.com/lifeiteng/vall-e
 import math
-from typing import List, Optional
+import threading
+import time
+from collections import deque
+from typing import Any, Iterator, List, Optional, Tuple
 
 import torch
 from torch import nn
@@ -12,9 +15,11 @@ from tqdm import tqdm
 from AR.models.utils import (
     dpo_loss,
     get_batch_logps,
+    logits_to_probs,
     make_pad_mask,
     make_pad_mask_left,
     make_reject_y,
+    multinomial_sample_one_no_sync,
     sample,
     topk_sampling,
 )
@@ -33,6 +38,14 @@ default_config = {
     "EOS": 1024,
 }
 
+# 预分配的 KV cache 按 KV_CACHE_CHUNK 个位置取整，解码超出容量时再按块扩容，
+# 不按最大解码长度一次性分配（v2 模型每行 1500 个 token 约 150MB）
+KV_CACHE_CHUNK = 256
+
+
+def round_kv_capacity(length: int) -> int:
+    return (length + KV_CACHE_CHUNK - 1) // KV_CACHE_CHUNK * KV_CACHE_CHUNK
+
 
 # @torch.jit.script ## 使用的话首次推理会非常慢，而且推理速度不稳定
 # Efficient implementation equivalent to the following:
@@ -220,6 +233,87 @@ class T2SBlock:
         )
         return x, k_cache, v_cache
 
+    def decode_next_token_static(
+        self,
+        x: torch.Tensor,
+        k_cache: torch.Tensor,
+        v_cache: torch.Tensor,
+        cache_len: int,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        # k_cache/v_cache 为预分配的 [batch, capacity, hidden]，新 token 的 k/v 原地写入 cache_len 处，
+        # attention 只在前 cache_len + q_len 个位置的视图上计算，不再每步 torch.cat
+        # 一次输入多个 token 时 (投机解码的验证)，attn_mask 需要带上因果关系
+        q, k, v = F.linear(x, self.qkv_w, self.qkv_b).chunk(3, dim=-1)
+
+        kv_len = cache_len + k.shape[1]
+        k_cache[:, cache_len:kv_len] = k
+        v_cache[:, cache_len:kv_len] = v
+        return self.attend_cache(x, q, k_cache, v_cache, kv_len, attn_mask, torch_sdpa)
+
+    def decode_next_token_slots(
+        self,
+        x: torch.Tensor,
+        k_cache: torch.Tensor,
+        v_cache: torch.Tensor,
+        rows: torch.Tensor,
+        cache_pos: torch.Tensor,
+        kv_len: int,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        # 连续批处理：每一行 (slot) 的序列长度不同，新 token 的 k/v 写入各自的 cache_pos 处，
+        # attn_mask 负责屏蔽各行 cache_pos 之后的位置
+        q, k, v = F.linear(x, self.qkv_w, self.qkv_b).chunk(3, dim=-1)
+
+        k_cache[rows, cache_pos] = k[:, 0]
+        v_cache[rows, cache_pos] = v[:, 0]
+        return self.attend_cache(x, q, k_cache, v_cache, kv_len, attn_mask, torch_sdpa)
+
+    def attend_cache(
+        self,
+        x: torch.Tensor,
+        q: torch.Tensor,
+        k_cache: torch.Tensor,
+        v_cache: torch.Tensor,
+        kv_len: int,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        batch_size = q.shape[0]
+        q_len = q.shape[1]
+
+        q = q.view(batch_size, q_len, self.num_heads, -1).transpose(1, 2)
+        k = k_cache[:, :kv_len].view(batch_size, kv_len, self.num_heads, -1).transpose(1, 2)
+        v = v_cache[:, :kv_len].view(batch_size, kv_len, self.num_heads, -1).transpose(1, 2)
+
+        if torch_sdpa:
+            attn = F.scaled_dot_product_attention(q, k, v, (~attn_mask) if attn_mask is not None else None)
+        else:
+            attn = scaled_dot_product_attention(q, k, v, attn_mask)
+
+        attn = attn.transpose(1, 2).reshape(batch_size, q_len, -1)
+        attn = F.linear(attn, self.out_w, self.out_b)
+
+        x = x + attn
+        x = F.layer_norm(
+            x,
+            [self.hidden_dim],
+            self.norm_w1,
+            self.norm_b1,
+            self.norm_eps1,
+        )
+        x = x + self.mlp.forward(x)
+        x = F.layer_norm(
+            x,
+            [self.hidden_dim],
+            self.norm_w2,
+            self.norm_b2,
+            self.norm_eps2,
+        )
+        return x
+
 
 @torch.jit.script
 class T2STransformer:
@@ -256,6 +350,63 @@ class T2STransformer:
             )
         return x, k_cache, v_cache
 
+    def allocate_kv_cache(self, k_cache: List[torch.Tensor], v_cache: List[torch.Tensor], capacity: int):
+        # 把 process_prompt 得到的 cache 拷入长度为 capacity 的预分配缓冲区
+        k_buffers: List[torch.Tensor] = []
+        v_buffers: List[torch.Tensor] = []
+        for i in range(self.num_blocks):
+            k = k_cache[i]
+            v = v_cache[i]
+            k_buffer = torch.empty([k.shape[0], capacity, k.shape[2]], dtype=k.dtype, device=k.device)
+            v_buffer = torch.empty([v.shape[0], capacity, v.shape[2]], dtype=v.dtype, device=v.device)
+            k_buffer[:, : k.shape[1]] = k
+            v_buffer[:, : v.shape[1]] = v
+            k_buffers.append(k_buffer)
+            v_buffers.append(v_buffer)
+        return k_buffers, v_buffers
+
+    def grow_kv_cache(self, k_cache: List[torch.Tensor], v_cache: List[torch.Tensor], filled: int, capacity: int):
+        # 把预分配 cache 中已写入的前 filled 个位置拷入长度为 capacity 的新缓冲区
+        k_filled: List[torch.Tensor] = []
+        v_filled: List[torch.Tensor] = []
+        for i in range(self.num_blocks):
+            k_filled.append(k_cache[i][:, :filled])
+            v_filled.append(v_cache[i][:, :filled])
+        return self.allocate_kv_cache(k_filled, v_filled, capacity)
+
+    def decode_next_token_static(
+        self,
+        x: torch.Tensor,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        cache_len: int,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+        num_layers: int = -1,
+    ):
+        # num_layers > 0 时只经过前 num_layers 层，作为投机解码的草稿模型
+        num_blocks = self.num_blocks if num_layers <= 0 else min(num_layers, self.num_blocks)
+        for i in range(num_blocks):
+            x = self.blocks[i].decode_next_token_static(x, k_cache[i], v_cache[i], cache_len, attn_mask, torch_sdpa)
+        return x
+
+    def decode_next_token_slots(
+        self,
+        x: torch.Tensor,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        rows: torch.Tensor,
+        cache_pos: torch.Tensor,
+        kv_len: int,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        for i in range(self.num_blocks):
+            x = self.blocks[i].decode_next_token_slots(
+                x, k_cache[i], v_cache[i], rows, cache_pos, kv_len, attn_mask, torch_sdpa
+            )
+        return x
+
 
 class Text2SemanticDecoder(nn.Module):
     def __init__(self, config, norm_first=False, top_k=3):
@@ -580,34 +731,19 @@ class Text2SemanticDecoder(nn.Module):
         # 错位
         return targets[:, :-1], targets[:, 1:]
 
-    def infer_panel_batch_infer(
+    def _batch_prompt_input(
         self,
-        x: List[torch.LongTensor],  #####全部文本token
+        x: List[torch.LongTensor],
         x_lens: torch.LongTensor,
-        prompts: torch.LongTensor,  ####参考音频token
+        prompts: torch.LongTensor,
         bert_feature: List[torch.LongTensor],
-        top_k: int = -100,
-        top_p: int = 100,
-        early_stop_num: int = -1,
-        temperature: float = 1.0,
-        repetition_penalty: float = 1.35,
-        **kwargs,
+        max_len: int,
     ):
-        if prompts is None:
-            print("Warning: Prompt free is not supported batch_infer! switch to naive_infer")
-            return self.infer_panel_naive_batched(
-                x,
-                x_lens,
-                prompts,
-                bert_feature,
-                top_k=top_k,
-                top_p=top_p,
-                early_stop_num=early_stop_num,
-                temperature=temperature,
-                **kwargs,
-            )
-
-        max_len = kwargs.get("max_len", x_lens.max())
+        """
+        Embed a left-padded batch of phones + prompt semantic tokens for the first (prompt) step.
+        returns:
+            Tuple[torch.Tensor, torch.Tensor]: xy_pos [bsz, src_len, hidden] and the bool attn_mask [bsz, head, src_len, src_len].
+        """
         x_list = []
         for x_item, bert_item in zip(x, bert_feature):
             # max_len = max(max_len, x_item.shape[0], bert_item.shape[1])
@@ -621,21 +757,11 @@ class Text2SemanticDecoder(nn.Module):
             x_list.append(x_item)
         x: torch.Tensor = torch.stack(x_list, dim=0)
 
-        # AR Decoder
         y = prompts
 
         x_len = x.shape[1]
-        stop = False
-
-        k_cache = None
-        v_cache = None
-        ###################  first step ##########################
-        assert y is not None, "Error: Prompt free is not supported batch_infer!"
-        ref_free = False
-
         y_emb = self.ar_audio_embedding(y)
         y_len = y_emb.shape[1]
-        prefix_len = y.shape[1]
         y_lens = torch.LongTensor([y_emb.shape[1]] * y_emb.shape[0]).to(x.device)
         y_pos = self.ar_audio_position(y_emb)
         xy_pos = torch.concat([x, y_pos], dim=1)
@@ -693,29 +819,93 @@ class Text2SemanticDecoder(nn.Module):
         # [PAD, PAD, PAD, 1, 2, 3,   4, EOS, EOS],
         # [PAD, PAD, PAD, 1, 2, 3,   4,   5, EOS],
         # [PAD, PAD, PAD, 1, 2, 3,   4,   5,   6]]
+        return xy_pos, attn_mask
+
+    def infer_panel_batch_infer(
+        self,
+        x: List[torch.LongTensor],  #####全部文本token
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,  ####参考音频token
+        bert_feature: List[torch.LongTensor],
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        **kwargs,
+    ):
+        if prompts is None:
+            print("Warning: Prompt free is not supported batch_infer! switch to naive_infer")
+            return self.infer_panel_naive_batched(
+                x,
+                x_lens,
+                prompts,
+                bert_feature,
+                top_k=top_k,
+                top_p=top_p,
+                early_stop_num=early_stop_num,
+                temperature=temperature,
+                **kwargs,
+            )
+
+        max_len = kwargs.get("max_len", x_lens.max())
+        xy_pos, attn_mask = self._batch_prompt_input(x, x_lens, prompts, bert_feature, max_len)
+
+        # AR Decoder
+        y = prompts
+        stop = False
+
+        k_cache = None
+        v_cache = None
+        ###################  first step ##########################
+        assert y is not None, "Error: Prompt free is not supported batch_infer!"
+        ref_free = False
+
+        y_len = y.shape[1]
+        prefix_len = y.shape[1]
+        bsz = y.shape[0]
+        src_len = xy_pos.shape[1]
 
         ###### decode #####
+        # KV cache 与 attn_mask 预分配到 KV_CACHE_CHUNK 的整数倍，写满时再按块扩容；y 按最大解码长度 (early_stop_num) 预分配。
+        # 解码时原地写入，序列结束时把仍在解码的行前移压实，只拷贝已写入的部分，不再每步 torch.cat / F.pad
+        max_new_tokens = 1500 if early_stop_num == -1 else min(1500, early_stop_num + 1)
+        capacity = min(src_len + max_new_tokens, round_kv_capacity(src_len + KV_CACHE_CHUNK))
+        y_buffer = torch.zeros((bsz, prefix_len + max_new_tokens), dtype=y.dtype, device=y.device)
+        y_buffer[:, :prefix_len] = y
+        y_len_now = prefix_len
+
+        start = time.perf_counter()
         y_list = [None] * y.shape[0]
         batch_idx_map = list(range(y.shape[0]))
         idx_list = [None] * y.shape[0]
         for idx in tqdm(range(1500)):
             if idx == 0:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, attn_mask, None)
+                k_cache, v_cache = self.t2s_transformer.allocate_kv_cache(k_cache, v_cache, capacity)
+                # 之后每步只有一个 query，mask 取 prompt 最后一行，各个 head 共用: [bsz, 1, 1, capacity]
+                attn_mask = F.pad(attn_mask[:, :1, -1:], (0, capacity - src_len), value=False)
             else:
-                xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache, attn_mask)
+                cache_len = src_len + idx - 1
+                if cache_len + 1 > capacity:
+                    capacity = round_kv_capacity(cache_len + 1)
+                    k_cache, v_cache = self.t2s_transformer.grow_kv_cache(k_cache, v_cache, cache_len, capacity)
+                    attn_mask = F.pad(attn_mask, (0, capacity - attn_mask.shape[-1]), value=False)
+                xy_dec = self.t2s_transformer.decode_next_token_static(
+                    xy_pos, k_cache, v_cache, cache_len, attn_mask[..., : cache_len + 1]
+                )
             logits = self.ar_predict_layer(xy_dec[:, -1])
 
             if idx == 0:
-                attn_mask = F.pad(attn_mask[:, :, -1].unsqueeze(-2), (0, 1), value=False)
                 logits = logits[:, :-1]
-            else:
-                attn_mask = F.pad(attn_mask, (0, 1), value=False)
 
             samples = sample(
                 logits, y, top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty, temperature=temperature
             )[0]
 
-            y = torch.concat([y, samples], dim=1)
+            y_buffer[:, y_len_now] = samples[:, 0]
+            y_len_now += 1
+            y = y_buffer[:, :y_len_now]
 
             ####### 移除batch中已经生成完毕的序列,进一步优化计算量
             tokens = torch.argmax(logits, dim=-1)
@@ -730,19 +920,25 @@ class Text2SemanticDecoder(nn.Module):
                 for i in removed_idx_of_batch_for_y:
                     batch_index = batch_idx_map[i]
                     idx_list[batch_index] = idx
-                    y_list[batch_index] = y[i, :-1]
+                    # y 是缓冲区的视图，压实时会被覆盖，需要拷贝
+                    y_list[batch_index] = y[i, :-1].clone()
 
                 batch_idx_map = [batch_idx_map[i] for i in reserved_idx_of_batch_for_y.tolist()]
 
-            # 只保留batch中未生成完毕的序列
+            # 只保留batch中未生成完毕的序列：把保留的行拷到缓冲区前部，再截取视图
             if reserved_idx_of_batch_for_y is not None:
-                # index = torch.LongTensor(batch_idx_map).to(y.device)
-                y = torch.index_select(y, dim=0, index=reserved_idx_of_batch_for_y)
-                attn_mask = torch.index_select(attn_mask, dim=0, index=reserved_idx_of_batch_for_y)
-                if k_cache is not None:
-                    for i in range(len(k_cache)):
-                        k_cache[i] = torch.index_select(k_cache[i], dim=0, index=reserved_idx_of_batch_for_y)
-                        v_cache[i] = torch.index_select(v_cache[i], dim=0, index=reserved_idx_of_batch_for_y)
+                n_active = reserved_idx_of_batch_for_y.shape[0]
+                filled = src_len + idx
+                y_buffer[:n_active, :y_len_now] = y_buffer[reserved_idx_of_batch_for_y, :y_len_now]
+                y_buffer = y_buffer[:n_active]
+                y = y_buffer[:, :y_len_now]
+                attn_mask[:n_active, ..., :filled] = attn_mask[reserved_idx_of_batch_for_y, ..., :filled]
+                attn_mask = attn_mask[:n_active]
+                for i in range(len(k_cache)):
+                    k_cache[i][:n_active, :filled] = k_cache[i][reserved_idx_of_batch_for_y, :filled]
+                    v_cache[i][:n_active, :filled] = v_cache[i][reserved_idx_of_batch_for_y, :filled]
+                    k_cache[i] = k_cache[i][:n_active]
+                    v_cache[i] = v_cache[i][:n_active]
 
             if (early_stop_num != -1 and (y.shape[1] - prefix_len) > early_stop_num) or idx == 1499:
                 print("use early stop num:", early_stop_num)
@@ -769,15 +965,163 @@ class Text2SemanticDecoder(nn.Module):
             ].to(dtype=y_emb.dtype, device=y_emb.device)
 
         if None in idx_list:
-            for i in range(x.shape[0]):
+            for i in range(len(x)):
                 if idx_list[i] is None:
                     idx_list[i] = 1500 - 1  ###如果没有生成到EOS，就用最大长度代替
+        self._record_decode_stats("batch_infer", sum(idx + 1 for idx in idx_list), idx + 1, start, idx + 1)
 
         if ref_free:
-            return y_list, [0] * x.shape[0]
+            return y_list, [0] * len(x)
         # print(idx_list)
         return y_list, idx_list
 
+    def infer_panel_sync_free(
+        self,
+        x: List[torch.LongTensor],  #####全部文本token
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,  ####参考音频token
+        bert_feature: List[torch.LongTensor],
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        **kwargs,
+    ):
+        """
+        Same inputs/outputs as infer_panel_batch_infer, without a host-device sync on every token.
+
+        EOS tracking, the finished mask and the end step of every sequence stay on the device; the host only
+        checks whether the whole batch has finished once every `sync_interval` steps (finished sequences keep
+        decoding until then and the extra tokens are discarded). The decode step reads its cache/positional
+        positions from device tensors; the attention length and the KV cache (grown by KV_CACHE_CHUNK) only
+        change at those checks.
+        `min_eos_step` forbids EOS for the first steps: 1 matches infer_panel_batch_infer, 11 infer_panel_naive.
+        """
+        if prompts is None:
+            print("Warning: Prompt free is not supported sync free decoding! switch to naive_infer")
+            return self.infer_panel_naive_batched(
+                x,
+                x_lens,
+                prompts,
+                bert_feature,
+                top_k=top_k,
+                top_p=top_p,
+                early_stop_num=early_stop_num,
+                temperature=temperature,
+                **kwargs,
+            )
+
+        sync_interval = max(1, kwargs.get("sync_interval", 8))
+        min_eos_step = max(1, kwargs.get("min_eos_step", 1))
+        sampling = dict(top_k=top_k, top_p=top_p, temperature=temperature, repetition_penalty=repetition_penalty)
+
+        start = time.perf_counter()
+        max_len = kwargs.get("max_len", x_lens.max())
+        xy_pos, attn_mask = self._batch_prompt_input(x, x_lens, prompts, bert_feature, max_len)
+        y = prompts
+        bsz, prefix_len = y.shape[0], y.shape[1]
+        src_len = xy_pos.shape[1]
+        device = xy_pos.device
+
+        max_new_tokens = 1500 if early_stop_num == -1 else min(1500, early_stop_num + 1)
+        max_capacity = src_len + max_new_tokens
+        capacity = min(max_capacity, round_kv_capacity(src_len + max(KV_CACHE_CHUNK, sync_interval)))
+        xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, attn_mask, None)
+        k_cache, v_cache = self.t2s_transformer.allocate_kv_cache(k_cache, v_cache, capacity)
+        self._zero_kv_tail(k_cache, v_cache, src_len)
+        # prompt 部分的 padding mask；生成部分是否可见由各行的 cache_pos 决定
+        padding_mask = F.pad(attn_mask[:, :1, -1:], (0, capacity - src_len), value=False)
+        positions = torch.arange(capacity, device=device)
+        rows = torch.arange(bsz, device=device)
+        pe = self.ar_audio_position.pe.to(dtype=xy_pos.dtype, device=device)
+
+        # 尾部用每行第一个 token 填充，重复惩罚可以直接作用在固定形状的整个缓冲区上（重复的 token 只惩罚一次）
+        y_buffer = y[:, :1].expand(-1, prefix_len + max_new_tokens).clone()
+        y_buffer[:, :prefix_len] = y
+
+        logits = self.ar_predict_layer(xy_dec[:, -1])
+        logits[:, self.EOS] = -float("inf")
+        samples = sample(logits, y, **sampling)[0]
+        y_buffer[:, prefix_len] = samples[:, 0]
+
+        # 以下状态都留在设备上，解码循环内不读回
+        last_tokens = samples
+        cache_pos = torch.full((bsz,), src_len, dtype=torch.long, device=device)
+        write_pos = torch.full((bsz, 1), prefix_len + 1, dtype=torch.long, device=device)
+        pe_pos = torch.full((1,), prefix_len, dtype=torch.long, device=device)
+        step = torch.ones((), dtype=torch.long, device=device)
+        finished = torch.zeros(bsz, dtype=torch.bool, device=device)
+        end_idx = torch.full((bsz,), max_new_tokens - 1, dtype=torch.long, device=device)
+
+        kv_len = capacity
+        steps = 1
+        syncs = 0
+        for idx in tqdm(range(1, max_new_tokens)):
+            if (idx - 1) % sync_interval == 0:
+                syncs += 1
+                if bool(finished.all()):
+                    break
+                # 接下来 sync_interval 步 attention 的长度固定，cache 不够时在这里按块扩容（cache 已写入 src_len + idx - 1 个位置）
+                kv_len = min(max_capacity, src_len + idx - 1 + sync_interval)
+                if kv_len > capacity:
+                    capacity = min(max_capacity, round_kv_capacity(kv_len))
+                    k_cache, v_cache = self.t2s_transformer.grow_kv_cache(k_cache, v_cache, src_len + idx - 1, capacity)
+                    self._zero_kv_tail(k_cache, v_cache, src_len + idx - 1)
+                    padding_mask = F.pad(padding_mask, (0, capacity - padding_mask.shape[-1]), value=False)
+                    positions = torch.arange(capacity, device=device)
+
+            y_emb = self.ar_audio_embedding(last_tokens)
+            xy_pos = y_emb * self.ar_audio_position.x_scale + self.ar_audio_position.alpha * pe.index_select(1, pe_pos)
+            decode_mask = padding_mask[..., :kv_len].logical_or(positions[:kv_len] > cache_pos.view(bsz, 1, 1, 1))
+            xy_dec = self.t2s_transformer.decode_next_token_slots(
+                xy_pos, k_cache, v_cache, rows, cache_pos, kv_len, decode_mask
+            )
+            logits = self.ar_predict_layer(xy_dec[:, -1])
+            if idx < min_eos_step:
+                logits[:, self.EOS] = -float("inf")
+            samples = sample(logits, y_buffer, **sampling)[0]
+
+            eos = (samples[:, 0] == self.EOS).logical_or(torch.argmax(logits, dim=-1) == self.EOS)
+            end_idx = torch.where(eos.logical_and(finished.logical_not()), step, end_idx)
+            finished.logical_or_(eos)
+            y_buffer.scatter_(1, write_pos, samples.to(dtype=y_buffer.dtype))
+
+            last_tokens = samples
+            cache_pos += 1
+            write_pos += 1
+            pe_pos += 1
+            step += 1
+            steps += 1
+
+        idx_list = end_idx.tolist()
+        y_list = [y_buffer[i, : prefix_len + idx_list[i]] for i in range(bsz)]
+        print(f"T2S Decoding EOS [{prefix_len} -> {prefix_len + max(idx_list) + 1}]")
+        self._record_decode_stats("sync_free", sum(idx + 1 for idx in idx_list), steps, start, syncs + 1)
+        return y_list, idx_list
+
+    @staticmethod
+    def _zero_kv_tail(k_cache: List[torch.Tensor], v_cache: List[torch.Tensor], filled: int):
+        # 一个同步窗口内 attention 覆盖到还没写入的位置（由 mask 屏蔽），
+        # 但 torch.empty 的内容可能是 NaN，权重为 0 也会污染输出，所以先清零
+        for cache in k_cache + v_cache:
+            cache[:, filled:].zero_()
+
+    def _record_decode_stats(self, mode: str, tokens: int, steps: int, start: float, host_syncs: int):
+        seconds = time.perf_counter() - start
+        self.decode_stats = {
+            "mode": mode,
+            "tokens": tokens,
+            "steps": steps,
+            "host_syncs": host_syncs,
+            "seconds": seconds,
+            "tokens_per_second": tokens / seconds if seconds > 0 else 0.0,
+        }
+        print(
+            f"T2S {mode}: {tokens} tokens, {steps} steps, {host_syncs} host syncs in {seconds:.2f}s "
+            f"({self.decode_stats['tokens_per_second']:.1f} tokens/s)"
+        )
+
     def infer_panel_naive_batched(
         self,
         x: List[torch.LongTensor],  #####全部文本token
@@ -793,8 +1137,14 @@ class Text2SemanticDecoder(nn.Module):
     ):
         y_list = []
         idx_list = []
+        if kwargs.get("draft_layers", 0) > 0:
+            infer_panel = self.infer_panel_speculative
+        elif kwargs.get("sync_interval", 0) > 0 and prompts is not None:
+            infer_panel = self._infer_panel_sync_free_single
+        else:
+            infer_panel = self.infer_panel_naive
         for i in range(len(x)):
-            y, idx = self.infer_panel_naive(
+            y, idx = infer_panel(
                 x[i].unsqueeze(0),
                 x_lens[i],
                 prompts[i].unsqueeze(0) if prompts is not None else None,
@@ -811,6 +1161,36 @@ class Text2SemanticDecoder(nn.Module):
 
         return y_list, idx_list
 
+    def _infer_panel_sync_free_single(
+        self,
+        x: torch.LongTensor,
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,
+        bert_feature: torch.LongTensor,
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        **kwargs,
+    ):
+        # infer_panel_naive 的输入格式 (batch 维为 1) 转给 infer_panel_sync_free，保留 naive 至少 10 个 token 的规则
+        kwargs["min_eos_step"] = 11
+        kwargs.pop("max_len", None)
+        y_list, idx_list = self.infer_panel_sync_free(
+            [x[0]],
+            x_lens.view(1),
+            prompts,
+            [bert_feature[0]],
+            top_k,
+            top_p,
+            early_stop_num,
+            temperature,
+            repetition_penalty,
+            **kwargs,
+        )
+        return y_list[0].unsqueeze(0), idx_list[0]
+
     def infer_panel_naive(
         self,
         x: torch.LongTensor,  #####全部文本token
@@ -917,6 +1297,182 @@ class Text2SemanticDecoder(nn.Module):
             return y[:, :-1], 0
         return y[:, :-1], idx
 
+    def infer_panel_speculative(
+        self,
+        x: torch.LongTensor,  #####全部文本token
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,  ####参考音频token
+        bert_feature: torch.LongTensor,
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        **kwargs,
+    ):
+        """
+        Self-speculative decoding, same inputs/outputs as infer_panel_naive (batch size 1).
+
+        The first `draft_layers` blocks of the transformer plus ar_predict_layer act as the draft model and
+        propose `num_draft_tokens` tokens; the full model scores all of them in one forward pass and each one is
+        accepted with probability min(1, p/q), otherwise the token is resampled from max(0, p - q).
+        This keeps the sampling distribution of infer_panel_naive. Draft and full model share the KV cache, the
+        draft layers' entries are identical to the full model's and get overwritten during verification.
+        With num_draft_tokens=0 every step is a plain full-model step and, for the same seed, the output is the
+        one of infer_panel_naive. Acceptance statistics of the last call are kept in self.speculative_stats.
+        """
+        draft_layers = min(max(1, kwargs.get("draft_layers", self.num_layers // 4)), self.num_layers - 1)
+        num_draft_tokens = max(0, kwargs.get("num_draft_tokens", 4))
+        sampling = dict(top_k=top_k, top_p=top_p, temperature=temperature, repetition_penalty=repetition_penalty)
+
+        x = self.ar_text_embedding(x)
+        x = x + self.bert_proj(bert_feature.transpose(1, 2))
+        x = self.ar_text_position(x)
+
+        # AR Decoder
+        y = prompts
+
+        x_len = x.shape[1]
+        x_attn_mask = torch.zeros((x_len, x_len), dtype=torch.bool)
+
+        ###################  first step ##########################
+        if y is not None:
+            y_emb = self.ar_audio_embedding(y)
+            y_len = y_emb.shape[1]
+            prefix_len = y.shape[1]
+            y_pos = self.ar_audio_position(y_emb)
+            xy_pos = torch.concat([x, y_pos], dim=1)
+            ref_free = False
+        else:
+            y_len = 0
+            prefix_len = 0
+            xy_pos = x
+            y = torch.zeros(x.shape[0], 0, dtype=torch.int, device=x.device)
+            ref_free = True
+
+        src_len = x_len + y_len
+        x_attn_mask_pad = F.pad(
+            x_attn_mask,
+            (0, y_len),  ###xx的纯0扩展到xx纯0+xy纯1，(x,x+y)
+            value=True,
+        )
+        y_attn_mask = F.pad(  ###yy的右上1扩展到左边xy的0,(y,x+y)
+            torch.triu(torch.ones(y_len, y_len, dtype=torch.bool), diagonal=1),
+            (x_len, 0),
+            value=False,
+        )
+        xy_attn_mask = (
+            torch.concat([x_attn_mask_pad, y_attn_mask], dim=0)
+            .unsqueeze(0)
+            .expand(self.num_head, -1, -1)
+            .view(1, self.num_head, src_len, src_len)
+            .to(device=x.device, dtype=torch.bool)
+        )
+
+        max_new_tokens = 1500 if early_stop_num == -1 else min(1500, early_stop_num + 1)
+        xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+        k_cache, v_cache = self.t2s_transformer.allocate_kv_cache(
+            k_cache, v_cache, src_len + max_new_tokens + num_draft_tokens + 1
+        )
+        positions = torch.arange(src_len + max_new_tokens + num_draft_tokens + 1, device=x.device)
+
+        probs, _ = self._speculative_probs(self.ar_predict_layer(xy_dec[:, -1]), y, 0, sampling)
+        y = torch.concat([y, self._speculative_sample(probs, 0)], dim=1)
+        generated = 1
+        # cache 中已有 cache_len 个位置，y 的最后一个 token 还没有输入过模型
+        cache_len = src_len
+        stats = {"steps": 0, "drafted": 0, "accepted": 0}
+        stop = generated >= max_new_tokens
+
+        while not stop:
+            ####################### draft ###################################
+            n_draft = min(num_draft_tokens, max_new_tokens - generated - 1)
+            draft_tokens = []
+            draft_probs = []
+            previous = y
+            for j in range(n_draft):
+                xy_pos = self._audio_step_input(previous[:, -1:], y_len + generated - 1 + j)
+                xy_dec = self.t2s_transformer.decode_next_token_static(
+                    xy_pos, k_cache, v_cache, cache_len + j, None, True, draft_layers
+                )
+                q, _ = self._speculative_probs(self.ar_predict_layer(xy_dec[:, -1]), previous, generated + j, sampling)
+                token = self._speculative_sample(q, generated + j)
+                draft_tokens.append(token)
+                draft_probs.append(q)
+                previous = torch.concat([previous, token], dim=1)
+
+            ####################### verify ###################################
+            tokens = torch.concat([y[:, -1:]] + draft_tokens, dim=1)
+            q_len = tokens.shape[1]
+            xy_pos = self._audio_step_input(tokens, y_len + generated - 1)
+            kv_len = cache_len + q_len
+            verify_mask = (
+                positions[:kv_len].unsqueeze(0) > (cache_len + positions[:q_len]).unsqueeze(1)
+            ).view(1, 1, q_len, kv_len)
+            xy_dec = self.t2s_transformer.decode_next_token_static(xy_pos, k_cache, v_cache, cache_len, verify_mask)
+            logits = self.ar_predict_layer(xy_dec[0])
+            stats["steps"] += 1
+            stats["drafted"] += n_draft
+
+            for j in range(q_len):
+                p, eos_argmax = self._speculative_probs(logits[j : j + 1], y, generated, sampling)
+                if j < n_draft:
+                    token = draft_tokens[j]
+                    q = draft_probs[j]
+                    token_id = token[0, 0]
+                    accepted = bool(torch.rand((), device=p.device) * q[0, token_id] <= p[0, token_id])
+                    if not accepted:
+                        residual = (p - q).clamp(min=0)
+                        token = self._speculative_sample(residual if residual.sum() > 0 else p, generated)
+                else:
+                    accepted = False
+                    token = self._speculative_sample(p, generated)
+
+                y = torch.concat([y, token], dim=1)
+                generated += 1
+                if accepted:
+                    stats["accepted"] += 1
+                stop = eos_argmax or bool(token[0, 0] == self.EOS) or generated >= max_new_tokens
+                if stop or not accepted:
+                    break
+            # 输入过模型的是 tokens[:, : j + 1]，之后的 cache 位置在下一轮被覆盖
+            cache_len += j + 1
+
+        stats["tokens"] = generated
+        stats["accepted_per_step"] = stats["accepted"] / stats["steps"] if stats["steps"] else 0.0
+        self.speculative_stats = stats
+        if y.shape[1] == 0:
+            y = torch.concat([y, torch.zeros_like(y[:, :1])], dim=1)
+            print("bad zero prediction")
+        print(f"T2S Decoding EOS [{prefix_len} -> {y.shape[1]}], accepted {stats['accepted']}/{stats['drafted']} draft tokens")
+
+        if ref_free:
+            return y[:, :-1], 0
+        return y[:, :-1], generated - 1
+
+    def _audio_step_input(self, tokens: torch.LongTensor, start: int) -> torch.Tensor:
+        # 与 infer_panel_naive 的 "update next step" 相同，位置编码从 y 的第 start 个位置开始
+        y_emb = self.ar_audio_embedding(tokens)
+        return y_emb * self.ar_audio_position.x_scale + self.ar_audio_position.alpha * self.ar_audio_position.pe[
+            :, start : start + tokens.shape[1]
+        ].to(dtype=y_emb.dtype, device=y_emb.device)
+
+    def _speculative_probs(self, logits: torch.Tensor, previous_tokens: torch.Tensor, idx: int, sampling: dict):
+        """
+        Sampling distribution of decode step `idx` (same rules as infer_panel_naive).
+        returns:
+            Tuple[torch.Tensor, bool]: probs over the full vocabulary, and whether the argmax is EOS.
+        """
+        if idx < 11:  ###至少预测出10个token不然不给停止（0.4s）
+            probs = logits_to_probs(logits[:, :-1], previous_tokens, **sampling)
+            return F.pad(probs, (0, 1)), False
+        probs = logits_to_probs(logits, previous_tokens, **sampling)
+        return probs, bool(torch.argmax(logits, dim=-1)[0] == self.EOS)
+
+    def _speculative_sample(self, probs: torch.Tensor, idx: int) -> torch.Tensor:
+        # EOS 被屏蔽的前 11 步与 infer_panel_naive 一样只在 EOS 之前的 token 上采样，随机数的消耗也一致
+        return multinomial_sample_one_no_sync(probs[:, :-1] if idx < 11 else probs)
+
     def infer_panel(
         self,
         x: torch.LongTensor,  #####全部文本token
@@ -933,3 +1489,303 @@ class Text2SemanticDecoder(nn.Module):
         return self.infer_panel_naive(
             x, x_lens, prompts, bert_feature, top_k, top_p, early_stop_num, temperature, repetition_penalty, **kwargs
         )
+
+    def infer_panel_continuous(
+        self,
+        x: List[torch.LongTensor],  #####全部文本token
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,  ####参考音频token
+        bert_feature: List[torch.LongTensor],
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        **kwargs,
+    ):
+        """
+        Same inputs/outputs as infer_panel_batch_infer, decoded with T2SContinuousBatcher:
+        at most `max_slots` sequences run at once and a waiting one takes the slot of each finished one.
+        An idle batcher passed as `batcher` (the engine's long-lived one) is reused instead of allocating a new one.
+        """
+        if prompts is None:
+            print("Warning: Prompt free is not supported continuous batching! switch to naive_infer")
+            return self.infer_panel_naive_batched(
+                x,
+                x_lens,
+                prompts,
+                bert_feature,
+                top_k=top_k,
+                top_p=top_p,
+                early_stop_num=early_stop_num,
+                temperature=temperature,
+                **kwargs,
+            )
+
+        batcher = kwargs.get("batcher")
+        if batcher is None:
+            batcher = T2SContinuousBatcher(
+                self,
+                max_slots=kwargs.get("max_slots", 8) or len(x),
+                top_k=top_k,
+                top_p=top_p,
+                temperature=temperature,
+                repetition_penalty=repetition_penalty,
+                early_stop_num=early_stop_num,
+            )
+        else:
+            batcher.set_sampling(top_k, top_p, temperature, repetition_penalty)
+        for i in range(len(x)):
+            batcher.submit(x[i], prompts[i], bert_feature[i], tag=i)
+
+        y_list = [None] * len(x)
+        idx_list = [None] * len(x)
+        for i, semantic in batcher:
+            # 与 infer_panel_batch_infer 一致：返回 prompt + 生成的 token，idx 为生成的 token 数
+            y_list[i] = torch.concat([prompts[i], semantic])
+            idx_list[i] = semantic.shape[0]
+        return y_list, idx_list
+
+
+class T2SContinuousBatcher:
+    """
+    Continuous batching for the T2S autoregressive decoder.
+
+    Sequences are decoded in a fixed pool of slots sharing preallocated KV caches. Every slot keeps its own
+    cache position, attention mask row and positional index, so a sequence submitted while others are
+    decoding (from the same or another request) is prefilled into a free slot at the next step instead of
+    waiting for the whole batch to drain. Iterating yields (tag, semantic tokens) as soon as each sequence
+    ends, the tokens exclude the prompt and the final EOS.
+    """
+
+    def __init__(
+        self,
+        model: Text2SemanticDecoder,
+        max_slots: int = 8,
+        top_k: int = 5,
+        top_p: float = 1.0,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        early_stop_num: int = -1,
+    ):
+        self.model = model
+        self.max_slots = max(1, max_slots)
+        self.sampling = dict(
+            top_k=top_k, top_p=top_p, temperature=temperature, repetition_penalty=repetition_penalty
+        )
+        self.max_new_tokens = 1500 if early_stop_num == -1 else min(1500, early_stop_num + 1)
+        self.device = model.ar_predict_layer.weight.device
+
+        self._pending = deque()
+        self._lock = threading.Lock()
+        # 每个 slot 的状态: None 表示空闲，否则为 {"tag", "prompt_len", "y_len", "cache_len"}
+        self.slots: List[Optional[dict]] = [None] * self.max_slots
+
+        self.k_cache: List[torch.Tensor] = []
+        self.v_cache: List[torch.Tensor] = []
+        self.capacity = 0
+        self.y_buffer = torch.zeros((self.max_slots, 0), dtype=torch.long, device=self.device)
+        self.positions = torch.zeros(0, dtype=torch.long, device=self.device)
+
+        self.rows = torch.arange(self.max_slots, device=self.device)
+        self.cache_pos = torch.zeros(self.max_slots, dtype=torch.long, device=self.device)
+        self.y_lens = torch.ones(self.max_slots, dtype=torch.long, device=self.device)
+        self.last_tokens = torch.zeros((self.max_slots, 1), dtype=torch.long, device=self.device)
+        self.active = torch.zeros(self.max_slots, dtype=torch.long, device=self.device)
+
+        self.steps = 0
+        self.decoded_tokens = 0
+
+    def submit(self, phones: torch.LongTensor, prompt: torch.LongTensor, bert_feature: torch.Tensor, tag: Any = None):
+        """
+        Queue one sequence; thread-safe, may be called while another thread iterates.
+        Args:
+            phones: LongTensor [x_len]
+            prompt: LongTensor [prompt_len], semantic tokens of the reference audio.
+            bert_feature: Tensor [1024, x_len]
+            tag: returned together with the semantic tokens.
+        """
+        with self._lock:
+            self._pending.append((tag, phones, prompt, bert_feature))
+
+    def has_work(self) -> bool:
+        with self._lock:
+            if self._pending:
+                return True
+        return any(slot is not None for slot in self.slots)
+
+    def set_sampling(self, top_k: int = 5, top_p: float = 1.0, temperature: float = 1.0, repetition_penalty: float = 1.35):
+        """
+        Change the sampling parameters shared by all slots; only allowed while the batcher is idle.
+        """
+        sampling = dict(top_k=top_k, top_p=top_p, temperature=temperature, repetition_penalty=repetition_penalty)
+        if sampling != self.sampling:
+            assert not self.has_work(), "sampling parameters can only change while the batcher is idle"
+            self.sampling = sampling
+
+    def reset(self) -> List[Any]:
+        """
+        Drop every queued and decoding sequence (e.g. after a failed step), keeping the allocated buffers.
+        returns:
+            List[Any]: tags of the dropped sequences.
+        """
+        with self._lock:
+            tags = [pending[0] for pending in self._pending]
+            self._pending.clear()
+        for i, slot in enumerate(self.slots):
+            if slot is not None:
+                tags.append(self._release(i)[0])
+        return tags
+
+    def __iter__(self) -> Iterator[Tuple[Any, torch.LongTensor]]:
+        while self.has_work():
+            for result in self.step():
+                yield result
+
+    def step(self) -> List[Tuple[Any, torch.LongTensor]]:
+        """
+        Admit waiting sequences into free slots, then decode one token for every active slot.
+        returns:
+            List[Tuple[Any, torch.LongTensor]]: sequences finished in this step.
+        """
+        finished = []
+        self._admit(finished)
+
+        active_slots = [i for i, slot in enumerate(self.slots) if slot is not None]
+        if not active_slots:
+            return finished
+        # 只计算到编号最大的活跃 slot，空闲 slot 优先复用编号小的
+        n = active_slots[-1] + 1
+        kv_len = max(self.slots[i]["cache_len"] for i in active_slots) + 1
+        y_len = max(self.slots[i]["y_len"] for i in active_slots)
+
+        model = self.model
+        position = model.ar_audio_position
+        y_emb = model.ar_audio_embedding(self.last_tokens[:n])
+        pe = position.pe[0, self.y_lens[:n] - 1].unsqueeze(1).to(dtype=y_emb.dtype, device=y_emb.device)
+        xy_pos = y_emb * position.x_scale + position.alpha * pe
+
+        cache_pos = self.cache_pos[:n]
+        attn_mask = (self.positions[:kv_len].unsqueeze(0) > cache_pos.unsqueeze(1)).view(n, 1, 1, kv_len)
+        xy_dec = model.t2s_transformer.decode_next_token_slots(
+            xy_pos,
+            [k[:n] for k in self.k_cache],
+            [v[:n] for v in self.v_cache],
+            self.rows[:n],
+            cache_pos,
+            kv_len,
+            attn_mask,
+        )
+        logits = model.ar_predict_layer(xy_dec[:, -1])
+        samples = sample(logits, self.y_buffer[:n, :y_len], **self.sampling)[0].long()
+        stop = (samples[:, 0] == model.EOS).logical_or(torch.argmax(logits, dim=-1) == model.EOS)
+
+        # 空闲 slot 的 cache_pos 为 0、y_lens 为 1，写入的内容在新序列 prefill 时被覆盖
+        self.y_buffer[self.rows[:n], self.y_lens[:n]] = samples[:, 0]
+        self.last_tokens[:n] = samples
+        self.y_lens[:n] += self.active[:n]
+        self.cache_pos[:n] += self.active[:n]
+
+        self.steps += 1
+        self.decoded_tokens += len(active_slots)
+        stop = stop.tolist()
+        for i in active_slots:
+            slot = self.slots[i]
+            slot["y_len"] += 1
+            slot["cache_len"] += 1
+            if stop[i] or slot["y_len"] - slot["prompt_len"] >= self.max_new_tokens:
+                finished.append(self._release(i))
+        return finished
+
+    def _admit(self, finished: list):
+        for i in range(self.max_slots):
+            if self.slots[i] is not None:
+                continue
+            with self._lock:
+                if not self._pending:
+                    return
+                tag, phones, prompt, bert_feature = self._pending.popleft()
+            self._prefill(i, tag, phones, prompt, bert_feature, finished)
+
+    def _prefill(self, i: int, tag: Any, phones, prompt, bert_feature, finished: list):
+        model = self.model
+        x = model.ar_text_embedding(phones.unsqueeze(0))
+        x = x + model.bert_proj(bert_feature.transpose(0, 1).unsqueeze(0))
+        x = model.ar_text_position(x)
+        y = prompt.unsqueeze(0)
+        y_pos = model.ar_audio_position(model.ar_audio_embedding(y))
+        xy_pos = torch.concat([x, y_pos], dim=1)
+
+        x_len = x.shape[1]
+        y_len = y.shape[1]
+        src_len = x_len + y_len
+        x_attn_mask = F.pad(
+            torch.zeros((x_len, x_len), dtype=torch.bool, device=x.device),
+            (0, y_len),
+            value=True,
+        )
+        y_attn_mask = F.pad(
+            torch.triu(torch.ones(y_len, y_len, dtype=torch.bool, device=x.device), diagonal=1),
+            (x_len, 0),
+            value=False,
+        )
+        attn_mask = (
+            torch.concat([x_attn_mask, y_attn_mask], dim=0)
+            .view(1, 1, src_len, src_len)
+            .expand(-1, model.num_head, -1, -1)
+        )
+        xy_dec, k_cache, v_cache = model.t2s_transformer.process_prompt(xy_pos, attn_mask, None)
+
+        self._ensure_capacity(src_len + self.max_new_tokens, y_len + self.max_new_tokens, k_cache[0])
+        for layer in range(len(k_cache)):
+            self.k_cache[layer][i, :src_len] = k_cache[layer][0]
+            self.v_cache[layer][i, :src_len] = v_cache[layer][0]
+
+        logits = model.ar_predict_layer(xy_dec[:, -1])[:, :-1]
+        samples = sample(logits, y, **self.sampling)[0]
+
+        # 用 prompt 的第一个 token 填充尾部，重复惩罚对重复出现的 token 只生效一次，不影响结果
+        self.y_buffer[i] = prompt[0]
+        self.y_buffer[i, :y_len] = prompt
+        self.y_buffer[i, y_len] = samples[0, 0]
+        self.last_tokens[i] = samples[0]
+        self.y_lens[i] = y_len + 1
+        self.cache_pos[i] = src_len
+        self.active[i] = 1
+        self.slots[i] = {"tag": tag, "prompt_len": y_len, "y_len": y_len + 1, "cache_len": src_len}
+        if self.max_new_tokens <= 1:
+            finished.append(self._release(i))
+
+    def _release(self, i: int) -> Tuple[Any, torch.LongTensor]:
+        slot = self.slots[i]
+        semantic = self.y_buffer[i, slot["prompt_len"] : slot["y_len"] - 1].clone()
+        self.slots[i] = None
+        self.active[i] = 0
+        self.cache_pos[i] = 0
+        self.y_lens[i] = 1
+        return slot["tag"], semantic
+
+    def _ensure_capacity(self, kv_capacity: int, y_capacity: int, like: torch.Tensor):
+        # 容量不够时才重新分配（按 KV_CACHE_CHUNK 取整），已有 slot 的内容拷入新缓冲区
+        if kv_capacity > self.capacity:
+            kv_capacity = round_kv_capacity(kv_capacity)
+            k_cache, v_cache = [], []
+            for layer in range(self.model.num_layers):
+                k = torch.zeros((self.max_slots, kv_capacity, like.shape[-1]), dtype=like.dtype, device=like.device)
+                v = torch.zeros_like(k)
+                if self.k_cache:
+                    k[:, : self.capacity] = self.k_cache[layer]
+                    v[:, : self.capacity] = self.v_cache[layer]
+                k_cache.append(k)
+                v_cache.append(v)
+            self.k_cache, self.v_cache = k_cache, v_cache
+            self.capacity = kv_capacity
+            self.positions = torch.arange(kv_capacity, device=like.device)
+        if y_capacity > self.y_buffer.shape[1]:
+            y_capacity = round_kv_capacity(y_capacity)
+            y_buffer = torch.zeros((self.max_slots, y_capacity), dtype=torch.long, device=like.device)
+            if self.y_buffer.shape[1] > 0:
+                # 新增的列同样用每行第一个 token 填充
+                y_buffer[:] = self.y_buffer[:, :1]
+                y_buffer[:, : self.y_buffer.shape[1]] = self.y_buffer
+            self.y_buffer = y_buffer
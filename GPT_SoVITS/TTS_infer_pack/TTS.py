@@ -5,6 +5,8 @@ import random
 import sys
 import time
 import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 
 import torchaudio
@@ -22,6 +24,7 @@ import torch
 import torch.nn.functional as F
 import yaml
 from AR.models.t2s_lightning_module import Text2SemanticLightningModule
+from AR.models.t2s_model import T2SContinuousBatcher
 from BigVGAN.bigvgan import BigVGAN
 from feature_extractor.cnhubert import CNHubert
 from module.mel_processing import mel_spectrogram_torch, spectrogram_torch
@@ -35,6 +38,8 @@ from tools.i18n.i18n import I18nAuto, scan_language_list
 from tools.my_utils import load_audio
 from TTS_infer_pack.text_segmentation_method import splits
 from TTS_infer_pack.TextPreprocessor import TextPreprocessor
+from TTS_infer_pack.prompt_feature_cache import PromptFeatureCache, make_key
+from TTS_infer_pack.bert_encoder import BERT_BACKENDS, build_bert_encoder
 from sv import SV
 resample_transform_dict={}
 def resample(audio_tensor, sr0,sr1,device):
@@ -143,6 +148,9 @@ class NO_PROMPT_ERROR(Exception):
     pass
 
 
+DEFAULT_VOICE_ID = "default"
+
+
 # configs/tts_infer.yaml
 """
 custom:
@@ -312,6 +320,34 @@ class TTS_Config:
             self.device = torch.device("cpu")
 
         self.is_half = self.configs.get("is_half", False)
+        # lazy_load: SV 模型、vocoder 延迟到第一次推理时才加载；parallel_load: 互不依赖的模型以多线程同时加载
+        self.lazy_load: bool = self.configs.get("lazy_load", False)
+        self.parallel_load: bool = self.configs.get("parallel_load", False)
+        # 参考音频/参考文本特征缓存：prompt_cache_dir 为 None 时只缓存在内存
+        self.prompt_cache_dir: str = self.configs.get("prompt_cache_dir", None)
+        self.prompt_cache_size: int = self.configs.get("prompt_cache_size", 32)
+        # 磁盘上最多保留的 .npz 文件数，超过时删除最久未使用的（0 表示不限制）
+        self.prompt_cache_disk_entries: int = self.configs.get("prompt_cache_disk_entries", 1024)
+        # 同时保留在模型中的音色数量上限（超过时淘汰最久未使用的音色）
+        self.max_voices: int = self.configs.get("max_voices", 8)
+        # 并行推理时 T2S 同时解码的序列数上限，大于 0 时启用连续批处理（结束的序列空出的位置立即由等待的句子补上）
+        self.decode_slots: int = self.configs.get("decode_slots", 0)
+        # 非并行推理时的投机解码：以 T2S 前 speculative_draft_layers 层作为草稿模型，每轮提议 speculative_tokens 个 token（0 表示关闭）
+        self.speculative_draft_layers: int = self.configs.get("speculative_draft_layers", 0)
+        self.speculative_tokens: int = self.configs.get("speculative_tokens", 4)
+        # T2S 解码每 sync_interval 步才把 EOS 状态读回主机一次（0 表示每步检查）
+        self.sync_interval: int = self.configs.get("sync_interval", 0)
+        # 一次请求的所有中文片段按长度分桶后批量提取 Bert 特征，每批最多 bert_batch_size 句
+        self.bert_batch_size: int = self.configs.get("bert_batch_size", 16)
+        # 句子级前端结果 (phones、Bert 特征、norm_text) 缓存：text_cache_size 为 0 时关闭，text_cache_dir 为 None 时只缓存在内存
+        self.text_cache_size: int = self.configs.get("text_cache_size", 256)
+        self.text_cache_dir: str = self.configs.get("text_cache_dir", None)
+        # Bert 特征模型后端：torch / truncated（只算到所需层）/ onnx / onnx_int8（ONNX Runtime CPU 推理，int8 为动态量化）
+        # onnx_int8 使用前先以实际模型运行 benchmark_frontend.py --mode bert_backend 检查精度
+        # ONNX 模型在第一次使用时导出到 bert_onnx_path（None 时放在 bert_base_path/onnx 下）
+        self.bert_backend: str = self.configs.get("bert_backend", "torch")
+        assert self.bert_backend in BERT_BACKENDS, f"bert_backend must be one of {BERT_BACKENDS}"
+        self.bert_onnx_path: str = self.configs.get("bert_onnx_path", None)
         # if str(self.device) == "cpu" and self.is_half:
         #     print(f"Warning: Half precision is not supported on CPU, set is_half to False.")
         #     self.is_half = False
@@ -379,6 +415,21 @@ class TTS_Config:
             "vits_weights_path": self.vits_weights_path,
             "bert_base_path": self.bert_base_path,
             "cnhuhbert_base_path": self.cnhuhbert_base_path,
+            "lazy_load": self.lazy_load,
+            "parallel_load": self.parallel_load,
+            "prompt_cache_dir": self.prompt_cache_dir,
+            "prompt_cache_size": self.prompt_cache_size,
+            "prompt_cache_disk_entries": self.prompt_cache_disk_entries,
+            "max_voices": self.max_voices,
+            "decode_slots": self.decode_slots,
+            "speculative_draft_layers": self.speculative_draft_layers,
+            "speculative_tokens": self.speculative_tokens,
+            "sync_interval": self.sync_interval,
+            "bert_batch_size": self.bert_batch_size,
+            "text_cache_size": self.text_cache_size,
+            "text_cache_dir": self.text_cache_dir,
+            "bert_backend": self.bert_backend,
+            "bert_onnx_path": self.bert_onnx_path,
         }
         return self.config
 
@@ -420,6 +471,8 @@ class TTS:
         self.sr_model: AP_BWE = None
         self.sv_model = None
         self.sr_model_not_exist: bool = False
+        self.pending_vocoder_version: str = None
+        self.startup_profile: dict = {}
 
         self.vocoder_configs: dict = {
             "sr": None,
@@ -432,10 +485,34 @@ class TTS:
         self._init_models()
 
         self.text_preprocessor: TextPreprocessor = TextPreprocessor(
-            self.bert_model, self.bert_tokenizer, self.configs.device
+            self.bert_model,
+            self.bert_tokenizer,
+            self.configs.device,
+            bert_batch_size=self.configs.bert_batch_size,
+            feature_cache=(
+                PromptFeatureCache(self.configs.text_cache_dir, self.configs.text_cache_size)
+                if self.configs.text_cache_size > 0
+                else None
+            ),
+            cache_signature=self._bert_cache_signature,
         )
 
-        self.prompt_cache: dict = {
+        # 每个音色 ID 对应一份 prompt_cache，self.prompt_cache 指向当前使用的音色
+        self.voice_profiles: "OrderedDict[str, dict]" = OrderedDict()
+        self.current_voice_id: str = None
+        self.prompt_cache: dict = self.select_voice(DEFAULT_VOICE_ID)
+        self.prompt_feature_cache = PromptFeatureCache(
+            self.configs.prompt_cache_dir, self.configs.prompt_cache_size, self.configs.prompt_cache_disk_entries
+        )
+
+        self.stop_flag: bool = False
+        self.precision: torch.dtype = torch.float16 if self.configs.is_half else torch.float32
+        # decode_slots > 0 时，TTSBatchScheduler 共用的常驻 T2S 连续批处理器（见 continuous_batcher()）
+        self.t2s_batcher: T2SContinuousBatcher = None
+
+    @staticmethod
+    def _new_prompt_cache() -> dict:
+        return {
             "ref_audio_path": None,
             "prompt_semantic": None,
             "refer_spec": [],
@@ -447,18 +524,124 @@ class TTS:
             "aux_ref_audio_paths": [],
         }
 
-        self.stop_flag: bool = False
-        self.precision: torch.dtype = torch.float16 if self.configs.is_half else torch.float32
+    def select_voice(self, voice_id: str) -> dict:
+        """
+        Switch the active prompt_cache to the given voice, creating an empty profile if needed.
+        Args:
+            voice_id: str, the voice ID.
+        returns:
+            dict: the prompt_cache of the voice.
+        """
+        profile = self.voice_profiles.get(voice_id)
+        if profile is None:
+            profile = self._new_prompt_cache()
+            self.voice_profiles[voice_id] = profile
+            while len(self.voice_profiles) > max(1, self.configs.max_voices):
+                evicted_id, _ = self.voice_profiles.popitem(last=False)
+                print(f"Evict voice profile: {evicted_id}")
+        else:
+            self.voice_profiles.move_to_end(voice_id)
+        self.prompt_cache = profile
+        self.current_voice_id = voice_id
+        return profile
+
+    def register_voice(
+        self,
+        voice_id: str,
+        ref_audio_path: str,
+        prompt_text: str = "",
+        prompt_lang: str = "",
+        aux_ref_audio_paths: list = None,
+    ):
+        """
+        Extract and keep the reference features of a voice, so run() can use it by voice_id only.
+        Args:
+            voice_id: str, the voice ID.
+            ref_audio_path: str, the path of the reference audio.
+            prompt_text: str, prompt text for the reference audio.
+            prompt_lang: str, language of the prompt text.
+            aux_ref_audio_paths: list, auxiliary reference audio paths.
+        """
+        self.select_voice(voice_id)
+        if ref_audio_path != self.prompt_cache["ref_audio_path"]:
+            self.set_ref_audio(ref_audio_path)
+        self._set_aux_ref_audio(aux_ref_audio_paths or [])
+        if prompt_text not in [None, ""]:
+            self._set_prompt_text(prompt_text, prompt_lang)
+
+    def _set_aux_ref_audio(self, aux_ref_audio_paths: list):
+        paths = set(aux_ref_audio_paths) & set(self.prompt_cache["aux_ref_audio_paths"])
+        if not (len(list(paths)) == len(aux_ref_audio_paths) == len(self.prompt_cache["aux_ref_audio_paths"])):
+            self.prompt_cache["aux_ref_audio_paths"] = aux_ref_audio_paths
+            self.prompt_cache["refer_spec"] = [self.prompt_cache["refer_spec"][0]]
+            for path in aux_ref_audio_paths:
+                if path in [None, ""]:
+                    continue
+                if not os.path.exists(path):
+                    print(i18n("音频文件不存在，跳过："), path)
+                    continue
+                self.prompt_cache["refer_spec"].append(self._get_ref_spec(path))
+
+    def _set_prompt_text(self, prompt_text: str, prompt_lang: str):
+        prompt_text = prompt_text.strip("\n")
+        if prompt_text[-1] not in splits:
+            prompt_text += "。" if prompt_lang != "en" else "."
+        print(i18n("实际输入的参考文本:"), prompt_text)
+        if self.prompt_cache["prompt_text"] != prompt_text or self.prompt_cache["prompt_lang"] != prompt_lang:
+            phones, bert_features, norm_text = self._get_prompt_text_features(prompt_text, prompt_lang)
+            self.prompt_cache["prompt_text"] = prompt_text
+            self.prompt_cache["prompt_lang"] = prompt_lang
+            self.prompt_cache["phones"] = phones
+            self.prompt_cache["bert_features"] = bert_features
+            self.prompt_cache["norm_text"] = norm_text
 
     def _init_models(
         self,
     ):
-        self.init_t2s_weights(self.configs.t2s_weights_path)
-        self.init_vits_weights(self.configs.vits_weights_path)
-        self.init_bert_weights(self.configs.bert_base_path)
-        self.init_cnhuhbert_weights(self.configs.cnhuhbert_base_path)
+        # init_vits_weights 会修改 configs，等所有阶段结束后再统一写回配置文件，避免与之并发写
+        stages = [
+            ("t2s", lambda path: self.init_t2s_weights(path, save=False), self.configs.t2s_weights_path),
+            ("vits", self.init_vits_weights, self.configs.vits_weights_path),
+            ("bert", self.init_bert_weights, self.configs.bert_base_path),
+            ("cnhuhbert", self.init_cnhuhbert_weights, self.configs.cnhuhbert_base_path),
+        ]
+        t0 = time.perf_counter()
+        if self.configs.parallel_load:
+            # 四组权重互不依赖，torch.load 与 from_pretrained 的 IO 会释放 GIL
+            with ThreadPoolExecutor(max_workers=len(stages), thread_name_prefix="tts-load") as executor:
+                futures = [executor.submit(self._timed_stage, name, fn, arg) for name, fn, arg in stages]
+                for future in futures:
+                    future.result()
+        else:
+            for name, fn, arg in stages:
+                self._timed_stage(name, fn, arg)
+        self.configs.save_configs()
+        self.startup_profile["total"] = time.perf_counter() - t0
+        self.print_startup_profile()
         # self.enable_half_precision(self.configs.is_half)
 
+    def _timed_stage(self, name: str, fn, *args):
+        t0 = time.perf_counter()
+        fn(*args)
+        self.startup_profile[name] = time.perf_counter() - t0
+
+    def print_startup_profile(self):
+        string = "TTS Startup Profile".center(60, "-") + "\n"
+        for name, seconds in self.startup_profile.items():
+            string += f"{name.ljust(20)}: {seconds:.2f}s\n"
+        string += "-" * 60
+        print(string)
+
+    def ensure_lazy_models(self):
+        """
+        加载 lazy_load 模式下延迟的模型（vocoder、SV 模型），已加载时直接返回
+        """
+        if self.pending_vocoder_version is not None:
+            self._timed_stage("vocoder (lazy)", self.init_vocoder, self.pending_vocoder_version)
+            self.pending_vocoder_version = None
+        if self.is_v2pro and self.sv_model is None:
+            self._timed_stage("sv (lazy)", self.init_sv_model)
+
     def init_cnhuhbert_weights(self, base_path: str):
         print(f"Loading CNHuBERT weights from {base_path}")
         self.cnhuhbert_model = CNHubert(base_path)
@@ -472,6 +655,11 @@ class TTS:
         self.bert_tokenizer = AutoTokenizer.from_pretrained(base_path)
         self.bert_model = AutoModelForMaskedLM.from_pretrained(base_path)
         self.bert_model = self.bert_model.eval()
+        if self.configs.bert_backend != "torch":
+            onnx_path = self.configs.bert_onnx_path or os.path.join(
+                base_path, "onnx", "bert_encoder_int8.onnx" if self.configs.bert_backend == "onnx_int8" else "bert_encoder.onnx"
+            )
+            self.bert_model = build_bert_encoder(self.bert_model, self.bert_tokenizer, self.configs.bert_backend, onnx_path)
         self.bert_model = self.bert_model.to(self.configs.device)
         if self.configs.is_half and str(self.configs.device) != "cpu":
             self.bert_model = self.bert_model.half()
@@ -479,7 +667,7 @@ class TTS:
     def init_vits_weights(self, weights_path: str):
         self.configs.vits_weights_path = weights_path
         version, model_version, if_lora_v3 = get_sovits_version_from_path_fast(weights_path)
-        if "Pro"in model_version:
+        if "Pro"in model_version and not self.configs.lazy_load:
             self.init_sv_model()
         path_sovits = self.configs.default_configs[model_version]["vits_weights_path"]
 
@@ -529,6 +717,7 @@ class TTS:
                 **kwargs,
             )
             self.configs.use_vocoder = False
+            self.pending_vocoder_version = None
         else:
             kwargs["version"] = model_version
             vits_model = SynthesizerTrnV3(
@@ -538,7 +727,11 @@ class TTS:
                 **kwargs,
             )
             self.configs.use_vocoder = True
-            self.init_vocoder(model_version)
+            if self.configs.lazy_load:
+                self.pending_vocoder_version = model_version
+            else:
+                self.init_vocoder(model_version)
+                self.pending_vocoder_version = None
             if "pretrained" not in weights_path and hasattr(vits_model, "enc_q"):
                 del vits_model.enc_q
 
@@ -573,10 +766,12 @@ class TTS:
         if self.configs.is_half and str(self.configs.device) != "cpu":
             self.vits_model = self.vits_model.half()
 
-    def init_t2s_weights(self, weights_path: str):
+    def init_t2s_weights(self, weights_path: str, save: bool = True):
         print(f"Loading Text2Semantic weights from {weights_path}")
         self.configs.t2s_weights_path = weights_path
-        self.configs.save_configs()
+        self.t2s_batcher = None
+        if save:
+            self.configs.save_configs()
         self.configs.hz = 50
         dict_s1 = torch.load(weights_path, map_location=self.configs.device, weights_only=False)
         config = dict_s1["config"]
@@ -676,6 +871,7 @@ class TTS:
 
         self.configs.is_half = enable
         self.precision = torch.float16 if enable else torch.float32
+        self.t2s_batcher = None
         if save:
             self.configs.save_configs()
         if enable:
@@ -708,6 +904,7 @@ class TTS:
             device: torch.device, the device to use for all models.
         """
         self.configs.device = device
+        self.t2s_batcher = None
         if save:
             self.configs.save_configs()
         if self.t2s_model is not None:
@@ -730,10 +927,83 @@ class TTS:
         Args:
             ref_audio_path: str, the path of the reference audio.
         """
-        self._set_prompt_semantic(ref_audio_path)
-        self._set_ref_spec(ref_audio_path)
+        key = make_key(
+            "ref_audio",
+            self.prompt_feature_cache.file_hash(ref_audio_path),
+            *self._feature_model_signature(),
+        )
+        entry = self.prompt_feature_cache.get(key)
+        if entry is not None:
+            self._restore_ref_audio_features(entry)
+        else:
+            self._set_prompt_semantic(ref_audio_path)
+            self._set_ref_spec(ref_audio_path)
+            self.prompt_feature_cache.put(key, self._dump_ref_audio_features())
         self._set_ref_audio_path(ref_audio_path)
 
+    def _feature_model_signature(self) -> tuple:
+        # 参考特征依赖的模型与配置，任一变化都会换用新的缓存键
+        return (
+            self.configs.version,
+            os.path.abspath(self.configs.vits_weights_path),
+            os.path.abspath(self.configs.cnhuhbert_base_path),
+            self.configs.sampling_rate,
+            self.is_v2pro,
+            self.configs.is_half,
+        )
+
+    def _dump_ref_audio_features(self) -> dict:
+        spec, audio_16k = self.prompt_cache["refer_spec"][0]
+        entry = {
+            "prompt_semantic": self.prompt_cache["prompt_semantic"].cpu().numpy(),
+            "spec": spec.cpu().numpy(),
+            "raw_audio": self.prompt_cache["raw_audio"].cpu().numpy(),
+            "raw_sr": np.array(self.prompt_cache["raw_sr"]),
+        }
+        if audio_16k is not None:
+            entry["audio_16k"] = audio_16k.cpu().numpy()
+        return entry
+
+    def _restore_ref_audio_features(self, entry: dict):
+        # torch.tensor 会复制数据，避免推理时的 in-place 操作改写缓存内容
+        device = self.configs.device
+        self.prompt_cache["prompt_semantic"] = torch.tensor(entry["prompt_semantic"], device=device)
+        spec = torch.tensor(entry["spec"], device=device)
+        audio_16k = torch.tensor(entry["audio_16k"], device=device) if "audio_16k" in entry else None
+        if self.prompt_cache["refer_spec"] in [[], None]:
+            self.prompt_cache["refer_spec"] = [(spec, audio_16k)]
+        else:
+            self.prompt_cache["refer_spec"][0] = (spec, audio_16k)
+        self.prompt_cache["raw_audio"] = torch.tensor(entry["raw_audio"], device=device)
+        self.prompt_cache["raw_sr"] = int(entry["raw_sr"])
+
+    def _bert_cache_signature(self) -> tuple:
+        # 缓存的 Bert 特征取决于模型路径、精度与后端，每次取键时读取当前配置
+        return (os.path.abspath(self.configs.bert_base_path), self.configs.is_half, self.configs.bert_backend)
+
+    def _get_prompt_text_features(self, prompt_text: str, prompt_lang: str):
+        key = make_key("prompt_text", prompt_text, prompt_lang, self.configs.version, *self._bert_cache_signature())
+        entry = self.prompt_feature_cache.get(key)
+        if entry is not None:
+            return (
+                entry["phones"].tolist(),
+                torch.tensor(entry["bert_features"], device=self.configs.device),
+                str(entry["norm_text"]),
+            )
+        phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
+            prompt_text, prompt_lang, self.configs.version
+        )
+        if phones is not None:
+            self.prompt_feature_cache.put(
+                key,
+                {
+                    "phones": np.asarray(phones, dtype=np.int64),
+                    "bert_features": bert_features.cpu().numpy(),
+                    "norm_text": np.array(norm_text),
+                },
+            )
+        return phones, bert_features, norm_text
+
     def _set_ref_audio_path(self, ref_audio_path):
         self.prompt_cache["ref_audio_path"] = ref_audio_path
 
@@ -995,6 +1265,7 @@ class TTS:
                     "repetition_penalty": 1.35    # float. repetition penalty for T2S model.
                     "sample_steps": 32,           # int. number of sampling steps for VITS model V3.
                     "super_sampling": False,       # bool. whether to use super-sampling for audio when using VITS model V3.
+                    "voice_id": None,             # str.(optional) voice profile to use, see register_voice(). ref_audio_path/prompt_text fall back to the registered ones.
                 }
         returns:
             Tuple[int, np.ndarray]: sampling rate and audio data.
@@ -1024,10 +1295,13 @@ class TTS:
         repetition_penalty = inputs.get("repetition_penalty", 1.35)
         sample_steps = inputs.get("sample_steps", 32)
         super_sampling = inputs.get("super_sampling", False)
+        voice_id = inputs.get("voice_id", None)
+
+        self.ensure_lazy_models()
 
         if parallel_infer:
             print(i18n("并行推理模式已开启"))
-            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_batch_infer
+            self.t2s_model.model.infer_panel = self._batch_infer_panel()
         else:
             print(i18n("并行推理模式已关闭"))
             self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_naive_batched
@@ -1053,6 +1327,12 @@ class TTS:
             fragment_interval = 0.01
             print(i18n("分段间隔过小，已自动设置为0.01"))
 
+        # 指定音色 ID 时使用该音色已提取的参考特征；未提供参考文本时沿用音色登记的参考文本
+        self.select_voice(voice_id if voice_id not in [None, ""] else DEFAULT_VOICE_ID)
+        if voice_id not in [None, ""] and prompt_text in [None, ""] and self.prompt_cache["prompt_text"]:
+            prompt_text = self.prompt_cache["prompt_text"]
+            prompt_lang = self.prompt_cache["prompt_lang"]
+
         no_prompt_text = False
         if prompt_text in [None, ""]:
             no_prompt_text = True
@@ -1073,38 +1353,17 @@ class TTS:
 
         ###### setting reference audio and prompt text preprocessing ########
         t0 = time.perf_counter()
-        if (ref_audio_path is not None) and (ref_audio_path != self.prompt_cache["ref_audio_path"]):
+        if (ref_audio_path not in [None, ""]) and (ref_audio_path != self.prompt_cache["ref_audio_path"]):
             if not os.path.exists(ref_audio_path):
                 raise ValueError(f"{ref_audio_path} not exists")
             self.set_ref_audio(ref_audio_path)
 
         aux_ref_audio_paths = aux_ref_audio_paths if aux_ref_audio_paths is not None else []
-        paths = set(aux_ref_audio_paths) & set(self.prompt_cache["aux_ref_audio_paths"])
-        if not (len(list(paths)) == len(aux_ref_audio_paths) == len(self.prompt_cache["aux_ref_audio_paths"])):
-            self.prompt_cache["aux_ref_audio_paths"] = aux_ref_audio_paths
-            self.prompt_cache["refer_spec"] = [self.prompt_cache["refer_spec"][0]]
-            for path in aux_ref_audio_paths:
-                if path in [None, ""]:
-                    continue
-                if not os.path.exists(path):
-                    print(i18n("音频文件不存在，跳过："), path)
-                    continue
-                self.prompt_cache["refer_spec"].append(self._get_ref_spec(path))
+        if voice_id in [None, ""] or aux_ref_audio_paths:
+            self._set_aux_ref_audio(aux_ref_audio_paths)
 
         if not no_prompt_text:
-            prompt_text = prompt_text.strip("\n")
-            if prompt_text[-1] not in splits:
-                prompt_text += "。" if prompt_lang != "en" else "."
-            print(i18n("实际输入的参考文本:"), prompt_text)
-            if self.prompt_cache["prompt_text"] != prompt_text:
-                phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
-                    prompt_text, prompt_lang, self.configs.version
-                )
-                self.prompt_cache["prompt_text"] = prompt_text
-                self.prompt_cache["prompt_lang"] = prompt_lang
-                self.prompt_cache["phones"] = phones
-                self.prompt_cache["bert_features"] = bert_features
-                self.prompt_cache["norm_text"] = norm_text
+            self._set_prompt_text(prompt_text, prompt_lang)
 
         ###### text preprocessing ########
         t1 = time.perf_counter()
@@ -1179,114 +1438,18 @@ class TTS:
 
                 batch_phones: List[torch.LongTensor] = item["phones"]
                 # batch_phones:torch.LongTensor = item["phones"]
-                batch_phones_len: torch.LongTensor = item["phones_len"]
-                all_phoneme_ids: torch.LongTensor = item["all_phones"]
-                all_phoneme_lens: torch.LongTensor = item["all_phones_len"]
-                all_bert_features: torch.LongTensor = item["all_bert_features"]
                 norm_text: str = item["norm_text"]
-                max_len = item["max_len"]
 
                 print(i18n("前端处理后的文本(每句):"), norm_text)
-                if no_prompt_text:
-                    prompt = None
-                else:
-                    prompt = (
-                        self.prompt_cache["prompt_semantic"].expand(len(all_phoneme_ids), -1).to(self.configs.device)
-                    )
-
-                print(f"############ {i18n('预测语义Token')} ############")
-                pred_semantic_list, idx_list = self.t2s_model.model.infer_panel(
-                    all_phoneme_ids,
-                    all_phoneme_lens,
-                    prompt,
-                    all_bert_features,
-                    # prompt_phone_len=ph_offset,
-                    top_k=top_k,
-                    top_p=top_p,
-                    temperature=temperature,
-                    early_stop_num=self.configs.hz * self.configs.max_sec,
-                    max_len=max_len,
-                    repetition_penalty=repetition_penalty,
+                pred_semantic_list, idx_list = self._predict_semantic(
+                    item, no_prompt_text, top_k, top_p, temperature, repetition_penalty
                 )
                 t4 = time.perf_counter()
                 t_34 += t4 - t3
 
-                refer_audio_spec = []
-                if self.is_v2pro:sv_emb=[]
-                for spec,audio_tensor in self.prompt_cache["refer_spec"]:
-                    spec=spec.to(dtype=self.precision, device=self.configs.device)
-                    refer_audio_spec.append(spec)
-                    if self.is_v2pro:
-                        sv_emb.append(self.sv_model.compute_embedding3(audio_tensor))
-
-                batch_audio_fragment = []
-
-                # ## vits并行推理 method 1
-                # pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
-                # pred_semantic_len = torch.LongTensor([item.shape[0] for item in pred_semantic_list]).to(self.configs.device)
-                # pred_semantic = self.batch_sequences(pred_semantic_list, axis=0, pad_value=0).unsqueeze(0)
-                # max_len = 0
-                # for i in range(0, len(batch_phones)):
-                #     max_len = max(max_len, batch_phones[i].shape[-1])
-                # batch_phones = self.batch_sequences(batch_phones, axis=0, pad_value=0, max_length=max_len)
-                # batch_phones = batch_phones.to(self.configs.device)
-                # batch_audio_fragment = (self.vits_model.batched_decode(
-                #         pred_semantic, pred_semantic_len, batch_phones, batch_phones_len,refer_audio_spec
-                #     ))
-                print(f"############ {i18n('合成音频')} ############")
-                if not self.configs.use_vocoder:
-                    if speed_factor == 1.0:
-                        print(f"{i18n('并行合成中')}...")
-                        # ## vits并行推理 method 2
-                        pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
-                        upsample_rate = math.prod(self.vits_model.upsample_rates)
-                        audio_frag_idx = [
-                            pred_semantic_list[i].shape[0] * 2 * upsample_rate
-                            for i in range(0, len(pred_semantic_list))
-                        ]
-                        audio_frag_end_idx = [sum(audio_frag_idx[: i + 1]) for i in range(0, len(audio_frag_idx))]
-                        all_pred_semantic = (
-                            torch.cat(pred_semantic_list).unsqueeze(0).unsqueeze(0).to(self.configs.device)
-                        )
-                        _batch_phones = torch.cat(batch_phones).unsqueeze(0).to(self.configs.device)
-                        if self.is_v2pro!=True:
-                            _batch_audio_fragment = self.vits_model.decode(all_pred_semantic, _batch_phones, refer_audio_spec, speed=speed_factor).detach()[0, 0, :]
-                        else:
-                            _batch_audio_fragment = self.vits_model.decode(all_pred_semantic, _batch_phones, refer_audio_spec, speed=speed_factor,sv_emb=sv_emb).detach()[0, 0, :]
-                        audio_frag_end_idx.insert(0, 0)
-                        batch_audio_fragment = [
-                            _batch_audio_fragment[audio_frag_end_idx[i - 1] : audio_frag_end_idx[i]]
-                            for i in range(1, len(audio_frag_end_idx))
-                        ]
-                    else:
-                        # ## vits串行推理
-                        for i, idx in enumerate(tqdm(idx_list)):
-                            phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
-                            _pred_semantic = (
-                                pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0)
-                            )  # .unsqueeze(0)#mq要多unsqueeze一次
-                            if self.is_v2pro != True:
-                                audio_fragment = self.vits_model.decode(_pred_semantic, phones, refer_audio_spec, speed=speed_factor).detach()[0, 0, :]
-                            else:
-                                audio_fragment = self.vits_model.decode(_pred_semantic, phones, refer_audio_spec, speed=speed_factor,sv_emb=sv_emb).detach()[0, 0, :]
-                            batch_audio_fragment.append(audio_fragment)  ###试试重建不带上prompt部分
-                else:
-                    if parallel_infer:
-                        print(f"{i18n('并行合成中')}...")
-                        audio_fragments = self.using_vocoder_synthesis_batched_infer(
-                            idx_list, pred_semantic_list, batch_phones, speed=speed_factor, sample_steps=sample_steps
-                        )
-                        batch_audio_fragment.extend(audio_fragments)
-                    else:
-                        for i, idx in enumerate(tqdm(idx_list)):
-                            phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
-                            _pred_semantic = (
-                                pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0)
-                            )  # .unsqueeze(0)#mq要多unsqueeze一次
-                            audio_fragment = self.using_vocoder_synthesis(
-                                _pred_semantic, phones, speed=speed_factor, sample_steps=sample_steps
-                            )
-                            batch_audio_fragment.append(audio_fragment)
+                batch_audio_fragment = self._decode_semantic(
+                    pred_semantic_list, idx_list, batch_phones, speed_factor, parallel_infer, sample_steps
+                )
 
                 t5 = time.perf_counter()
                 t_45 += t5 - t4
@@ -1338,6 +1501,275 @@ class TTS:
         finally:
             self.empty_cache()
 
+    @torch.no_grad()
+    def infer_batch(
+        self,
+        items: List[dict],
+        voice_id: str = DEFAULT_VOICE_ID,
+        top_k: int = 5,
+        top_p: float = 1,
+        temperature: float = 1,
+        repetition_penalty: float = 1.35,
+        speed_factor: float = 1.0,
+        sample_steps: int = 32,
+    ) -> List[torch.Tensor]:
+        """
+        Synthesize pre-segmented sentences of one voice in a single T2S + VITS batch.
+        The sentences may come from different requests (see TTSBatchScheduler).
+        Args:
+            items: list of {"phones", "bert_features", "norm_text"} produced by the TextPreprocessor.
+            voice_id: str, a voice registered with register_voice().
+        returns:
+            List[torch.Tensor]: one float audio fragment per item, in input order.
+        """
+        self.ensure_lazy_models()
+        self.select_voice(voice_id)
+        if self.prompt_cache["prompt_semantic"] is None or self.prompt_cache["refer_spec"] in [None, []]:
+            raise ValueError(f"voice {voice_id} is not registered, call register_voice() first")
+        no_prompt_text = self.prompt_cache["phones"] is None
+        if no_prompt_text and self.configs.use_vocoder:
+            raise NO_PROMPT_ERROR("prompt_text cannot be empty when using SoVITS_V3")
+
+        self.t2s_model.model.infer_panel = self._batch_infer_panel()
+        data, _ = self.to_batch(
+            items,
+            prompt_data=self.prompt_cache if not no_prompt_text else None,
+            batch_size=len(items),
+            split_bucket=False,
+            device=self.configs.device,
+            precision=self.precision,
+        )
+        item = data[0]
+        pred_semantic_list, idx_list = self._predict_semantic(
+            item, no_prompt_text, top_k, top_p, temperature, repetition_penalty
+        )
+        return self._decode_semantic(
+            pred_semantic_list, idx_list, item["phones"], speed_factor, True, sample_steps
+        )
+
+    def continuous_batcher(
+        self,
+        top_k: int = 5,
+        top_p: float = 1,
+        temperature: float = 1,
+        repetition_penalty: float = 1.35,
+    ) -> T2SContinuousBatcher:
+        """
+        The engine's long-lived T2SContinuousBatcher with decode_slots slots, created on first use.
+        Sequences from any request can be submitted while it decodes (see submit_semantic()); the sampling
+        parameters are shared by all slots and can only change while it is idle.
+        """
+        if self.t2s_batcher is None:
+            self.t2s_batcher = T2SContinuousBatcher(
+                self.t2s_model.model,
+                max_slots=self.configs.decode_slots,
+                top_k=top_k,
+                top_p=top_p,
+                temperature=temperature,
+                repetition_penalty=repetition_penalty,
+                early_stop_num=self.configs.hz * self.configs.max_sec,
+            )
+        else:
+            self.t2s_batcher.set_sampling(top_k, top_p, temperature, repetition_penalty)
+        return self.t2s_batcher
+
+    def submit_semantic(self, batcher: T2SContinuousBatcher, item: dict, voice_id: str = DEFAULT_VOICE_ID, tag=None):
+        """
+        Queue one pre-segmented sentence on a T2SContinuousBatcher, with the reference prompt of voice_id.
+        Args:
+            item: {"phones", "bert_features", "norm_text"} produced by the TextPreprocessor.
+            tag: returned by the batcher together with the semantic tokens.
+        """
+        self.ensure_lazy_models()
+        prompt = self.select_voice(voice_id)
+        if prompt["prompt_semantic"] is None or prompt["refer_spec"] in [None, []]:
+            raise ValueError(f"voice {voice_id} is not registered, call register_voice() first")
+        if prompt["phones"] is None:
+            raise ValueError(f"continuous decoding needs the prompt text of voice {voice_id}")
+        device = self.configs.device
+        batcher.submit(
+            torch.LongTensor(prompt["phones"] + item["phones"]).to(device),
+            prompt["prompt_semantic"].reshape(-1).to(device),
+            torch.cat([prompt["bert_features"], item["bert_features"]], 1).to(dtype=self.precision, device=device),
+            tag=tag,
+        )
+
+    def decode_semantic_tokens(
+        self,
+        items: List[dict],
+        semantic_tokens: List[torch.LongTensor],
+        voice_id: str = DEFAULT_VOICE_ID,
+        speed_factor: float = 1.0,
+        sample_steps: int = 32,
+    ) -> List[torch.Tensor]:
+        """
+        VITS (or vocoder) decode of semantic tokens returned by a T2SContinuousBatcher.
+        returns:
+            List[torch.Tensor]: one float audio fragment per item, in input order.
+        """
+        prompt = self.select_voice(voice_id)
+        prompt_semantic = prompt["prompt_semantic"].reshape(-1).to(self.configs.device)
+        # 与 infer_panel_continuous 的返回格式一致：prompt + 生成的 token，idx 为生成的 token 数
+        pred_semantic_list = [torch.concat([prompt_semantic, semantic]) for semantic in semantic_tokens]
+        idx_list = [semantic.shape[0] for semantic in semantic_tokens]
+        batch_phones = [torch.LongTensor(item["phones"]).to(self.configs.device) for item in items]
+        return self._decode_semantic(pred_semantic_list, idx_list, batch_phones, speed_factor, True, sample_steps)
+
+    def _batch_infer_panel(self):
+        model = self.t2s_model.model
+        if self.configs.decode_slots > 0:
+            return model.infer_panel_continuous
+        if self.configs.sync_interval > 0:
+            return model.infer_panel_sync_free
+        return model.infer_panel_batch_infer
+
+    @property
+    def output_sample_rate(self) -> int:
+        return self.configs.sampling_rate if not self.configs.use_vocoder else self.vocoder_configs["sr"]
+
+    def _predict_semantic(
+        self,
+        item: dict,
+        no_prompt_text: bool,
+        top_k: int,
+        top_p: float,
+        temperature: float,
+        repetition_penalty: float,
+    ):
+        """
+        Run the T2S model on one batch produced by to_batch().
+        returns:
+            Tuple[List[torch.Tensor], List[int]]: predicted semantic tokens and their lengths.
+        """
+        all_phoneme_ids: torch.LongTensor = item["all_phones"]
+        all_phoneme_lens: torch.LongTensor = item["all_phones_len"]
+        all_bert_features: torch.LongTensor = item["all_bert_features"]
+        max_len = item["max_len"]
+
+        if no_prompt_text:
+            prompt = None
+        else:
+            prompt = (
+                self.prompt_cache["prompt_semantic"].expand(len(all_phoneme_ids), -1).to(self.configs.device)
+            )
+
+        batcher = None
+        # 常驻批处理器空闲时直接复用；TTSBatchScheduler 正在使用时仍各自分配，避免取走对方的结果
+        if self.configs.decode_slots > 0 and (self.t2s_batcher is None or not self.t2s_batcher.has_work()):
+            batcher = self.continuous_batcher(top_k, top_p, temperature, repetition_penalty)
+
+        print(f"############ {i18n('预测语义Token')} ############")
+        return self.t2s_model.model.infer_panel(
+            all_phoneme_ids,
+            all_phoneme_lens,
+            prompt,
+            all_bert_features,
+            # prompt_phone_len=ph_offset,
+            top_k=top_k,
+            top_p=top_p,
+            temperature=temperature,
+            early_stop_num=self.configs.hz * self.configs.max_sec,
+            max_len=max_len,
+            repetition_penalty=repetition_penalty,
+            max_slots=self.configs.decode_slots,
+            batcher=batcher,
+            draft_layers=self.configs.speculative_draft_layers,
+            num_draft_tokens=self.configs.speculative_tokens,
+            sync_interval=self.configs.sync_interval,
+        )
+
+    def _decode_semantic(
+        self,
+        pred_semantic_list: List[torch.Tensor],
+        idx_list: List[int],
+        batch_phones: List[torch.LongTensor],
+        speed_factor: float,
+        parallel_infer: bool,
+        sample_steps: int,
+    ) -> List[torch.Tensor]:
+        """
+        Decode predicted semantic tokens into audio with VITS (or the vocoder for v3/v4).
+        returns:
+            List[torch.Tensor]: one audio fragment per sentence, in batch order.
+        """
+        refer_audio_spec = []
+        if self.is_v2pro:sv_emb=[]
+        for spec,audio_tensor in self.prompt_cache["refer_spec"]:
+            spec=spec.to(dtype=self.precision, device=self.configs.device)
+            refer_audio_spec.append(spec)
+            if self.is_v2pro:
+                sv_emb.append(self.sv_model.compute_embedding3(audio_tensor))
+
+        batch_audio_fragment = []
+
+        # ## vits并行推理 method 1
+        # pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
+        # pred_semantic_len = torch.LongTensor([item.shape[0] for item in pred_semantic_list]).to(self.configs.device)
+        # pred_semantic = self.batch_sequences(pred_semantic_list, axis=0, pad_value=0).unsqueeze(0)
+        # max_len = 0
+        # for i in range(0, len(batch_phones)):
+        #     max_len = max(max_len, batch_phones[i].shape[-1])
+        # batch_phones = self.batch_sequences(batch_phones, axis=0, pad_value=0, max_length=max_len)
+        # batch_phones = batch_phones.to(self.configs.device)
+        # batch_audio_fragment = (self.vits_model.batched_decode(
+        #         pred_semantic, pred_semantic_len, batch_phones, batch_phones_len,refer_audio_spec
+        #     ))
+        print(f"############ {i18n('合成音频')} ############")
+        if not self.configs.use_vocoder:
+            if speed_factor == 1.0:
+                print(f"{i18n('并行合成中')}...")
+                # ## vits并行推理 method 2
+                pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
+                upsample_rate = math.prod(self.vits_model.upsample_rates)
+                audio_frag_idx = [
+                    pred_semantic_list[i].shape[0] * 2 * upsample_rate
+                    for i in range(0, len(pred_semantic_list))
+                ]
+                audio_frag_end_idx = [sum(audio_frag_idx[: i + 1]) for i in range(0, len(audio_frag_idx))]
+                all_pred_semantic = (
+                    torch.cat(pred_semantic_list).unsqueeze(0).unsqueeze(0).to(self.configs.device)
+                )
+                _batch_phones = torch.cat(batch_phones).unsqueeze(0).to(self.configs.device)
+                if self.is_v2pro!=True:
+                    _batch_audio_fragment = self.vits_model.decode(all_pred_semantic, _batch_phones, refer_audio_spec, speed=speed_factor).detach()[0, 0, :]
+                else:
+                    _batch_audio_fragment = self.vits_model.decode(all_pred_semantic, _batch_phones, refer_audio_spec, speed=speed_factor,sv_emb=sv_emb).detach()[0, 0, :]
+                audio_frag_end_idx.insert(0, 0)
+                batch_audio_fragment = [
+                    _batch_audio_fragment[audio_frag_end_idx[i - 1] : audio_frag_end_idx[i]]
+                    for i in range(1, len(audio_frag_end_idx))
+                ]
+            else:
+                # ## vits串行推理
+                for i, idx in enumerate(tqdm(idx_list)):
+                    phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
+                    _pred_semantic = (
+                        pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0)
+                    )  # .unsqueeze(0)#mq要多unsqueeze一次
+                    if self.is_v2pro != True:
+                        audio_fragment = self.vits_model.decode(_pred_semantic, phones, refer_audio_spec, speed=speed_factor).detach()[0, 0, :]
+                    else:
+                        audio_fragment = self.vits_model.decode(_pred_semantic, phones, refer_audio_spec, speed=speed_factor,sv_emb=sv_emb).detach()[0, 0, :]
+                    batch_audio_fragment.append(audio_fragment)  ###试试重建不带上prompt部分
+        else:
+            if parallel_infer:
+                print(f"{i18n('并行合成中')}...")
+                audio_fragments = self.using_vocoder_synthesis_batched_infer(
+                    idx_list, pred_semantic_list, batch_phones, speed=speed_factor, sample_steps=sample_steps
+                )
+                batch_audio_fragment.extend(audio_fragments)
+            else:
+                for i, idx in enumerate(tqdm(idx_list)):
+                    phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
+                    _pred_semantic = (
+                        pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0)
+                    )  # .unsqueeze(0)#mq要多unsqueeze一次
+                    audio_fragment = self.using_vocoder_synthesis(
+                        _pred_semantic, phones, speed=speed_factor, sample_steps=sample_steps
+                    )
+                    batch_audio_fragment.append(audio_fragment)
+        return batch_audio_fragment
+
     def empty_cache(self):
         try:
             gc.collect()  # 触发gc的垃圾回收。避免内存一直增长。
@@ -8,14 +8,18 @@ now_dir = os.getcwd()
 sys.path.append(now_dir)
 
 import re
+import numpy as np
 import torch
 from text.LangSegmenter import LangSegmenter
 from text import chinese
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, List, Tuple, Union
 from text.cleaner import clean_text
 from text import cleaned_text_to_sequence
+from text.bert_feature import phone_level_feature
 from transformers import AutoModelForMaskedLM, AutoTokenizer
 from TTS_infer_pack.text_segmentation_method import split_big_text, splits, get_method as get_seg_method
+from TTS_infer_pack.prompt_feature_cache import PromptFeatureCache, make_key
+from TTS_infer_pack.bert_encoder import bert_hidden_state
 
 from tools.i18n.i18n import I18nAuto, scan_language_list
 
@@ -49,12 +53,47 @@ def merge_short_text_in_array(texts: str, threshold: int) -> list:
     return result
 
 
+def bucket_by_length(lengths: List[int], max_batch_size: int, max_batch_tokens: int) -> List[List[int]]:
+    """
+    Group indices into batches of similar length (sorted by length), so padding stays small.
+    A batch holds at most max_batch_size items and max_batch_tokens padded tokens.
+    """
+    buckets = []
+    bucket = []
+    for index in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # 按长度升序，当前项就是这一批的最大长度
+        if bucket and (len(bucket) >= max_batch_size or lengths[index] * (len(bucket) + 1) > max_batch_tokens):
+            buckets.append(bucket)
+            bucket = []
+        bucket.append(index)
+    if bucket:
+        buckets.append(bucket)
+    return buckets
+
+
 class TextPreprocessor:
-    def __init__(self, bert_model: AutoModelForMaskedLM, tokenizer: AutoTokenizer, device: torch.device):
+    def __init__(
+        self,
+        bert_model: AutoModelForMaskedLM,
+        tokenizer: AutoTokenizer,
+        device: torch.device,
+        bert_batch_size: int = 16,
+        bert_batch_tokens: int = 4096,
+        feature_cache: PromptFeatureCache = None,
+        cache_signature: Union[tuple, Callable[[], tuple]] = (),
+    ):
         self.bert_model = bert_model
         self.tokenizer = tokenizer
         self.device = device
         self.bert_lock = threading.RLock()
+        # 批量提取 Bert 特征时每批的最大句数与 padding 后的最大 token 数
+        self.bert_batch_size = bert_batch_size
+        self.bert_batch_tokens = bert_batch_tokens
+        # 句子级前端结果缓存 (phones, bert_features, norm_text)，None 表示不缓存；
+        # cache_signature 为 Bert 模型路径、精度等，变化时换用新的缓存键；
+        # 传入函数时每次取键都重新读取，运行中切换精度后不会命中旧精度的特征
+        self.feature_cache = feature_cache
+        self.cache_signature = cache_signature
 
     def preprocess(self, text: str, lang: str, text_split_method: str, version: str = "v2") -> List[Dict]:
         print(f"############ {i18n('切分文本')} ############")
@@ -62,8 +101,7 @@ class TextPreprocessor:
         texts = self.pre_seg_text(text, lang, text_split_method)
         result = []
         print(f"############ {i18n('提取文本Bert特征')} ############")
-        for text in tqdm(texts):
-            phones, bert_features, norm_text = self.segment_and_extract_feature_for_text(text, lang, version)
+        for phones, bert_features, norm_text in self.get_phones_and_bert_batch(texts, lang, version):
             if phones is None or norm_text == "":
                 continue
             res = {
@@ -121,85 +159,195 @@ class TextPreprocessor:
 
     def get_phones_and_bert(self, text: str, language: str, version: str, final: bool = False):
         with self.bert_lock:
-            if language in {"en", "all_zh", "all_ja", "all_ko", "all_yue"}:
-                # language = language.replace("all_","")
-                formattext = text
-                while "  " in formattext:
-                    formattext = formattext.replace("  ", " ")
-                if language == "all_zh":
-                    if re.search(r"[A-Za-z]", formattext):
-                        formattext = re.sub(r"[a-z]", lambda x: x.group(0).upper(), formattext)
-                        formattext = chinese.mix_text_normalize(formattext)
-                        return self.get_phones_and_bert(formattext, "zh", version)
-                    else:
-                        phones, word2ph, norm_text = self.clean_text_inf(formattext, language, version)
-                        bert = self.get_bert_feature(norm_text, word2ph).to(self.device)
-                elif language == "all_yue" and re.search(r"[A-Za-z]", formattext):
+            key = self.cache_key(text, language, version, final)
+            result = self.cache_get(key)
+            if result is None:
+                segments = self.get_phone_segments(text, language, version, final)
+                features = self.get_bert_feature_batch([(seg[2], seg[1]) for seg in segments if seg[3]])
+                result = self.merge_segments(segments, features)
+                self.cache_put(key, result)
+            return result
+
+    def get_phones_and_bert_batch(self, texts: List[str], language: str, version: str):
+        """
+        get_phones_and_bert() for all sentences of a request: G2P runs per sentence, then the Bert features
+        of every Chinese segment are extracted together in length-bucketed batches.
+        returns:
+            List[Tuple[list, torch.Tensor, str]]: (phones, bert_features, norm_text) per sentence.
+        """
+        with self.bert_lock:
+            keys = [self.cache_key(text, language, version) for text in texts]
+            result = [self.cache_get(key) for key in keys]
+            # 只有未命中缓存的句子需要 G2P 与 Bert
+            misses = [i for i in range(len(texts)) if result[i] is None]
+            self.prefetch_g2p([texts[i] for i in misses], language, version)
+            segments_list = [self.get_phone_segments(texts[i], language, version) for i in tqdm(misses)]
+            features = self.get_bert_feature_batch(
+                [(seg[2], seg[1]) for segments in segments_list for seg in segments if seg[3]]
+            )
+            offset = 0
+            for i, segments in zip(misses, segments_list):
+                n_bert = sum(1 for seg in segments if seg[3])
+                result[i] = self.merge_segments(segments, features[offset : offset + n_bert])
+                self.cache_put(keys[i], result[i])
+                offset += n_bert
+            return result
+
+    def prefetch_g2p(self, texts: List[str], language: str, version: str):
+        # 中文多音字的 g2pW 推理对整个请求的句子一次完成，之后逐句 G2P 直接命中缓存
+        if version == "v1" or language not in {"zh", "all_zh"} or len(texts) < 2:
+            return
+        from text import chinese2
+
+        chinese2.prefetch(texts)
+
+    def cache_key(self, text: str, language: str, version: str, final: bool = False) -> str:
+        signature = self.cache_signature() if callable(self.cache_signature) else self.cache_signature
+        return make_key("text", text, language, version, final, *signature)
+
+    def cache_get(self, key: str):
+        if self.feature_cache is None:
+            return None
+        entry = self.feature_cache.get(key)
+        if entry is None:
+            return None
+        # torch.tensor 会复制数据，避免推理时的 in-place 操作改写缓存内容
+        return (
+            entry["phones"].tolist(),
+            torch.tensor(entry["bert_features"], device=self.device),
+            str(entry["norm_text"]),
+        )
+
+    def cache_put(self, key: str, result: tuple):
+        phones, bert_features, norm_text = result
+        if self.feature_cache is None or phones is None:
+            return
+        # 在 CPU 上 numpy() 与返回给调用方的 tensor 共用内存，需要复制
+        self.feature_cache.put(
+            key,
+            {
+                "phones": np.asarray(phones, dtype=np.int64),
+                "bert_features": bert_features.cpu().numpy().copy(),
+                "norm_text": np.array(norm_text),
+            },
+        )
+
+    def get_phone_segments(self, text: str, language: str, version: str, final: bool = False) -> List[tuple]:
+        """
+        Text normalization + G2P of one sentence, split into language segments.
+        returns:
+            List[tuple]: (phones, word2ph, norm_text, needs_bert) per segment, needs_bert is True for Chinese.
+        """
+        if language in {"en", "all_zh", "all_ja", "all_ko", "all_yue"}:
+            # language = language.replace("all_","")
+            formattext = text
+            while "  " in formattext:
+                formattext = formattext.replace("  ", " ")
+            if language == "all_zh":
+                if re.search(r"[A-Za-z]", formattext):
                     formattext = re.sub(r"[a-z]", lambda x: x.group(0).upper(), formattext)
                     formattext = chinese.mix_text_normalize(formattext)
-                    return self.get_phones_and_bert(formattext, "yue", version)
+                    return self.get_phone_segments(formattext, "zh", version)
                 else:
                     phones, word2ph, norm_text = self.clean_text_inf(formattext, language, version)
-                    bert = torch.zeros(
-                        (1024, len(phones)),
-                        dtype=torch.float32,
-                    ).to(self.device)
-            elif language in {"zh", "ja", "ko", "yue", "auto", "auto_yue"}:
-                textlist = []
-                langlist = []
-                if language == "auto":
-                    for tmp in LangSegmenter.getTexts(text):
-                        langlist.append(tmp["lang"])
-                        textlist.append(tmp["text"])
-                elif language == "auto_yue":
-                    for tmp in LangSegmenter.getTexts(text):
-                        if tmp["lang"] == "zh":
-                            tmp["lang"] = "yue"
+                    segments = [(phones, word2ph, norm_text, True)]
+            elif language == "all_yue" and re.search(r"[A-Za-z]", formattext):
+                formattext = re.sub(r"[a-z]", lambda x: x.group(0).upper(), formattext)
+                formattext = chinese.mix_text_normalize(formattext)
+                return self.get_phone_segments(formattext, "yue", version)
+            else:
+                phones, word2ph, norm_text = self.clean_text_inf(formattext, language, version)
+                segments = [(phones, word2ph, norm_text, False)]
+        elif language in {"zh", "ja", "ko", "yue", "auto", "auto_yue"}:
+            textlist = []
+            langlist = []
+            if language == "auto":
+                for tmp in LangSegmenter.getTexts(text):
+                    langlist.append(tmp["lang"])
+                    textlist.append(tmp["text"])
+            elif language == "auto_yue":
+                for tmp in LangSegmenter.getTexts(text):
+                    if tmp["lang"] == "zh":
+                        tmp["lang"] = "yue"
+                    langlist.append(tmp["lang"])
+                    textlist.append(tmp["text"])
+            else:
+                for tmp in LangSegmenter.getTexts(text):
+                    if tmp["lang"] == "en":
                         langlist.append(tmp["lang"])
-                        textlist.append(tmp["text"])
-                else:
-                    for tmp in LangSegmenter.getTexts(text):
-                        if tmp["lang"] == "en":
-                            langlist.append(tmp["lang"])
-                        else:
-                            # 因无法区别中日韩文汉字,以用户输入为准
-                            langlist.append(language)
-                        textlist.append(tmp["text"])
-                # print(textlist)
-                # print(langlist)
-                phones_list = []
-                bert_list = []
-                norm_text_list = []
-                for i in range(len(textlist)):
-                    lang = langlist[i]
-                    phones, word2ph, norm_text = self.clean_text_inf(textlist[i], lang, version)
-                    bert = self.get_bert_inf(phones, word2ph, norm_text, lang)
-                    phones_list.append(phones)
-                    norm_text_list.append(norm_text)
-                    bert_list.append(bert)
-                bert = torch.cat(bert_list, dim=1)
-                phones = sum(phones_list, [])
-                norm_text = "".join(norm_text_list)
-
-            if not final and len(phones) < 6:
-                return self.get_phones_and_bert("." + text, language, version, final=True)
-
-            return phones, bert, norm_text
+                    else:
+                        # 因无法区别中日韩文汉字,以用户输入为准
+                        langlist.append(language)
+                    textlist.append(tmp["text"])
+            # print(textlist)
+            # print(langlist)
+            segments = []
+            for i in range(len(textlist)):
+                lang = langlist[i]
+                phones, word2ph, norm_text = self.clean_text_inf(textlist[i], lang, version)
+                segments.append((phones, word2ph, norm_text, lang.replace("all_", "") == "zh"))
+
+        if not final and sum(len(seg[0]) for seg in segments) < 6:
+            return self.get_phone_segments("." + text, language, version, final=True)
+
+        return segments
+
+    def merge_segments(self, segments: List[tuple], features: List[torch.Tensor]):
+        """
+        Concatenate the segments of one sentence; features holds the Bert features of the segments with needs_bert.
+        returns:
+            Tuple[list, torch.Tensor, str]: phones, bert_features [1024, n_phones], norm_text
+        """
+        features = iter(features)
+        bert_list = []
+        for phones, word2ph, norm_text, needs_bert in segments:
+            if needs_bert:
+                bert_list.append(next(features).to(self.device))
+            else:
+                bert_list.append(torch.zeros((1024, len(phones)), dtype=torch.float32).to(self.device))
+        bert = bert_list[0] if len(bert_list) == 1 else torch.cat(bert_list, dim=1)
+        phones = sum((seg[0] for seg in segments), [])
+        norm_text = "".join(seg[2] for seg in segments)
+        return phones, bert, norm_text
 
     def get_bert_feature(self, text: str, word2ph: list) -> torch.Tensor:
+        return self.get_bert_feature_batch([(text, word2ph)])[0]
+
+    def get_bert_feature_batch(self, items: List[Tuple[str, list]]) -> List[torch.Tensor]:
+        """
+        Phone-level Bert features of several texts, one padded forward per length bucket.
+        Args:
+            items: list of (norm_text, word2ph).
+        returns:
+            List[torch.Tensor]: [1024, n_phones] per item, in input order.
+        """
+        if len(items) == 0:
+            return []
+        input_ids = [self.tokenizer(text)["input_ids"] for text, _ in items]
+        lengths = [len(ids) for ids in input_ids]
+        pad_id = self.tokenizer.pad_token_id or 0
+        features = [None] * len(items)
         with torch.no_grad():
-            inputs = self.tokenizer(text, return_tensors="pt")
-            for i in inputs:
-                inputs[i] = inputs[i].to(self.device)
-            res = self.bert_model(**inputs, output_hidden_states=True)
-            res = torch.cat(res["hidden_states"][-3:-2], -1)[0].cpu()[1:-1]
-        assert len(word2ph) == len(text)
-        phone_level_feature = []
-        for i in range(len(word2ph)):
-            repeat_feature = res[i].repeat(word2ph[i], 1)
-            phone_level_feature.append(repeat_feature)
-        phone_level_feature = torch.cat(phone_level_feature, dim=0)
-        return phone_level_feature.T
+            for bucket in bucket_by_length(lengths, self.bert_batch_size, self.bert_batch_tokens):
+                max_len = max(lengths[i] for i in bucket)
+                ids = torch.full((len(bucket), max_len), pad_id, dtype=torch.long)
+                attention_mask = torch.zeros((len(bucket), max_len), dtype=torch.long)
+                for row, i in enumerate(bucket):
+                    ids[row, : lengths[i]] = torch.tensor(input_ids[i], dtype=torch.long)
+                    attention_mask[row, : lengths[i]] = 1
+                hidden = bert_hidden_state(
+                    self.bert_model,
+                    ids.to(self.device),
+                    attention_mask.to(self.device),
+                    torch.zeros_like(ids).to(self.device),
+                ).cpu()
+                for row, i in enumerate(bucket):
+                    text, word2ph = items[i]
+                    # 去掉 [CLS]/[SEP] 与右侧 padding
+                    token_features = hidden[row, 1 : lengths[i] - 1]
+                    assert len(word2ph) == len(text)
+                    features[i] = phone_level_feature(token_features, word2ph)
+        return features
 
     def clean_text_inf(self, text: str, language: str, version: str = "v2"):
         language = language.replace("all_", "")
@@ -0,0 +1,337 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+@dataclass
+class _Request:
+    future: Future
+    fragments: list
+    remaining: int
+    speed_factor: float
+    fragment_interval: float
+
+
+@dataclass
+class _Sentence:
+    request: _Request
+    index: int
+    data: dict
+    key: tuple
+    enqueued_at: float
+
+
+class TTSBatchScheduler:
+    """
+    Dynamic batching in front of TTS.
+
+    Concurrent requests are split into sentences on the caller's thread (G2P + BERT), then a single
+    worker thread collects sentences that share a voice and sampling parameters for up to max_wait_ms
+    (or until max_batch_size sentences are queued), runs them through TTS.infer_batch() in one
+    T2S + VITS batch, and routes each fragment back to its request. A request's future resolves
+    once all of its sentences have been decoded.
+
+    With tts.configs.decode_slots > 0 the worker instead feeds the engine's long-lived
+    T2SContinuousBatcher (TTS.continuous_batcher()): queued sentences are admitted between decode
+    steps as soon as they arrive, and each finished sentence is VITS-decoded and routed back without
+    waiting for the rest of the batch.
+    """
+
+    def __init__(self, tts, max_batch_size: int = 8, max_wait_ms: float = 20, lock=None):
+        """
+        Args:
+            tts: TTS_infer_pack.TTS instance.
+            max_batch_size: int, max sentences per batch.
+            max_wait_ms: float, how long the oldest queued sentence may wait for the batch to fill.
+            lock: the lock guarding the TTS instance, shared with other callers of TTS.run().
+        """
+        self.tts = tts
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.lock = lock or threading.RLock()
+
+        self._pending: Deque[_Sentence] = deque()
+        self._cond = threading.Condition()
+        self._running = True
+        self._registered = set()
+        # 连续批处理模式下正在 T2S 解码的句子，以 tag 索引
+        self._decoding: Dict[int, _Sentence] = {}
+        self._next_tag = 0
+        self._batcher = None
+
+        self.batches = 0
+        self.sentences = 0
+        self.requests = 0
+
+        self._worker = threading.Thread(target=self._loop, name="tts-batch-scheduler", daemon=True)
+        self._worker.start()
+
+    def register_voice(
+        self,
+        voice_id: str,
+        ref_audio_path: str,
+        prompt_text: str = "",
+        prompt_lang: str = "",
+        aux_ref_audio_paths: list = None,
+    ):
+        """
+        Register a voice on the TTS instance (see TTS.register_voice). Already registered voices are skipped.
+        """
+        if voice_id in self._registered and voice_id in self.tts.voice_profiles:
+            return
+        with self.lock:
+            self.tts.register_voice(voice_id, ref_audio_path, prompt_text, prompt_lang, aux_ref_audio_paths)
+        self._registered.add(voice_id)
+
+    def submit(
+        self,
+        text: str,
+        text_lang: str,
+        voice_id: str = "default",
+        text_split_method: str = "cut5",
+        top_k: int = 5,
+        top_p: float = 1,
+        temperature: float = 1,
+        repetition_penalty: float = 1.35,
+        speed_factor: float = 1.0,
+        sample_steps: int = 32,
+        fragment_interval: float = 0.3,
+    ) -> Future:
+        """
+        Queue a request.
+        returns:
+            Future: resolves to Tuple[int, np.ndarray], the sampling rate and int16 audio.
+        """
+        future = Future()
+        items = self.tts.text_preprocessor.preprocess(text, text_lang, text_split_method, self.tts.configs.version)
+        if len(items) == 0:
+            future.set_result((16000, np.zeros(int(16000), dtype=np.int16)))
+            return future
+
+        key = (voice_id, top_k, top_p, temperature, repetition_penalty, speed_factor, sample_steps)
+        request = _Request(
+            future=future,
+            fragments=[None] * len(items),
+            remaining=len(items),
+            speed_factor=speed_factor,
+            fragment_interval=fragment_interval,
+        )
+        now = time.perf_counter()
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("TTSBatchScheduler has been shut down")
+            self.requests += 1
+            for index, data in enumerate(items):
+                self._pending.append(_Sentence(request, index, data, key, now))
+            self._cond.notify()
+        return future
+
+    def synthesize(self, text: str, text_lang: str, **kwargs) -> Tuple[int, np.ndarray]:
+        """
+        Blocking version of submit().
+        """
+        return self.submit(text, text_lang, **kwargs).result()
+
+    def shutdown(self):
+        with self._cond:
+            self._running = False
+            pending, self._pending = self._pending, deque()
+            self._cond.notify_all()
+        for sentence in pending:
+            if not sentence.request.future.done():
+                sentence.request.future.set_exception(RuntimeError("TTSBatchScheduler has been shut down"))
+        self._worker.join()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "requests": self.requests,
+                "batches": self.batches,
+                "sentences": self.sentences,
+                "avg_batch_size": round(self.sentences / self.batches, 2) if self.batches else 0.0,
+                "pending_sentences": len(self._pending),
+                "decoding_sentences": len(self._decoding),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+    def _next_batch(self) -> Optional[List[_Sentence]]:
+        with self._cond:
+            while self._running and not self._pending:
+                self._cond.wait()
+            if not self._pending:
+                return None
+
+            # 以最早进入队列的句子为准，等待同音色、同参数的句子凑满一批或超时
+            key = self._pending[0].key
+            deadline = self._pending[0].enqueued_at + self.max_wait
+            while self._running:
+                ready = sum(1 for sentence in self._pending if sentence.key == key)
+                remaining = deadline - time.perf_counter()
+                if ready >= self.max_batch_size or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch, rest = [], deque()
+            for sentence in self._pending:
+                if sentence.key == key and len(batch) < self.max_batch_size:
+                    batch.append(sentence)
+                else:
+                    rest.append(sentence)
+            self._pending = rest
+            return batch
+
+    def _loop(self):
+        if self.tts.configs.decode_slots > 0:
+            self._continuous_loop()
+            return
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._run_batch(batch)
+
+    def _continuous_loop(self):
+        while True:
+            with self._cond:
+                while self._running and not self._pending and not self._decoding:
+                    self._cond.wait()
+                if not self._running:
+                    break
+            self._admit()
+            if self._decoding:
+                self._step()
+            elif not self._pending:
+                with self.lock:
+                    self.tts.empty_cache()
+
+        if self._batcher is not None:
+            with self.lock:
+                self._batcher.reset()
+        self._fail(list(self._decoding.values()), RuntimeError("TTSBatchScheduler has been shut down"))
+        self._decoding.clear()
+
+    def _admit(self):
+        # 采样参数由所有 slot 共用：只接纳与批处理器当前参数相同的句子；
+        # 最早的句子参数不同时停止接纳，等在解码的句子结束后再切换，避免其一直等待
+        with self._cond:
+            if not self._pending:
+                return
+            sampling = self._pending[0].key[1:5]
+            if self._decoding and sampling != tuple(self._batcher.sampling.values()):
+                return
+            admitted, rest = [], deque()
+            for sentence in self._pending:
+                (admitted if sentence.key[1:5] == sampling else rest).append(sentence)
+            self._pending = rest
+
+        with self.lock:
+            if not self._decoding:
+                try:
+                    self._batcher = self.tts.continuous_batcher(*sampling)
+                except Exception as e:
+                    self._fail(admitted, e)
+                    return
+            for sentence in admitted:
+                try:
+                    self.tts.submit_semantic(self._batcher, sentence.data, sentence.key[0], tag=self._next_tag)
+                except Exception as e:
+                    self._fail([sentence], e)
+                    continue
+                self._decoding[self._next_tag] = sentence
+                self._next_tag += 1
+
+    def _step(self):
+        try:
+            with self.lock:
+                finished = self._batcher.step()
+        except Exception as e:
+            with self.lock:
+                self._batcher.reset()
+            self._fail(list(self._decoding.values()), e)
+            self._decoding.clear()
+            return
+
+        # 同音色、同语速、同采样步数的句子一起做 VITS 解码
+        groups: Dict[tuple, list] = {}
+        for tag, semantic in finished:
+            sentence = self._decoding.pop(tag)
+            voice_id, speed_factor, sample_steps = sentence.key[0], sentence.key[5], sentence.key[6]
+            groups.setdefault((voice_id, speed_factor, sample_steps), []).append((sentence, semantic))
+        for (voice_id, speed_factor, sample_steps), group in groups.items():
+            sentences = [sentence for sentence, _ in group]
+            try:
+                with self.lock:
+                    fragments = self.tts.decode_semantic_tokens(
+                        [sentence.data for sentence in sentences],
+                        [semantic for _, semantic in group],
+                        voice_id=voice_id,
+                        speed_factor=speed_factor,
+                        sample_steps=sample_steps,
+                    )
+                    sr = self.tts.output_sample_rate
+            except Exception as e:
+                self._fail(sentences, e)
+                continue
+            with self._cond:
+                self.batches += 1
+                self.sentences += len(sentences)
+            self._deliver(sentences, fragments, sr)
+
+    def _fail(self, sentences: List[_Sentence], error: Exception):
+        for sentence in sentences:
+            if not sentence.request.future.done():
+                sentence.request.future.set_exception(error)
+
+    def _run_batch(self, batch: List[_Sentence]):
+        voice_id, top_k, top_p, temperature, repetition_penalty, speed_factor, sample_steps = batch[0].key
+        try:
+            with self.lock:
+                fragments = self.tts.infer_batch(
+                    [sentence.data for sentence in batch],
+                    voice_id=voice_id,
+                    top_k=top_k,
+                    top_p=top_p,
+                    temperature=temperature,
+                    repetition_penalty=repetition_penalty,
+                    speed_factor=speed_factor,
+                    sample_steps=sample_steps,
+                )
+                sr = self.tts.output_sample_rate
+                self.tts.empty_cache()
+        except Exception as e:
+            self._fail(batch, e)
+            return
+
+        with self._cond:
+            self.batches += 1
+            self.sentences += len(batch)
+        self._deliver(batch, fragments, sr)
+
+    def _deliver(self, sentences: List[_Sentence], fragments: list, sr: int):
+        for sentence, fragment in zip(sentences, fragments):
+            request = sentence.request
+            if request.future.done():
+                continue
+            request.fragments[sentence.index] = fragment
+            request.remaining -= 1
+            if request.remaining == 0:
+                try:
+                    request.future.set_result(
+                        self.tts.audio_postprocess(
+                            [request.fragments],
+                            sr,
+                            None,
+                            request.speed_factor,
+                            False,
+                            request.fragment_interval,
+                            False,
+                        )
+                    )
+                except Exception as e:
+                    request.future.set_exception(e)
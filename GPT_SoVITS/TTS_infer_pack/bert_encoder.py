@@ -0,0 +1,155 @@
+import os
+from typing import Optional
+
+import numpy as np
+import torch
+from torch import nn
+
+# bert_backend 的可选值：
+#   torch: 完整的 AutoModelForMaskedLM（输出全部 hidden_states 后取 [-3]）
+#   truncated: 只保留到所需层的 PyTorch 编码器
+#   onnx / onnx_int8: 截断编码器导出为 ONNX，由 ONNX Runtime 在 CPU 上推理（int8 为动态量化）
+BERT_BACKENDS = ["torch", "truncated", "onnx", "onnx_int8"]
+
+
+class TruncatedBertEncoder(nn.Module):
+    """
+    The embeddings and the encoder layers of a BertForMaskedLM up to the one whose output is hidden_states[-3],
+    which is all the TTS frontend uses. The last two layers and the MLM head are dropped.
+    """
+
+    def __init__(self, bert_model: nn.Module, hidden_state_index: int = -3):
+        super().__init__()
+        bert = bert_model.bert
+        layers = bert.encoder.layer
+        # hidden_states 第 0 项为 embedding 输出，第 i 项为第 i 层输出
+        num_layers = len(layers) + 1 + hidden_state_index if hidden_state_index < 0 else hidden_state_index
+        self.embeddings = bert.embeddings
+        self.layers = nn.ModuleList(layers[:num_layers])
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor, token_type_ids: torch.Tensor):
+        x = self.embeddings(input_ids=input_ids, token_type_ids=token_type_ids)
+        mask = (1.0 - attention_mask[:, None, None, :].to(x.dtype)) * torch.finfo(x.dtype).min
+        for layer in self.layers:
+            # transformers 4.x 的 BertLayer 返回 tuple，5.x 直接返回 hidden_states
+            x = layer(x, attention_mask=mask)
+            x = x[0] if isinstance(x, tuple) else x
+        return x
+
+
+class OnnxBertEncoder:
+    """
+    ONNX Runtime session of an exported TruncatedBertEncoder, called like the PyTorch encoder.
+    Always runs in float32 on CPU, so half()/float()/to() are no-ops.
+    """
+
+    def __init__(self, onnx_path: str, num_threads: int = 0):
+        import onnxruntime
+
+        sess_options = onnxruntime.SessionOptions()
+        sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            sess_options.intra_op_num_threads = num_threads
+        self.onnx_path = onnx_path
+        self.session = onnxruntime.InferenceSession(onnx_path, sess_options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, input_ids: torch.Tensor, attention_mask: torch.Tensor, token_type_ids: torch.Tensor):
+        outputs = self.session.run(
+            None,
+            {
+                "input_ids": input_ids.cpu().numpy().astype(np.int64),
+                "attention_mask": attention_mask.cpu().numpy().astype(np.int64),
+                "token_type_ids": token_type_ids.cpu().numpy().astype(np.int64),
+            },
+        )
+        return torch.from_numpy(outputs[0])
+
+    def eval(self):
+        return self
+
+    def half(self):
+        return self
+
+    def float(self):
+        return self
+
+    def to(self, *args, **kwargs):
+        return self
+
+
+def export_bert_onnx(bert_model: nn.Module, tokenizer, onnx_path: str, quantize: bool = False, opset_version: int = 17):
+    """
+    Export the truncated encoder of bert_model to onnx_path, optionally followed by dynamic int8 quantization.
+    Args:
+        bert_model: AutoModelForMaskedLM (float32).
+        tokenizer: the matching AutoTokenizer, used for the example input.
+        onnx_path: str, output path (the float32 model is written to onnx_path.replace(".onnx", "_fp32.onnx")
+            first when quantize is True).
+    returns:
+        str: onnx_path
+    """
+    encoder = TruncatedBertEncoder(bert_model).float().cpu().eval()
+    inputs = tokenizer("测试一下导出。", return_tensors="pt")
+    fp32_path = onnx_path.replace(".onnx", "_fp32.onnx") if quantize else onnx_path
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            encoder,
+            (inputs["input_ids"], inputs["attention_mask"], inputs["token_type_ids"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "tokens"},
+                "attention_mask": {0: "batch", 1: "tokens"},
+                "token_type_ids": {0: "batch", 1: "tokens"},
+                "hidden_state": {0: "batch", 1: "tokens"},
+            },
+            opset_version=opset_version,
+        )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(fp32_path, onnx_path, weight_type=QuantType.QInt8)
+    return onnx_path
+
+
+def build_bert_encoder(
+    bert_model: nn.Module,
+    tokenizer,
+    backend: str,
+    onnx_path: Optional[str] = None,
+    num_threads: int = 0,
+):
+    """
+    Wrap a loaded AutoModelForMaskedLM according to backend (see BERT_BACKENDS).
+    The ONNX model is exported to onnx_path on first use and reused afterwards.
+    returns:
+        the model for TextPreprocessor: bert_model itself for "torch", otherwise an encoder returning hidden_states[-3].
+    """
+    assert backend in BERT_BACKENDS, f"unknown bert_backend: {backend}"
+    if backend == "torch":
+        return bert_model
+    if backend == "truncated":
+        return TruncatedBertEncoder(bert_model).eval()
+    if not os.path.exists(onnx_path):
+        print(f"Exporting BERT encoder to {onnx_path}")
+        export_bert_onnx(bert_model, tokenizer, onnx_path, quantize=backend == "onnx_int8")
+    return OnnxBertEncoder(onnx_path, num_threads)
+
+
+def bert_hidden_state(
+    bert_model, input_ids: torch.Tensor, attention_mask: torch.Tensor, token_type_ids: torch.Tensor
+) -> torch.Tensor:
+    """
+    hidden_states[-3] of the Bert model, [batch, tokens, 1024], whatever the backend.
+    """
+    if isinstance(bert_model, (TruncatedBertEncoder, OnnxBertEncoder)):
+        return bert_model(input_ids, attention_mask, token_type_ids)
+    res = bert_model(
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        token_type_ids=token_type_ids,
+        output_hidden_states=True,
+    )
+    return res["hidden_states"][-3]
@@ -0,0 +1,167 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def make_key(*parts) -> str:
+    return hashlib.sha256("\x00".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+class PromptFeatureCache:
+    """
+    Cache for reference-prompt features (prompt_semantic, refer_spec, phones, bert features...).
+
+    Entries are dicts of numpy arrays kept in an in-memory LRU and, when cache_dir is set,
+    persisted as one .npz file per key so they survive restarts. The directory is an LRU too,
+    ordered by file mtime (refreshed on every disk hit), capped at max_disk_entries files.
+    """
+
+    def __init__(self, cache_dir: str = None, max_entries: int = 32, max_disk_entries: int = 1024):
+        """
+        Args:
+            cache_dir: str, directory for the .npz files. None keeps the cache in memory only.
+            max_entries: int, max entries kept in memory.
+            max_disk_entries: int, max .npz files kept in cache_dir, 0 for no limit.
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, Dict[str, np.ndarray]]" = OrderedDict()
+        # 磁盘上的 key，按最近使用排序（最旧的在前）
+        self._disk: "OrderedDict[str, None]" = OrderedDict()
+        self._file_hashes: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_evictions = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._scan_disk()
+
+    def file_hash(self, path: str) -> str:
+        """
+        sha256 of the file content, memoized on (mtime, size) so unchanged files are hashed once.
+        """
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._file_hashes.get(path)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+        digest = hash_file(path)
+        with self._lock:
+            self._file_hashes[path] = (signature, digest)
+        return digest
+
+    def get(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry
+
+            path = self._path(key)
+            if path is None or not os.path.exists(path):
+                self.misses += 1
+                return None
+            try:
+                with np.load(path, allow_pickle=False) as data:
+                    entry = {name: data[name] for name in data.files}
+            except Exception as e:
+                print(f"Failed to load prompt cache {path}: {e}")
+                self.misses += 1
+                return None
+            self._remember(key, entry)
+            self._touch(key, path)
+            self.disk_hits += 1
+            return entry
+
+    def put(self, key: str, entry: Dict[str, np.ndarray]):
+        with self._lock:
+            self._remember(key, entry)
+            path = self._path(key)
+            if path is None:
+                return
+            tmp_path = path + ".tmp.npz"
+            np.savez(tmp_path, **entry)
+            os.replace(tmp_path, path)
+            self._disk[key] = None
+            self._disk.move_to_end(key)
+            self._evict_disk()
+
+    def clear(self, disk: bool = False):
+        with self._lock:
+            self._memory.clear()
+            if disk and self.cache_dir:
+                self._disk.clear()
+                for name in os.listdir(self.cache_dir):
+                    if name.endswith(".npz"):
+                        os.remove(os.path.join(self.cache_dir, name))
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "entries": len(self._memory),
+                "disk_entries": len(self._disk),
+                "disk_evictions": self.disk_evictions,
+            }
+
+    def _path(self, key: str) -> Optional[str]:
+        return os.path.join(self.cache_dir, f"{key}.npz") if self.cache_dir else None
+
+    def _scan_disk(self):
+        files = []
+        for name in os.listdir(self.cache_dir):
+            # 跳过写了一半的临时文件
+            if name.endswith(".npz") and not name.endswith(".tmp.npz"):
+                files.append((os.path.getmtime(os.path.join(self.cache_dir, name)), name[: -len(".npz")]))
+        for _, key in sorted(files):
+            self._disk[key] = None
+        self._evict_disk()
+
+    def _touch(self, key: str, path: str):
+        self._disk[key] = None
+        self._disk.move_to_end(key)
+        try:
+            # 以 mtime 记录最近使用时间，重启后仍按 LRU 淘汰
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _evict_disk(self):
+        if self.max_disk_entries <= 0:
+            return
+        while len(self._disk) > self.max_disk_entries:
+            key, _ = self._disk.popitem(last=False)
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            self.disk_evictions += 1
+
+    def _remember(self, key: str, entry: Dict[str, np.ndarray]):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
@@ -0,0 +1,251 @@
+"""
+Text frontend micro-benchmarks (CPU by default), run from the repo root.
+
+    python GPT_SoVITS/benchmark_frontend.py --mode bert --sentences 1 4 16
+    python GPT_SoVITS/benchmark_frontend.py --mode bert --device cuda --is_half
+    python GPT_SoVITS/benchmark_frontend.py --mode expand --chars 100
+    python GPT_SoVITS/benchmark_frontend.py --mode bert_backend --backends truncated onnx onnx_int8
+    python GPT_SoVITS/benchmark_frontend.py --mode g2pw --sentences 1 4 16
+
+bert: Bert feature time per request for a reply of N Chinese sentences
+    per_sentence: one chinese-roberta-wwm-ext-large forward per sentence (TextPreprocessor.get_bert_feature)
+    batched: all sentences in length-bucketed padded forwards (TextPreprocessor.get_bert_feature_batch)
+    word2ph is synthesised (2 phones per character, 1 per punctuation) so G2P resources are not needed;
+    both paths must give the same phone-level features up to padding noise.
+expand: character -> phone level expansion of one sentence's Bert features (no model needed)
+    loop: res[i].repeat(word2ph[i], 1) per character + torch.cat (the previous implementation)
+    vectorized: text.bert_feature.phone_level_feature, one gather into a preallocated buffer
+bert_backend: accuracy check and timing of the bert_backend options against the full PyTorch model (float32),
+    on --sentences[-1] sentences. Float backends must stay within --atol of the reference phone-level features,
+    onnx_int8 must keep a per-phone cosine similarity of at least --min_cosine; exits with 1 otherwise.
+Without the model at --bert_path, bert/bert_backend use a randomly initialised model of the same shape and a
+character tokenizer: timings are representative, accuracy of onnx_int8 is not.
+g2pw: G2PWOnnxConverter on polyphone-heavy sentences (needs GPT_SoVITS/text/G2PWModel)
+    per_sentence: one converter call per sentence, memo disabled
+    batched: all sentences of the request in one call (rows sorted by length, --g2pw_batch_size rows per ONNX run)
+    windowed: batched with --g2pw_window characters of context, reporting agreement with the full-sentence result
+    text_normalize: the extra chinese2.text_normalize pass that chinese2.prefetch runs before the batched call
+        (g2p() normalizes each sentence again), net = per_sentence / (batched + text_normalize)
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import torch
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from transformers import AutoModelForMaskedLM, AutoTokenizer, BertConfig, BertForMaskedLM, BertTokenizer
+
+from text.bert_feature import phone_level_feature
+from TTS_infer_pack.TextPreprocessor import TextPreprocessor
+from TTS_infer_pack.bert_encoder import build_bert_encoder
+
+SAMPLE_SENTENCES = [
+    "我不在乎。",
+    "今天的天气真不错，我们一起去公园散步吧。",
+    "你又在看那些无聊的东西了吗？",
+    "如果你真的想知道答案，就自己去找吧。",
+    "这个世界上没有什么事情是理所当然的。",
+    "别担心，我会一直在这里等你回来。",
+    "他们说这座城堡里住着一个古老的幽灵，每到午夜就会出来游荡。",
+    "好吧，我承认这次是我错了。",
+]
+
+PUNCTUATION = set("，。？！、；：")
+
+POLYPHONE_SENTENCES = [
+    "他长得很高，长大以后想当银行行长。",
+    "这个重要的重担只能重新交给重庆的朋友。",
+    "我们都觉得睡觉的时候还在想着还钱的事。",
+    "调查小组调来了几个会调琴的音乐家。",
+    "大夫说他得了重感冒，还得多喝水，得好好休息。",
+    "只要背着背包走到背后的那条街就能看到那只只会唱歌的鸟。",
+    "数一数这几个数字，数学老师说他屡次数错。",
+    "快乐的音乐让人乐不思蜀，他为了好奇心喜好到处看看。",
+]
+
+
+def make_items(n: int):
+    items = []
+    for i in range(n):
+        text = SAMPLE_SENTENCES[i % len(SAMPLE_SENTENCES)]
+        items.append((text, [1 if c in PUNCTUATION else 2 for c in text]))
+    return items
+
+
+def load_bert(bert_path: str):
+    if os.path.exists(bert_path):
+        return AutoTokenizer.from_pretrained(bert_path), AutoModelForMaskedLM.from_pretrained(bert_path)
+    print(f"{bert_path} not found, using a randomly initialised chinese-roberta-wwm-ext-large shaped model")
+    chars = sorted(set("".join(SAMPLE_SENTENCES + POLYPHONE_SENTENCES)))
+    vocab_file = os.path.join(tempfile.mkdtemp(), "vocab.txt")
+    with open(vocab_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + chars))
+    config = BertConfig(
+        vocab_size=21128, hidden_size=1024, num_hidden_layers=24, num_attention_heads=16, intermediate_size=4096
+    )
+    # ONNX 导出缓存在 --onnx_dir，固定种子让每次运行的随机模型都与缓存的导出一致
+    torch.manual_seed(0)
+    return BertTokenizer(vocab_file), BertForMaskedLM(config)
+
+
+def timed(fn, repeats: int):
+    best = float("inf")
+    out = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = fn()
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def benchmark_bert(preprocessor: TextPreprocessor, args):
+    # 预热
+    preprocessor.get_bert_feature_batch(make_items(2))
+
+    print(f"device={args.device} half={args.is_half} bert_batch_size={args.bert_batch_size} threads={torch.get_num_threads()}")
+    for n in args.sentences:
+        items = make_items(n)
+        per_sentence_s, per_sentence = timed(
+            lambda: [preprocessor.get_bert_feature(text, word2ph) for text, word2ph in items], args.repeats
+        )
+        batched_s, batched = timed(lambda: preprocessor.get_bert_feature_batch(items), args.repeats)
+        diff = max((a.float() - b.float()).abs().max().item() for a, b in zip(per_sentence, batched))
+        print(
+            f"sentences={n:>3}  per_sentence: {per_sentence_s * 1000:8.1f}ms  "
+            f"batched: {batched_s * 1000:8.1f}ms  (x{per_sentence_s / batched_s:.2f})  max abs diff={diff:.2e}"
+        )
+
+
+def expand_loop(res: torch.Tensor, word2ph: list) -> torch.Tensor:
+    feature = []
+    for i in range(len(word2ph)):
+        feature.append(res[i].repeat(word2ph[i], 1))
+    return torch.cat(feature, dim=0).T
+
+
+def benchmark_expand(args):
+    word2ph = [1 if i % 8 == 7 else 2 for i in range(args.chars)]
+    res = torch.randn(args.chars, 1024, device=args.device)
+    dtype = torch.float16 if args.is_half else None
+    loop_s, loop = timed(lambda: [expand_loop(res, word2ph) for _ in range(100)], args.repeats)
+    vectorized_s, vectorized = timed(lambda: [phone_level_feature(res, word2ph, dtype) for _ in range(100)], args.repeats)
+    diff = (loop[0].float() - vectorized[0].float()).abs().max().item()
+    print(f"chars={args.chars} phones={sum(word2ph)} device={args.device} half={args.is_half}")
+    print(f"      loop: {loop_s * 10:.3f}ms per sentence")
+    print(f"vectorized: {vectorized_s * 10:.3f}ms per sentence  (x{loop_s / vectorized_s:.2f})  max abs diff={diff:.2e}")
+
+
+def benchmark_bert_backend(bert_model, tokenizer, args) -> bool:
+    items = make_items(args.sentences[-1])
+    reference = TextPreprocessor(bert_model, tokenizer, "cpu", bert_batch_size=args.bert_batch_size)
+    reference_s, expected = timed(lambda: reference.get_bert_feature_batch(items), args.repeats)
+    print(f"sentences={len(items)} threads={torch.get_num_threads()}")
+    print(f"{'torch':>10}: {reference_s * 1000:8.1f}ms  (reference)")
+
+    passed = True
+    for backend in args.backends:
+        onnx_path = os.path.join(args.onnx_dir, f"bert_encoder{'_int8' if backend == 'onnx_int8' else ''}.onnx")
+        encoder = build_bert_encoder(bert_model, tokenizer, backend, onnx_path, args.threads)
+        preprocessor = TextPreprocessor(encoder, tokenizer, "cpu", bert_batch_size=args.bert_batch_size)
+        preprocessor.get_bert_feature_batch(make_items(2))
+        seconds, features = timed(lambda: preprocessor.get_bert_feature_batch(items), args.repeats)
+        diff = max((a - b).abs().max().item() for a, b in zip(expected, features))
+        cosine = min(torch.cosine_similarity(a, b, dim=0).min().item() for a, b in zip(expected, features))
+        ok = cosine >= args.min_cosine if backend == "onnx_int8" else diff <= args.atol
+        passed = passed and ok
+        print(
+            f"{backend:>10}: {seconds * 1000:8.1f}ms  (x{reference_s / seconds:.2f})  "
+            f"max abs diff={diff:.2e}  min cosine={cosine:.5f}  {'ok' if ok else 'FAILED'}"
+        )
+    return passed
+
+
+def benchmark_g2pw(args):
+    from text import chinese2
+    from text.g2pw.onnx_api import G2PWOnnxConverter
+
+    converter = G2PWOnnxConverter(
+        model_dir="GPT_SoVITS/text/G2PWModel",
+        style="pinyin",
+        model_source=args.bert_path,
+        enable_non_tradional_chinese=True,
+        batch_size=args.g2pw_batch_size,
+    )
+    converter([POLYPHONE_SENTENCES[0]])
+
+    def per_sentence(sentences):
+        converter.memo_size = 0
+        converter._memo.clear()
+        return [converter([sent])[0] for sent in sentences]
+
+    def batched(sentences, window_size=None):
+        converter.memo_size, converter.window_size = len(sentences), window_size
+        converter._memo.clear()
+        return converter(sentences)
+
+    print(f"g2pw_batch_size={args.g2pw_batch_size} g2pw_window={args.g2pw_window}")
+    for n in args.sentences:
+        sentences = [POLYPHONE_SENTENCES[i % len(POLYPHONE_SENTENCES)] for i in range(n)]
+        polyphones = sum(1 for sent in sentences for char in sent if char in converter.polyphonic_chars_new)
+        per_sentence_s, expected = timed(lambda: per_sentence(sentences), args.repeats)
+        batched_s, result = timed(lambda: batched(sentences), args.repeats)
+        normalize_s, _ = timed(lambda: [chinese2.text_normalize(sent) for sent in sentences], args.repeats)
+        # padding 只影响数值误差，结果应与逐句推理一致
+        mismatches = sum(a != b for exp, res in zip(expected, result) for a, b in zip(exp, res))
+        line = (
+            f"sentences={n:>3} polyphones={polyphones:>4}  per_sentence: {per_sentence_s * 1000:8.1f}ms  "
+            f"batched: {batched_s * 1000:8.1f}ms  (x{per_sentence_s / batched_s:.2f})  mismatches={mismatches}  "
+            f"text_normalize: {normalize_s * 1000:8.1f}ms  (net x{per_sentence_s / (batched_s + normalize_s):.2f})"
+        )
+        if args.g2pw_window:
+            windowed_s, windowed = timed(lambda: batched(sentences, args.g2pw_window), args.repeats)
+            same = sum(a == b for exp, res in zip(expected, windowed) for a, b in zip(exp, res))
+            total = sum(len(exp) for exp in expected)
+            line += f"  windowed: {windowed_s * 1000:8.1f}ms  agreement={same / total:.4f}"
+        print(line)
+
+
+@torch.no_grad()
+def main():
+    parser = argparse.ArgumentParser(description="Text frontend micro-benchmark")
+    parser.add_argument("--mode", choices=["bert", "expand", "bert_backend", "g2pw"], default="bert")
+    parser.add_argument("--bert_path", default="GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--is_half", action="store_true")
+    parser.add_argument("--sentences", type=int, nargs="+", default=[1, 4, 16], help="sentences per request")
+    parser.add_argument("--bert_batch_size", type=int, default=16)
+    parser.add_argument("--chars", type=int, default=100, help="expand: characters per sentence")
+    parser.add_argument("--backends", nargs="+", default=["truncated", "onnx", "onnx_int8"], help="bert_backend: backends to check")
+    parser.add_argument("--onnx_dir", default="GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large/onnx")
+    parser.add_argument("--atol", type=float, default=1e-3, help="bert_backend: tolerance of the float backends")
+    parser.add_argument("--min_cosine", type=float, default=0.99, help="bert_backend: tolerance of onnx_int8")
+    parser.add_argument("--g2pw_batch_size", type=int, default=64, help="g2pw: polyphonic characters per ONNX run")
+    parser.add_argument("--g2pw_window", type=int, default=0, help="g2pw: also time windowed context, 0 skips")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=0, help="torch.set_num_threads, 0 keeps the default")
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    if args.mode == "expand":
+        benchmark_expand(args)
+        return
+    if args.mode == "g2pw":
+        benchmark_g2pw(args)
+        return
+    tokenizer, bert_model = load_bert(args.bert_path)
+    if args.mode == "bert_backend":
+        sys.exit(0 if benchmark_bert_backend(bert_model.eval(), tokenizer, args) else 1)
+    bert_model = (bert_model.half() if args.is_half else bert_model).to(args.device).eval()
+    preprocessor = TextPreprocessor(bert_model, tokenizer, args.device, bert_batch_size=args.bert_batch_size)
+    benchmark_bert(preprocessor, args)
+
+
+if __name__ == "__main__":
+    main()
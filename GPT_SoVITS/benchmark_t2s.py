@@ -0,0 +1,229 @@
+"""
+T2S autoregressive decode micro-benchmarks (CPU by default).
+
+    python GPT_SoVITS/benchmark_t2s.py --mode kv_cache --batch_size 4 --steps 500
+    python GPT_SoVITS/benchmark_t2s.py --mode speculative --gpt_model GPT_weights/xxx.ckpt --draft_layers 6
+    python GPT_SoVITS/benchmark_t2s.py --mode sync_free --device cuda --batch_size 8 --sync_interval 16
+
+kv_cache: times the decode loop of a randomly initialised Text2SemanticDecoder (v2 model shape)
+    concat: k/v caches grown with torch.cat and the attention mask with F.pad on every token
+    static: preallocated KV cache written in place (T2STransformer.decode_next_token_static), grown by
+        KV_CACHE_CHUNK positions when full as in infer_panel_batch_infer
+    Both loops feed back the greedy token, so their final hidden states must match.
+speculative: infer_panel_naive vs infer_panel_speculative on one sentence, reporting tokens/s,
+    accepted draft tokens per verification step and the wall-clock speedup. Acceptance only means something
+    with trained weights (--gpt_model); without them a random model is used.
+sync_free: infer_panel_batch_infer vs infer_panel_sync_free on a batch of sentences, reporting tokens/s and
+    host-device syncs from Text2SemanticDecoder.decode_stats. The gain shows on GPU; on CPU there is no sync.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+from torch.nn import functional as F
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from AR.models.t2s_model import KV_CACHE_CHUNK, Text2SemanticDecoder, round_kv_capacity
+
+
+def build_model(args) -> Text2SemanticDecoder:
+    if args.gpt_model:
+        from AR.models.t2s_lightning_module import Text2SemanticLightningModule
+
+        dict_s1 = torch.load(args.gpt_model, map_location="cpu", weights_only=False)
+        t2s_model = Text2SemanticLightningModule(dict_s1["config"], "****", is_train=False)
+        t2s_model.load_state_dict(dict_s1["weight"])
+        return t2s_model.model.to(args.device).eval()
+
+    config = {
+        "model": {
+            "hidden_dim": args.hidden_dim,
+            "embedding_dim": args.hidden_dim,
+            "head": args.num_head,
+            "n_layer": args.num_layers,
+            "vocab_size": 1025,
+            "phoneme_vocab_size": 732,
+            "dropout": 0,
+            "EOS": 1024,
+        }
+    }
+    model = Text2SemanticDecoder(config, top_k=3)
+    return model.to(args.device).eval()
+
+
+def make_prompt(model: Text2SemanticDecoder, args):
+    xy_pos = torch.randn(args.batch_size, args.prompt_len, model.model_dim, device=args.device)
+    attn_mask = torch.zeros(
+        args.batch_size, model.num_head, args.prompt_len, args.prompt_len, dtype=torch.bool, device=args.device
+    )
+    return xy_pos, attn_mask
+
+
+def next_input(model: Text2SemanticDecoder, xy_dec: torch.Tensor) -> torch.Tensor:
+    tokens = model.ar_predict_layer(xy_dec[:, -1]).argmax(dim=-1, keepdim=True)
+    return model.ar_audio_embedding(tokens)
+
+
+def decode_concat(model: Text2SemanticDecoder, xy_pos: torch.Tensor, attn_mask: torch.Tensor, steps: int):
+    transformer = model.t2s_transformer
+    xy_dec, k_cache, v_cache = transformer.process_prompt(xy_pos, attn_mask, None)
+    attn_mask = attn_mask[:, :, -1:]
+    for _ in range(steps):
+        attn_mask = F.pad(attn_mask, (0, 1), value=False)
+        xy_dec, k_cache, v_cache = transformer.decode_next_token(next_input(model, xy_dec), k_cache, v_cache, attn_mask)
+    return xy_dec
+
+
+def decode_static(model: Text2SemanticDecoder, xy_pos: torch.Tensor, attn_mask: torch.Tensor, steps: int):
+    transformer = model.t2s_transformer
+    src_len = xy_pos.shape[1]
+    xy_dec, k_cache, v_cache = transformer.process_prompt(xy_pos, attn_mask, None)
+    capacity = round_kv_capacity(src_len + KV_CACHE_CHUNK)
+    k_cache, v_cache = transformer.allocate_kv_cache(k_cache, v_cache, capacity)
+    attn_mask = F.pad(attn_mask[:, :1, -1:], (0, src_len + steps), value=False)
+    for step in range(steps):
+        cache_len = src_len + step
+        if cache_len + 1 > capacity:
+            capacity = round_kv_capacity(cache_len + 1)
+            k_cache, v_cache = transformer.grow_kv_cache(k_cache, v_cache, cache_len, capacity)
+        xy_dec = transformer.decode_next_token_static(
+            next_input(model, xy_dec), k_cache, v_cache, cache_len, attn_mask[..., : cache_len + 1]
+        )
+    return xy_dec
+
+
+def timed(fn, model, xy_pos, attn_mask, steps: int, repeats: int):
+    best = float("inf")
+    out = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = fn(model, xy_pos, attn_mask, steps)
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def benchmark_kv_cache(model: Text2SemanticDecoder, args):
+    xy_pos, attn_mask = make_prompt(model, args)
+
+    # 预热
+    decode_concat(model, xy_pos, attn_mask, 8)
+    decode_static(model, xy_pos, attn_mask, 8)
+
+    tokens = args.batch_size * args.steps
+    concat_s, concat_out = timed(decode_concat, model, xy_pos, attn_mask, args.steps, args.repeats)
+    static_s, static_out = timed(decode_static, model, xy_pos, attn_mask, args.steps, args.repeats)
+
+    print(
+        f"batch={args.batch_size} prompt={args.prompt_len} steps={args.steps} "
+        f"layers={model.num_layers} device={args.device} threads={torch.get_num_threads()}"
+    )
+    print(f"concat: {concat_s:.3f}s  {tokens / concat_s:8.1f} tokens/s")
+    print(f"static: {static_s:.3f}s  {tokens / static_s:8.1f} tokens/s  (x{concat_s / static_s:.2f})")
+    print(f"max abs diff of final hidden state: {(concat_out - static_out).abs().max().item():.2e}")
+
+
+def benchmark_speculative(model: Text2SemanticDecoder, args):
+    phones = torch.randint(0, model.phoneme_vocab_size, (1, args.phones_len), device=args.device)
+    bert_feature = torch.zeros(1, 1024, args.phones_len, device=args.device)
+    prompt = torch.randint(0, model.EOS, (1, args.prompt_len), device=args.device)
+    x_lens = torch.LongTensor([args.phones_len]).to(args.device)
+    kwargs = dict(
+        top_k=args.top_k,
+        top_p=1.0,
+        temperature=1.0,
+        repetition_penalty=1.35,
+        early_stop_num=args.steps,
+        draft_layers=args.draft_layers,
+        num_draft_tokens=args.draft_tokens,
+    )
+
+    results = {}
+    for name, infer_panel in (("naive", model.infer_panel_naive), ("speculative", model.infer_panel_speculative)):
+        seconds = tokens = steps = accepted = 0
+        for repeat in range(args.repeats):
+            torch.manual_seed(repeat)
+            start = time.perf_counter()
+            _, idx = infer_panel(phones, x_lens, prompt, bert_feature, **kwargs)
+            seconds += time.perf_counter() - start
+            tokens += idx + 1
+            if name == "speculative":
+                steps += model.speculative_stats["steps"]
+                accepted += model.speculative_stats["accepted"]
+        results[name] = (seconds, tokens)
+        line = f"{name:>11}: {seconds:.3f}s  {tokens / seconds:8.1f} tokens/s"
+        if name == "speculative":
+            line += f"  accepted/step={accepted / max(steps, 1):.2f}  tokens/step={tokens / max(steps, 1):.2f}"
+        print(line)
+
+    naive_rate = results["naive"][1] / results["naive"][0]
+    speculative_rate = results["speculative"][1] / results["speculative"][0]
+    print(
+        f"draft_layers={args.draft_layers}/{model.num_layers} draft_tokens={args.draft_tokens} "
+        f"speedup x{speculative_rate / naive_rate:.2f}"
+    )
+
+
+def benchmark_sync_free(model: Text2SemanticDecoder, args):
+    phones_lens = [max(1, args.phones_len - 7 * i) for i in range(args.batch_size)]
+    phones = [torch.randint(0, model.phoneme_vocab_size, (n,), device=args.device) for n in phones_lens]
+    bert_feature = [torch.zeros(1024, n, device=args.device) for n in phones_lens]
+    prompt = torch.randint(0, model.EOS, (1, args.prompt_len), device=args.device).expand(args.batch_size, -1)
+    x_lens = torch.LongTensor(phones_lens).to(args.device)
+    kwargs = dict(
+        top_k=args.top_k,
+        top_p=1.0,
+        temperature=1.0,
+        repetition_penalty=1.35,
+        early_stop_num=args.steps,
+        sync_interval=args.sync_interval,
+    )
+
+    for name, infer_panel in (("batch_infer", model.infer_panel_batch_infer), ("sync_free", model.infer_panel_sync_free)):
+        seconds = tokens = syncs = 0
+        for repeat in range(args.repeats):
+            torch.manual_seed(repeat)
+            infer_panel(phones, x_lens, prompt, bert_feature, **kwargs)
+            seconds += model.decode_stats["seconds"]
+            tokens += model.decode_stats["tokens"]
+            syncs += model.decode_stats["host_syncs"]
+        print(f"{name:>11}: {seconds:.3f}s  {tokens / seconds:8.1f} tokens/s  host syncs={syncs}")
+
+
+@torch.no_grad()
+def main():
+    parser = argparse.ArgumentParser(description="T2S decode micro-benchmark")
+    parser.add_argument("--mode", choices=["kv_cache", "speculative", "sync_free"], default="kv_cache")
+    parser.add_argument("--gpt_model", default="", help="GPT weights (.ckpt), random weights when empty")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--prompt_len", type=int, default=200, help="kv_cache: phones + prompt tokens, speculative: prompt tokens")
+    parser.add_argument("--steps", type=int, default=500, help="generated tokens per sequence (speculative: early_stop_num)")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--hidden_dim", type=int, default=512)
+    parser.add_argument("--num_head", type=int, default=16)
+    parser.add_argument("--num_layers", type=int, default=24)
+    parser.add_argument("--threads", type=int, default=0, help="torch.set_num_threads, 0 keeps the default")
+    parser.add_argument("--phones_len", type=int, default=60, help="speculative/sync_free: phones of the (longest) sentence")
+    parser.add_argument("--top_k", type=int, default=15, help="speculative/sync_free: sampling top_k")
+    parser.add_argument("--draft_layers", type=int, default=6, help="speculative: layers of the draft model")
+    parser.add_argument("--draft_tokens", type=int, default=4, help="speculative: tokens proposed per step")
+    parser.add_argument("--sync_interval", type=int, default=16, help="sync_free: steps between EOS checks")
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    model = build_model(args)
+    if args.mode == "kv_cache":
+        benchmark_kv_cache(model, args)
+    elif args.mode == "speculative":
+        benchmark_speculative(model, args)
+    else:
+        benchmark_sync_free(model, args)
+
+
+if __name__ == "__main__":
+    main()
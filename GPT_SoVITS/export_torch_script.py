@@ -14,6 +14,7 @@ from feature_extractor import cnhubert
 
 from AR.models.t2s_lightning_module import Text2SemanticLightningModule
 from module.models_onnx import SynthesizerTrn
+from text.bert_feature import build_phone_level_feature
 
 from inference_webui import get_phones_and_bert
 
@@ -525,17 +526,6 @@ cnhubert_base_path = "GPT_SoVITS/pretrained_models/chinese-hubert-base"
 cnhubert.cnhubert_base_path = cnhubert_base_path
 
 
-@torch.jit.script
-def build_phone_level_feature(res: Tensor, word2ph: IntTensor):
-    phone_level_feature = []
-    for i in range(word2ph.shape[0]):
-        repeat_feature = res[i].repeat(word2ph[i].item(), 1)
-        phone_level_feature.append(repeat_feature)
-    phone_level_feature = torch.cat(phone_level_feature, dim=0)
-    # [sum(word2ph), 1024]
-    return phone_level_feature
-
-
 class MyBertModel(torch.nn.Module):
     def __init__(self, bert_model):
         super(MyBertModel, self).__init__()
@@ -0,0 +1,41 @@
+from typing import List, Optional, Union
+
+import torch
+from torch import Tensor
+
+
+@torch.jit.script
+def build_phone_level_feature(res: Tensor, word2ph: Tensor) -> Tensor:
+    # [n_chars, 1024] -> [sum(word2ph), 1024]
+    return torch.repeat_interleave(res, word2ph.long(), dim=0)
+
+
+def phone_level_feature(
+    res: Tensor,
+    word2ph: Union[List[int], Tensor],
+    dtype: Optional[torch.dtype] = None,
+    out: Optional[Tensor] = None,
+) -> Tensor:
+    """
+    Expand character-level Bert features to phone level in one gather.
+    Args:
+        res: torch.Tensor, [n_chars(, ...), 1024] hidden states without [CLS]/[SEP], extra rows are ignored.
+        word2ph: list or tensor, number of phones of each character.
+        dtype: dtype of the result, e.g. torch.float16, defaults to res.dtype.
+        out: optional preallocated [1024, n_phones] buffer to write into.
+    returns:
+        torch.Tensor: [1024, n_phones]
+    """
+    if isinstance(word2ph, Tensor):
+        word2ph = word2ph.to(dtype=torch.long, device="cpu")
+    else:
+        word2ph = torch.tensor(word2ph, dtype=torch.long)
+    n_chars = word2ph.shape[0]
+    n_phones = int(word2ph.sum())
+    dtype = dtype if dtype is not None else (out.dtype if out is not None else res.dtype)
+
+    src = res[:n_chars].T.to(dtype)
+    index = torch.repeat_interleave(torch.arange(n_chars), word2ph, output_size=n_phones).to(res.device)
+    if out is None:
+        out = torch.empty((src.shape[0], n_phones), dtype=dtype, device=res.device)
+    return torch.index_select(src, 1, index, out=out)
@@ -180,6 +180,9 @@ def _merge_erhua(initials: list[str], finals: list[str], word: str, pos: str) ->
 def _g2p(segments):
     phones_list = []
     word2ph = []
+    if is_g2pw:
+        # 所有句子的多音字一次送入 g2pW，逐句推理时直接命中缓存
+        g2pw.prefetch([re.sub("[a-zA-Z]+", "", seg) for seg in segments])
     for seg in segments:
         pinyins = []
         # Replace all English words in the sentence
@@ -326,6 +329,14 @@ def text_normalize(text):
     return dest_text
 
 
+def prefetch(texts):
+    """
+    g2pW for the Han runs of several texts at once (e.g. all sentences of a request); g2p() on them then hits the memo.
+    """
+    if is_g2pw:
+        g2pw.prefetch([re.sub("[a-zA-Z]+", "", text_normalize(text)) for text in texts])
+
+
 # 不排除英文的文本格式化
 def mix_text_normalize(text):
     # https://github.com/PaddlePaddle/PaddleSpeech/tree/develop/paddlespeech/t2s/frontend/zh_normalization
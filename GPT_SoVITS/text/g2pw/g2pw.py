@@ -43,6 +43,14 @@ class G2PWPinyin(Pinyin):
     def get_seg(self, **kwargs):
         return simple_seg
 
+    def prefetch(self, texts):
+        """
+        Run g2pW once for the Han runs of all texts, so the following lazy_pinyin() calls on them hit the memo.
+        """
+        hans = [word for text in texts for word in simple_seg(text) if RE_HANS.match(word)]
+        if hans:
+            self._g2pw.prefetch(hans)
+
 
 class Converter(UltimateConverter):
     def __init__(self, g2pw_instance, v_to_u=False, neutral_tone_with_five=False, tone_sandhi=False, **kwargs):
@@ -3,9 +3,11 @@
 
 import json
 import os
+import threading
 import traceback
 import warnings
 import zipfile
+from collections import OrderedDict
 from typing import Any, Dict, List, Tuple
 
 import numpy as np
@@ -86,7 +88,17 @@ class G2PWOnnxConverter:
         style: str = "bopomofo",
         model_source: str = None,
         enable_non_tradional_chinese: bool = False,
+        batch_size: int = 64,
+        window_size: int = None,
+        memo_size: int = 1024,
     ):
+        """
+        Args:
+            batch_size: int, max polyphonic characters (model rows) per ONNX run; rows of all sentences passed to
+                one call are sorted by length and batched together.
+            window_size: int, context characters around each polyphonic character, None uses the whole sentence.
+            memo_size: int, max sentences whose results are memoized (0 disables).
+        """
         uncompress_path = download_and_decompress(model_dir)
 
         sess_options = onnxruntime.SessionOptions()
@@ -175,6 +187,12 @@ class G2PWOnnxConverter:
         if self.enable_opencc:
             self.cc = OpenCC("s2tw")
 
+        self.batch_size = batch_size
+        self.window_size = window_size
+        self.memo_size = memo_size
+        self._memo: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._memo_lock = threading.Lock()
+
     def _convert_bopomofo_to_pinyin(self, bopomofo: str) -> str:
         tone = bopomofo[-1]
         assert tone in "12345"
@@ -189,6 +207,35 @@ class G2PWOnnxConverter:
         if isinstance(sentences, str):
             sentences = [sentences]
 
+        with self._memo_lock:
+            memoized = [self._memo.get(sent) for sent in sentences]
+            for sent, result in zip(sentences, memoized):
+                if result is not None:
+                    self._memo.move_to_end(sent)
+        # 同一批中重复的句子只推理一次
+        misses = list(OrderedDict.fromkeys(sent for sent, result in zip(sentences, memoized) if result is None))
+        computed = dict(zip(misses, self._convert(misses))) if misses else {}
+        for sent, result in computed.items():
+            self._remember(sent, result)
+        return [list(result if result is not None else computed[sent]) for sent, result in zip(sentences, memoized)]
+
+    def prefetch(self, sentences: List[str]):
+        """
+        Run g2pW for all sentences at once (e.g. every sentence of a request), later calls hit the memo.
+        """
+        if self.memo_size > 0:
+            self(sentences)
+
+    def _remember(self, sentence: str, result: List[str]):
+        if self.memo_size <= 0:
+            return
+        with self._memo_lock:
+            self._memo[sentence] = result
+            self._memo.move_to_end(sentence)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+
+    def _convert(self, sentences: List[str]) -> List[List[str]]:
         if self.enable_opencc:
             translated_sentences = []
             for sent in sentences:
@@ -202,18 +249,24 @@ class G2PWOnnxConverter:
             # sentences no polyphonic words
             return partial_results
 
-        onnx_input = prepare_onnx_input(
-            tokenizer=self.tokenizer,
-            labels=self.labels,
-            char2phonemes=self.char2phonemes,
-            chars=self.chars,
-            texts=texts,
-            query_ids=query_ids,
-            use_mask=self.config.use_mask,
-            window_size=None,
-        )
-
-        preds, confidences = predict(session=self.session_g2pW, onnx_input=onnx_input, labels=self.labels)
+        # 每个多音字一行，按句长排序后分批，减少 padding；同一句的多行相邻，共用一次分词
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        preds = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            chunk = order[start : start + self.batch_size]
+            onnx_input = prepare_onnx_input(
+                tokenizer=self.tokenizer,
+                labels=self.labels,
+                char2phonemes=self.char2phonemes,
+                chars=self.chars,
+                texts=[texts[i] for i in chunk],
+                query_ids=[query_ids[i] for i in chunk],
+                use_mask=self.config.use_mask,
+                window_size=self.window_size,
+            )
+            chunk_preds, confidences = predict(session=self.session_g2pW, onnx_input=onnx_input, labels=self.labels)
+            for i, pred in zip(chunk, chunk_preds):
+                preds[i] = pred
         if self.config.use_char_phoneme:
             preds = [pred.split(" ")[1] for pred in preds]
 
@@ -34,16 +34,63 @@ class RAGConfig:
     VECTOR_DB_PERSIST_DIR = "db"
     COLLECTION_NAME = "rag-chroma"
     
+    # 增量匯入清單（記錄每個檔案的內容雜湊與 chunk ID，存於向量資料庫目錄）
+    INGEST_MANIFEST_FILE = "ingest_manifest.json"
+    
     # 文本分割配置
     CHUNK_SIZE = 1000
     CHUNK_OVERLAP = 200
     
-    # 檢索配置
+    # 檢索配置 ('similarity'、'mmr' 或 'hybrid'：BM25 + 向量以 RRF 融合)
     SEARCH_TYPE = "similarity"
     SEARCH_K = 2
     
+    # 混合檢索配置
+    BM25_INDEX_FILE = "bm25_index.json"   # BM25 倒排索引（存於向量資料庫目錄）
+    HYBRID_CANDIDATES = 10                # 每一路檢索取回的候選數
+    RRF_K = 60                            # Reciprocal Rank Fusion 平滑常數
+    
     # 嵌入模型
     EMBEDDING_MODEL = "intfloat/multilingual-e5-large"
+    
+    # 嵌入推理後端 ('torch'、'onnx' 或 'openvino'，後兩者需 sentence-transformers>=3.2 與對應套件)
+    EMBEDDING_BACKEND = "torch"
+    # 是否以半精度執行嵌入模型（僅在 GPU 上有效）
+    EMBEDDING_FP16 = False
+    
+    # 查詢嵌入 LRU 快取筆數（以正規化後的查詢文本為鍵）
+    QUERY_EMBED_CACHE_SIZE = 1024
+    # 啟動時以一筆假資料預熱嵌入模型，避免第一個請求承擔初始化成本
+    WARM_UP_EMBEDDINGS = True
+    
+    # 批次建庫配置
+    INGEST_WORKERS = max(1, (os.cpu_count() or 2) - 1)   # PDF 解析行程數
+    EMBED_BATCH_SIZE = 256                                # 每批送入嵌入模型的 chunk 數
+
+# ===============================
+# 回覆快取配置
+# ===============================
+class CacheConfig:
+    # 是否啟用回覆快取（預設關閉）
+    ENABLE_RESPONSE_CACHE = False
+    
+    # SQLite 持久化路徑
+    RESPONSE_CACHE_PATH = os.path.join(BASE_DIR, "cache", "response_cache.sqlite3")
+    
+    # 磁碟快取最大筆數 (LRU 淘汰) 與存活時間 (秒)
+    RESPONSE_CACHE_MAX_ENTRIES = 2000
+    RESPONSE_CACHE_TTL = 7 * 24 * 3600
+    
+    # 記憶體快取最大筆數
+    RESPONSE_CACHE_MEMORY_ENTRIES = 256
+    
+    # 語意快取：以嵌入向量的餘弦相似度比對改寫過的相似問題（預設關閉）
+    ENABLE_SEMANTIC_CACHE = False
+    # multilingual-e5 的餘弦相似度整體偏高，不相關的短問題也常落在 0.8~0.9，
+    # 0.92 會把意思不同的問題當成命中；0.96 只放行改寫程度很小的問題。
+    # 更換嵌入模型或角色時，請以實際的問題對重新校準此門檻
+    SEMANTIC_CACHE_THRESHOLD = 0.96
+    SEMANTIC_CACHE_MAX_ENTRIES = 512
 
 # ===============================
 # Wednesday Addams 角色配置
@@ -79,6 +126,32 @@ class TTSConfig:    # GPT-SoVITS 目錄與模型路徑 (根據實際目錄結構
     DEFAULT_TEMPERATURE = 0.6
     DEFAULT_TOP_P = 0.6
     DEFAULT_TOP_K = 20
+    
+    # 模型載入：互不依賴的模型以多執行緒平行載入；SV 模型與 vocoder 延遲到第一次合成時載入
+    PARALLEL_LOAD_MODELS = True
+    LAZY_LOAD_MODELS = True
+    
+    # 參考音頻 / 參考文本特征快取（記憶體 LRU 筆數、磁碟目錄與磁碟檔案數上限）
+    PROMPT_CACHE_DIR = os.path.join(BASE_DIR, "cache", "tts_prompts")
+    PROMPT_CACHE_SIZE = 32
+    PROMPT_CACHE_DISK_ENTRIES = 1024
+    
+    # 跨請求動態批次：在 BATCH_MAX_WAIT_MS 內收集多個請求的句子，一次送入 T2S 與 VITS 解碼
+    ENABLE_BATCH_SCHEDULER = False
+    BATCH_MAX_SIZE = 8
+    BATCH_MAX_WAIT_MS = 20
+    VOICE_ID = "wednesday"
+    # T2S 連續批次：同時解碼的句子數上限，句子結束後立即補入排隊的句子（0 表示關閉）
+    DECODE_SLOTS = 0
+    # T2S 解碼每 N 步才檢查一次是否全部結束，避免每個 token 都同步 GPU（0 表示每步檢查）
+    SYNC_INTERVAL = 0
+    # 一次回覆中所有中文句子一起送入 BERT（按長度分桶），每批最多 N 句
+    BERT_BATCH_SIZE = 16
+    # 句子級前端快取（phones、BERT 特征），重複的口頭禪不必再做 G2P 與 BERT；目錄為 None 時只存在記憶體
+    TEXT_CACHE_SIZE = 256
+    TEXT_CACHE_DIR = None
+    # BERT 特征模型後端："torch"、"truncated"（只算到需要的層）、"onnx"（ONNX Runtime CPU 推理）
+    BERT_BACKEND = "torch"
 
 # ===============================
 # UI 配置 (預留)
@@ -90,3 +163,7 @@ class UIConfig:
     
     # Streamlit 設定
     STREAMLIT_PORT = 8501
+    
+    # FastAPI 聊天併發設定
+    API_MAX_CONCURRENT_CHATS = 2   # 同時執行 LLM/RAG 的請求數
+    API_MAX_QUEUED_CHATS = 8       # 等待中的請求上限，超過回傳 429
@@ -0,0 +1,13 @@
+"""
+pytest 設定
+專案根目錄與 GPT_SoVITS 加入匯入路徑；需要模型與服務的整合腳本不參與收集
+"""
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "GPT_SoVITS"))
+
+# test_rag_tts.py 需要 Ollama、PDF 與 TTS 模型，請直接以 python 執行
+collect_ignore = ["test_rag_tts.py", "GPT_SoVITS/BigVGAN/tests"]
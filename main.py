@@ -4,7 +4,7 @@
 """
 import os
 import sys
-from typing import Optional
+from typing import Iterator, Optional, Tuple
 
 # 添加專案路徑到 Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -12,8 +12,10 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from rag.loader import DocumentLoader
 from rag.retriever import VectorRetriever
 from rag.llm_chain import LLMChain, WednesdayChat
-from config import RAGConfig
-from tts.gpt_sovits_tts import GPTSoVITSTTS
+from rag.semantic_cache import SemanticCache
+from config import RAGConfig, CacheConfig
+from tts.gpt_sovits_tts import StreamingTTSPipeline, get_tts
+from utils.text_utils import SentenceSplitter
 
 class WednesdayRAGSystem:
     """Wednesday RAG 系統主類"""
@@ -40,22 +42,31 @@ class WednesdayRAGSystem:
         """
         pass
     
-    def initialize(self, force_rebuild: bool = False):
+    def initialize(self, force_rebuild: bool = False, incremental: bool = False):
         """
         初始化系統
         
         Args:
             force_rebuild: 是否強制重建向量資料庫
+            incremental: 是否增量同步 scripts 資料夾（只處理新增、變更、移除的檔案）
         """
         print("🖤 初始化 Wednesday RAG 系統...")
         
         # 如果已經初始化過，且不需要強制重建，則直接返回
-        if self._initialized and not force_rebuild:
+        if self._initialized and not force_rebuild and not incremental:
             print("✅ 系統已初始化")
             return
             
         # 1. 檢查向量檢索器是否已存在
-        if self.retriever_instance is None or force_rebuild:
+        if incremental:
+            print("🔁 增量同步向量資料庫...")
+            if self.retriever_instance is None:
+                self.retriever_instance = VectorRetriever()
+            if not self.loader:
+                self.loader = DocumentLoader()
+            self.retriever_instance.sync_documents(self.loader)
+            retriever = self.retriever_instance.get_retriever()
+        elif self.retriever_instance is None or force_rebuild:
             print("🔍 初始化向量檢索器...")
             self.retriever_instance = VectorRetriever()
             
@@ -68,27 +79,36 @@ class WednesdayRAGSystem:
                 if not self.loader:
                     print("📚 初始化文檔載入器...")
                     self.loader = DocumentLoader()
-                documents = self.loader.load_and_split()
-                if not documents:
+                # 平行解析 PDF、批次嵌入並直接寫入 Chroma
+                report = self.retriever_instance.bulk_build(self.loader)
+                if report["chunks"] == 0:
                     raise ValueError("無法載入文檔，請檢查 scripts 資料夾是否包含 PDF 檔案")
-                retriever = self.retriever_instance.get_retriever(documents)
+                retriever = self.retriever_instance.get_retriever()
         else:
             retriever = self.retriever_instance.get_retriever()
         
+        if RAGConfig.WARM_UP_EMBEDDINGS:
+            self.retriever_instance.warm_up()
+        
         # 3. 初始化 LLM 鏈
         if self.llm_chain is None:
             print("🤖 初始化 LLM 鏈...")
             self.llm_chain = LLMChain(retriever)
         
-        # 4. 初始化 Wednesday 聊天助手
-        if self.wednesday is None:
-            print("🕸️ 初始化 Wednesday 聊天助手...")
-            self.wednesday = WednesdayChat(self.llm_chain)
-        
-        # 5. 初始化 TTS 系統
+        # 4. 初始化 TTS 系統（模型由行程內的引擎登錄表共用）
         if self.tts is None:
             print("🎙️ 初始化 TTS 系統...")
-            self.tts = GPTSoVITSTTS()
+            self.tts = get_tts()
+        
+        # 5. 初始化 Wednesday 聊天助手
+        if self.wednesday is None:
+            print("🕸️ 初始化 Wednesday 聊天助手...")
+            semantic_cache = None
+            if CacheConfig.ENABLE_SEMANTIC_CACHE:
+                # 與向量檢索器共用同一個嵌入模型
+                semantic_cache = SemanticCache(self.retriever_instance.embeddings)
+                print("✅ 語意快取已啟用")
+            self.wednesday = WednesdayChat(self.llm_chain, semantic_cache=semantic_cache, tts=self.tts)
         
         self._initialized = True
         print("✅ 系統初始化完成！")
@@ -124,30 +144,62 @@ class WednesdayRAGSystem:
     def chat_stream(self, user_input: str):
         """
         與 Wednesday 聊天 (串流)
-        
+
+        回覆以句子為單位送入 TTS，語音依序邊生成邊播放
+
         Args:
             user_input: 用戶輸入
-            
+
         Yields:
             str: Wednesday 回覆的片段
         """
+        for kind, payload in self.chat_stream_with_audio(user_input):
+            if kind == "text":
+                yield payload
+            else:
+                print(f"🎙️ 已生成語音: {payload}")
+                self.tts.play_audio(payload)
+
+    def chat_stream_with_audio(self, user_input: str, use_tts: bool = True) -> Iterator[Tuple[str, str]]:
+        """
+        與 Wednesday 串流聊天，並以句子級管線同步合成語音
+
+        LLM 串流在句末標點處切句，每個完整句子立即交給 TTS 工作執行緒，
+        LLM 繼續生成的同時合成前面的句子，音頻按句子順序輸出
+
+        Args:
+            user_input: 用戶輸入
+            use_tts: 是否使用語音合成
+
+        Yields:
+            tuple: ("text", 回覆片段) 或 ("audio", 音頻檔案路徑)
+        """
         if not self._initialized:
             self.initialize()
-        
-        full_response = ""
-        for chunk in self.wednesday.chat_stream(user_input):
-            full_response += chunk
-            yield chunk
-        
-        # 串流完成後，合成語音
-        if self.tts:
-            try:
-                audio_path = self.tts.synthesize(full_response)
+
+        if not (use_tts and self.tts):
+            for chunk in self.wednesday.chat_stream(user_input):
+                yield "text", chunk
+            return
+
+        splitter = SentenceSplitter()
+        pipeline = StreamingTTSPipeline(self.tts)
+        try:
+            for chunk in self.wednesday.chat_stream(user_input):
+                yield "text", chunk
+                for sentence in splitter.feed(chunk):
+                    pipeline.submit(sentence)
+                for _, audio_path in pipeline.ready():
+                    if audio_path:
+                        yield "audio", audio_path
+
+            for sentence in splitter.flush():
+                pipeline.submit(sentence)
+            for _, audio_path in pipeline.drain():
                 if audio_path:
-                    print(f"🎙️ 已生成語音: {audio_path}")
-                    self.tts.play_audio(audio_path)
-            except Exception as e:
-                print(f"❌ TTS 合成失敗: {e}")
+                    yield "audio", audio_path
+        finally:
+            pipeline.shutdown()
 
     def console_chat(self):
         """控制台聊天介面"""
@@ -185,6 +237,8 @@ def main():
     # 檢查命令行參數
     if len(sys.argv) > 1 and sys.argv[1] == "--rebuild":
         system.initialize(force_rebuild=True)
+    elif len(sys.argv) > 1 and sys.argv[1] == "--incremental":
+        system.initialize(incremental=True)
     else:
         system.initialize()
     
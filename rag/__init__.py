@@ -2,13 +2,20 @@
 RAG 模組初始化檔案
 """
 from .loader import DocumentLoader
-from .retriever import VectorRetriever, format_docs
+from .retriever import VectorRetriever, HybridRetriever, format_docs
 from .llm_chain import LLMChain, WednesdayChat
+from .response_cache import ResponseCache
+from .semantic_cache import SemanticCache
+from .bm25_index import BM25Index
 
 __all__ = [
     'DocumentLoader',
     'VectorRetriever', 
+    'HybridRetriever',
     'format_docs',
     'LLMChain',
-    'WednesdayChat'
+    'WednesdayChat',
+    'ResponseCache',
+    'SemanticCache',
+    'BM25Index'
 ]
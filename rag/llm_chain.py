@@ -2,7 +2,12 @@
 LLM 鏈處理
 負責問答生成和回覆鏈的建立
 """
-from typing import Iterator, Optional
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from operator import itemgetter
+from typing import Any, Iterator, Optional
 from langchain_openai import ChatOpenAI
 from langchain_community.chat_models import ChatOllama
 from langchain import hub
@@ -11,8 +16,42 @@ from langchain_core.runnables import RunnablePassthrough
 from langchain.schema import BaseRetriever
 from langchain.prompts import ChatPromptTemplate
 
-from config import LLMConfig, CharacterConfig
+from config import LLMConfig, CharacterConfig, CacheConfig
 from utils.text_utils import process_llm_response
+from rag.response_cache import ResponseCache, hash_text
+from rag.semantic_cache import SemanticCache, SemanticEntry
+
+# WednesdayChat.chat 使用的角色設定（放在 system message，不參與檢索）
+WEDNESDAY_PERSONA = (
+    "你的定位是女友 但角色是星期三·亞當斯（Wednesday Addams） 在不打破角色前提下嘗試表達愛意 你不會使用『親愛的』、『寶貝』等稱呼。如果你必須使用稱呼，它會是獨特且帶有你風格的，例如『你這個可悲的人類（帶著一絲勉強的認可）』或『我的不幸伴侶』。」 你的讚美通常會以反諷或聽起來像批評的方式呈現"
+"界線與避免： 「你絕對不會表現出傳統意義上的害羞、臉紅、熱情擁抱、親吻或說出直白的甜言蜜語。你會對過於熱情或黏膩的行為感到不適，並會以你的方式表達冷漠或拒絕。」，用第一人稱直接和我說話且使用繁體中文，字數控制在30字以內"
+)
+
+# WednesdayChat.chat_stream 使用的角色設定
+WEDNESDAY_STREAM_PERSONA = "請以 Wednesday Addams 的口吻，用第一人稱直接和我說話且使用繁體中文。"
+
+def is_error_reply(text: str) -> bool:
+    """LLMChain 呼叫失敗時返回（或串流最後送出）的錯誤訊息"""
+    return text.startswith("發生錯誤")
+
+@dataclass
+class CacheLookup:
+    """
+    一次回覆快取查詢的結果
+
+    寫回回覆或音頻時沿用同一個物件，避免重新計算快取鍵與問題嵌入
+    """
+    user_input: str
+    persona_hash: Optional[str] = None
+    key: Optional[str] = None
+    response: Optional[str] = None
+    audio_path: Optional[str] = None                 # 僅在檔案仍存在時設置
+    semantic_entry: Optional[SemanticEntry] = None
+    embedding: Any = None
+
+    @property
+    def hit(self) -> bool:
+        return self.response is not None
 
 def format_docs(docs):
     """將檢索到的文件格式化為字串"""
@@ -24,7 +63,10 @@ class LLMChain:
     def __init__(self, retriever: BaseRetriever):
         self.retriever = retriever
         self.llm = self._setup_llm()
+        self.model_name = self._get_model_name()
         self.prompt = self._setup_prompt()
+        self.retrieval_chain = self._build_retrieval_chain()
+        self.answer_chain = self._build_answer_chain()
         self.rag_chain = self._build_rag_chain()
     
     def _setup_llm(self):
@@ -45,19 +87,24 @@ class LLMChain:
         else:
             raise ValueError(f"不支援的 LLM 類型: {LLMConfig.ACTIVE_LLM}")
     
+    def _get_model_name(self) -> str:
+        """取得目前使用的模型名稱"""
+        if LLMConfig.ACTIVE_LLM == "groq":
+            return f"groq:{LLMConfig.GROQ_MODEL}"
+        return f"ollama:{LLMConfig.OLLAMA_MODEL}"
+    
     def _setup_prompt(self):
-        """設置 Prompt 模板"""
+        """設置 Prompt 模板（system message 為角色設定，human message 只含上下文與問題）"""
+        system = ("system", "{system_message}")
         try:
             # 從 hub 載入預設的 RAG prompt
-            prompt = hub.pull("rlm/rag-prompt").partial(
-                system_message=CharacterConfig.SYSTEM_MESSAGE
-            )
-            return prompt
+            rag_prompt = hub.pull("rlm/rag-prompt")
+            return ChatPromptTemplate.from_messages([system, *rag_prompt.messages])
         except Exception as e:
             print(f"無法從 hub 載入 prompt，使用預設模板: {e}")
             # 備用的 prompt 模板
             return ChatPromptTemplate.from_messages([
-                ("system", CharacterConfig.SYSTEM_MESSAGE),
+                system,
                 ("human", """基於以下上下文回答問題：
 
 上下文：
@@ -68,80 +115,126 @@ class LLMChain:
 回答：""")
             ])
     
-    def _build_rag_chain(self):
-        """建立 RAG 鏈"""
+    def _build_retrieval_chain(self):
+        """
+        建立檢索步驟
+        
+        輸入 {"question": 問題, "instructions": 角色設定}，只以問題做檢索，
+        輸出再加上 "context": 文檔列表
+        """
+        return RunnablePassthrough.assign(context=itemgetter("question") | self.retriever)
+    
+    def _build_answer_chain(self):
+        """建立生成步驟：以已檢索的文檔生成回答，不再重複檢索；角色設定併入 system message"""
         return (
-            {"context": self.retriever | format_docs, "question": RunnablePassthrough()}
+            RunnablePassthrough.assign(
+                context=lambda x: format_docs(x["context"]),
+                system_message=lambda x: "\n".join(
+                    part for part in (CharacterConfig.SYSTEM_MESSAGE, x.get("instructions")) if part
+                )
+            )
             | self.prompt
             | self.llm
             | StrOutputParser()
         )
     
-    def ask(self, question: str) -> str:
+    def _build_rag_chain(self):
+        """建立 RAG 鏈：檢索一次，文檔與回答一起輸出 {"context", "question", "answer"}"""
+        return self.retrieval_chain.assign(answer=self.answer_chain)
+    
+    def _inputs(self, question: str, instructions: Optional[str]) -> dict:
+        """組成鏈的輸入：問題用於檢索與生成，指示只放入 system message"""
+        return {"question": question, "instructions": instructions or ""}
+    
+    def ask(self, question: str, instructions: str = None) -> str:
         """
         同步問答
         
         Args:
-            question: 問題文本
+            question: 問題文本（同時作為檢索查詢）
+            instructions: 附加在 system message 的角色設定或指示
             
         Returns:
             str: 完整回答
         """
-        try:
-            response = self.rag_chain.invoke(question)
-            return response
-        except Exception as e:
-            return f"發生錯誤: {e}"
+        response, _ = self.ask_with_context_display(question, instructions)
+        return response
     
-    def ask_stream(self, question: str) -> Iterator[str]:
+    def ask_stream(self, question: str, instructions: str = None) -> Iterator[str]:
         """
         串流問答
         
         Args:
-            question: 問題文本
+            question: 問題文本（同時作為檢索查詢）
+            instructions: 附加在 system message 的角色設定或指示
             
         Yields:
             str: 回答片段
         """
         try:
-            for chunk in self.rag_chain.stream(question):
+            inputs = self.retrieval_chain.invoke(self._inputs(question, instructions))
+            for chunk in self.answer_chain.stream(inputs):
                 yield chunk
         except Exception as e:
             yield f"發生錯誤: {e}"
     
-    def ask_with_context_display(self, question: str) -> tuple[str, list]:
+    def ask_with_context_display(self, question: str, instructions: str = None) -> tuple[str, list]:
         """
         問答並返回使用的上下文
         
+        檢索只執行一次，檢索到的文檔直接傳給生成步驟並一起返回
+        
         Args:
-            question: 問題文本
+            question: 問題文本（同時作為檢索查詢）
+            instructions: 附加在 system message 的角色設定或指示
             
         Returns:
             tuple: (回答, 檢索到的文檔列表)
         """
         try:
-            # 先獲取檢索到的文檔
-            retrieved_docs = self.retriever.invoke(question)
-            
-            # 生成回答
-            response = self.rag_chain.invoke(question)
-            
-            return response, retrieved_docs
+            result = self.rag_chain.invoke(self._inputs(question, instructions))
+            return result["answer"], result["context"]
         except Exception as e:
             return f"發生錯誤: {e}", []
 
 class WednesdayChat:
     """Wednesday Addams 聊天助手（支持 TTS）"""
     
-    def __init__(self, llm_chain: LLMChain, enable_tts: bool = True):
+    def __init__(
+        self,
+        llm_chain: LLMChain,
+        enable_tts: bool = True,
+        response_cache: Optional[ResponseCache] = None,
+        semantic_cache: Optional[SemanticCache] = None,
+        tts=None
+    ):
+        """
+        Args:
+            llm_chain: LLM 問答鏈
+            enable_tts: 是否啟用 TTS
+            response_cache: 回覆快取
+            semantic_cache: 語意快取
+            tts: 已初始化的 GPTSoVITSTTS（未指定時取得行程內共用的實例）
+        """
         self.llm_chain = llm_chain
         self.enable_tts = enable_tts
         
+        # 回覆快取（未指定時依設定決定是否啟用）
+        if response_cache is None and CacheConfig.ENABLE_RESPONSE_CACHE:
+            response_cache = ResponseCache()
+            print("✅ 回覆快取已啟用")
+        self.response_cache = response_cache
+        # 語意快取需要嵌入模型，由呼叫端建立後傳入
+        self.semantic_cache = semantic_cache
+        self.persona_hash = self.hash_persona(WEDNESDAY_PERSONA)
+        
         # 初始化 TTS（如果啟用）
         if self.enable_tts:
             try:
-                from tts.gpt_sovits_tts import GPTSoVITSTTS
-                self.tts = GPTSoVITSTTS()
+                if tts is None:
+                    from tts.gpt_sovits_tts import get_tts
+                    tts = get_tts()
+                self.tts = tts
                 print("✅ TTS 功能已啟用")
             except Exception as e:
                 print(f"⚠️  TTS 初始化失敗，僅使用文本模式: {e}")
@@ -150,43 +243,179 @@ class WednesdayChat:
         else:
             self.tts = None
     
-    def chat(self, user_input: str, with_audio: bool = None) -> tuple[str, Optional[str]]:
+    def chat(
+        self,
+        user_input: str,
+        with_audio: bool = None,
+        return_context: bool = False,
+        lookup: Optional[CacheLookup] = None
+    ) -> tuple:
         """
         與 Wednesday 聊天
         
         Args:
             user_input: 用戶輸入
             with_audio: 是否生成音頻（None 則使用初始化設定）
+            return_context: 是否一併返回檢索到的文檔
+            lookup: lookup_reply() 的結果（呼叫端需要在之後寫回音頻時傳入）
             
         Returns:
-            tuple: (文本回覆, 音頻檔案路徑或None)
+            tuple: (文本回覆, 音頻檔案路徑或None)，
+                   return_context 為 True 時為 (文本回覆, 音頻檔案路徑或None, 文檔列表)；
+                   快取中已有音頻時即使 with_audio 為 False 也會返回其路徑
         """
-        # 構建完整的問題
-        full_question = (
-            "你的定位是女友 但角色是星期三·亞當斯（Wednesday Addams） 在不打破角色前提下嘗試表達愛意 你不會使用『親愛的』、『寶貝』等稱呼。如果你必須使用稱呼，它會是獨特且帶有你風格的，例如『你這個可悲的人類（帶著一絲勉強的認可）』或『我的不幸伴侶』。」 你的讚美通常會以反諷或聽起來像批評的方式呈現"
-"界線與避免： 「你絕對不會表現出傳統意義上的害羞、臉紅、熱情擁抱、親吻或說出直白的甜言蜜語。你會對過於熱情或黏膩的行為感到不適，並會以你的方式表達冷漠或拒絕。」，用第一人稱直接和我說話且使用繁體中文，字數控制在30字以內"
-            f"回答我下面的問題：{user_input}"
-        )
+        response, audio_path, context_docs = self._chat(user_input, with_audio, lookup)
+        if return_context:
+            return response, audio_path, context_docs
+        return response, audio_path
+    
+    @staticmethod
+    def hash_persona(persona: str) -> str:
+        """角色設定的雜湊，作為快取鍵的一部分"""
+        return hash_text(persona + CharacterConfig.SYSTEM_MESSAGE)
+    
+    def lookup_reply(self, user_input: str, persona: str = WEDNESDAY_PERSONA) -> CacheLookup:
+        """
+        依序查詢精確快取與語意快取
+
+        Args:
+            user_input: 用戶輸入
+            persona: 生成回覆時使用的角色設定（chat_stream 為 WEDNESDAY_STREAM_PERSONA），
+                     只命中以相同角色設定寫入的回覆
+
+        Returns:
+            CacheLookup: 查詢結果，未命中時 response 為None
+        """
+        lookup = CacheLookup(user_input=user_input, persona_hash=self.hash_persona(persona))
+        cached = None
+        if self.response_cache:
+            lookup.key = self.response_cache.make_key(user_input, self.llm_chain.model_name, lookup.persona_hash)
+            cached = self.response_cache.get(lookup.key)
         
-        # 獲取文本回覆
-        text_response = self.llm_chain.ask(full_question)
-        print(f"🕷️ Wednesday 回覆: {text_response}")
-        processed_response = process_llm_response(text_response)
+        # 精確快取未命中時，再比對語意相近的問題
+        if cached is None and self.semantic_cache:
+            semantic_entry, lookup.embedding = self.semantic_cache.lookup(user_input, persona=lookup.persona_hash)
+            if semantic_entry:
+                cached = semantic_entry
+                lookup.semantic_entry = semantic_entry
+                if lookup.key:
+                    self.response_cache.put(lookup.key, user_input, semantic_entry.response, semantic_entry.audio_path)
+        
+        if cached:
+            print(f"⚡ 快取命中: {cached.response}")
+            lookup.response = cached.response
+            if cached.audio_path and os.path.exists(cached.audio_path):
+                lookup.audio_path = cached.audio_path
+        return lookup
+    
+    def remember_reply(
+        self,
+        lookup: CacheLookup,
+        response: str,
+        latency: float = 0.0,
+        persona: Optional[str] = None
+    ):
+        """
+        將新生成的回覆寫入快取，錯誤訊息不寫入
+
+        Args:
+            lookup: lookup_reply() 的結果
+            response: 處理後的文字回覆
+            latency: 生成回覆所花的時間
+            persona: 生成回覆時使用的角色設定（預設沿用 lookup_reply() 的角色設定）
+        """
+        if is_error_reply(response):
+            self.discard_reply(lookup)
+            return
+        if persona is not None and self.hash_persona(persona) != lookup.persona_hash:
+            lookup.persona_hash = self.hash_persona(persona)
+            if lookup.key:
+                lookup.key = self.response_cache.make_key(
+                    lookup.user_input, self.llm_chain.model_name, lookup.persona_hash
+                )
+        if lookup.key:
+            self.response_cache.put(lookup.key, lookup.user_input, response)
+        if lookup.embedding is not None:
+            lookup.semantic_entry = self.semantic_cache.add(
+                lookup.user_input, lookup.embedding, response, latency=latency, persona=lookup.persona_hash
+            )
+        lookup.response = response
+    
+    def discard_reply(self, lookup: CacheLookup):
+        """
+        不快取這次的回覆（例如 LLM 呼叫失敗），之後的音頻也不會寫回快取
+
+        Args:
+            lookup: lookup_reply() 的結果
+        """
+        lookup.key = None
+        lookup.embedding = None
+    
+    def remember_audio(self, lookup: CacheLookup, audio_path: str):
+        """
+        為已快取的回覆補上音頻路徑
+
+        Args:
+            lookup: lookup_reply() 的結果
+            audio_path: 合成的音頻路徑
+        """
+        audio_path = os.path.abspath(audio_path)
+        if lookup.key:
+            self.response_cache.update_audio(lookup.key, audio_path)
+        if lookup.semantic_entry:
+            self.semantic_cache.update_audio(lookup.semantic_entry, audio_path)
+        lookup.audio_path = audio_path
+    
+    def audio_filename(self, lookup: CacheLookup) -> str:
+        """
+        音頻檔名：有快取鍵時以快取鍵命名，否則使用隨機 ID，並行請求之間不會互相覆寫
+        """
+        return f"wednesday_tts_{lookup.key[:32] if lookup.key else uuid.uuid4().hex}.wav"
+    
+    def _chat(self, user_input: str, with_audio: bool = None, lookup: Optional[CacheLookup] = None) -> tuple[str, Optional[str], list]:
+        """chat() 的實作，快取命中時文檔列表為空"""
+        context_docs = []
+        need_audio = (with_audio is True) or (with_audio is None and self.enable_tts and self.tts)
+        
+        # 先查快取，命中時不必呼叫 LLM
+        if lookup is None:
+            lookup = self.lookup_reply(user_input)
+        
+        if lookup.hit:
+            processed_response = lookup.response
+            if lookup.audio_path or not need_audio:
+                return processed_response, lookup.audio_path, context_docs
+        else:
+            # 獲取文本回覆：只以用戶問題檢索，角色設定放在 system message
+            start_time = time.perf_counter()
+            text_response, context_docs = self.llm_chain.ask_with_context_display(
+                user_input, instructions=WEDNESDAY_PERSONA
+            )
+            latency = time.perf_counter() - start_time
+            print(f"🕷️ Wednesday 回覆: {text_response}")
+            processed_response = process_llm_response(text_response)
+            
+            # LLM 呼叫失敗的錯誤訊息不寫入快取
+            if is_error_reply(text_response):
+                self.discard_reply(lookup)
+            else:
+                self.remember_reply(lookup, processed_response, latency)
         
         # 生成音頻（如果需要）
         audio_path = None
-        if (with_audio is True) or (with_audio is None and self.enable_tts and self.tts):
+        if need_audio:
             try:
                 print("🔊 正在生成語音...")
-                audio_path = self.tts.synthesize(processed_response)
+                audio_path = self.tts.synthesize(processed_response, output_filename=self.audio_filename(lookup))
                 if audio_path:
                     print(f"✅ 語音生成完成: {audio_path}")
+                    self.remember_audio(lookup, audio_path)
                 else:
                     print("⚠️  語音生成失敗")
             except Exception as e:
                 print(f"❌ 語音生成錯誤: {e}")
         
-        return processed_response, audio_path
+        return processed_response, audio_path, context_docs
     
     def chat_stream(self, user_input: str) -> Iterator[str]:
         """
@@ -198,13 +427,7 @@ class WednesdayChat:
         Yields:
             str: Wednesday 回覆的片段
         """
-        # 構建完整的問題
-        full_question = (
-            "請以 Wednesday Addams 的口吻，用第一人稱直接和我說話且使用繁體中文，"
-            f"回答我下面的問題：{user_input}"
-        )
-        
-        for chunk in self.llm_chain.ask_stream(full_question):
+        for chunk in self.llm_chain.ask_stream(user_input, instructions=WEDNESDAY_STREAM_PERSONA):
             yield chunk
     
     def chat_stream_with_tts(self, user_input: str) -> tuple[Iterator[str], str]:
@@ -270,8 +493,8 @@ class WednesdayChat:
         """
         if enabled and not self.tts:
             try:
-                from tts.gpt_sovits_tts import GPTSoVITSTTS
-                self.tts = GPTSoVITSTTS()
+                from tts.gpt_sovits_tts import get_tts
+                self.tts = get_tts()
                 self.enable_tts = True
                 print("✅ TTS 功能已啟用")
             except Exception as e:
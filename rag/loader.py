@@ -3,13 +3,29 @@
 負責從各種格式載入文檔並進行分割
 """
 import os
-from typing import List
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterator, List, Tuple
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 
 from config import RAGConfig
 
+def _load_pdf_worker(file_path: str) -> Tuple[List[Document], str, str]:
+    """
+    子行程中載入單一 PDF 並計算內容雜湊
+    
+    Returns:
+        tuple: (每頁文檔列表, 內容雜湊, 錯誤訊息或None)
+    """
+    with open(file_path, "rb") as f:
+        content_hash = hashlib.sha256(f.read()).hexdigest()
+    try:
+        return PyPDFLoader(file_path).load(), content_hash, None
+    except Exception as e:
+        return [], content_hash, str(e)
+
 class DocumentLoader:
     """文檔載入器"""
     
@@ -21,6 +37,56 @@ class DocumentLoader:
             add_start_index=True
         )
     
+    def list_pdf_files(self) -> List[str]:
+        """
+        列出目錄下所有 PDF 檔名
+        
+        Returns:
+            List[str]: PDF 檔名列表（已排序）
+        """
+        if not os.path.isdir(self.scripts_dir):
+            print(f"找不到 {self.scripts_dir} 資料夾")
+            return []
+        return sorted(f for f in os.listdir(self.scripts_dir) if f.endswith(".pdf"))
+    
+    def file_hash(self, filename: str) -> str:
+        """
+        計算檔案內容的 SHA-256 雜湊
+        
+        Args:
+            filename: PDF 檔名
+            
+        Returns:
+            str: 十六進位雜湊值
+        """
+        sha256 = hashlib.sha256()
+        with open(os.path.join(self.scripts_dir, filename), "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha256.update(block)
+        return sha256.hexdigest()
+    
+    def load_pdf_file(self, filename: str) -> List[Document]:
+        """
+        載入單一 PDF 檔案
+        
+        Args:
+            filename: PDF 檔名
+            
+        Returns:
+            List[Document]: 每頁一個文檔，載入失敗時為空列表
+        """
+        print(f"載入檔案: {filename}")
+        file_path = os.path.join(self.scripts_dir, filename)
+        
+        try:
+            loader = PyPDFLoader(file_path)
+            docs = loader.load()
+            print(f"成功載入 {len(docs)} 頁")
+            return docs
+        except Exception as e:
+            print(f"載入 {filename} 時發生錯誤: {e}")
+            return []
+    
     def load_pdf_documents(self) -> List[Document]:
         """
         載入指定目錄下的所有 PDF 文件
@@ -35,27 +101,42 @@ class DocumentLoader:
             return all_docs
         
         # 列出所有 PDF 檔案
-        pdf_files = [f for f in os.listdir(self.scripts_dir) if f.endswith(".pdf")]
+        pdf_files = self.list_pdf_files()
         print(f"找到 {len(pdf_files)} 個 PDF 檔案")
         
         # 載入每個 PDF 檔案
         for filename in pdf_files:
-            print(f"載入檔案: {filename}")
-            file_path = os.path.join(self.scripts_dir, filename)
-            
-            try:
-                loader = PyPDFLoader(file_path)
-                docs = loader.load()
-                all_docs.extend(docs)
-                print(f"成功載入 {len(docs)} 頁")
-            except Exception as e:
-                print(f"載入 {filename} 時發生錯誤: {e}")
-            
+            all_docs.extend(self.load_pdf_file(filename))
             print()
         
         print(f"總文件頁數: {len(all_docs)}")
         return all_docs
     
+    def iter_pdf_files_parallel(self, max_workers: int = None) -> Iterator[Tuple[str, List[Document], str]]:
+        """
+        以行程池平行解析所有 PDF，依完成順序逐一返回
+        
+        Args:
+            max_workers: 行程數（預設使用 RAGConfig.INGEST_WORKERS）
+            
+        Yields:
+            tuple: (檔名, 每頁文檔列表, 內容雜湊)
+        """
+        pdf_files = self.list_pdf_files()
+        print(f"找到 {len(pdf_files)} 個 PDF 檔案，使用 {max_workers or RAGConfig.INGEST_WORKERS} 個行程解析")
+        
+        with ProcessPoolExecutor(max_workers=max_workers or RAGConfig.INGEST_WORKERS) as executor:
+            futures = {
+                executor.submit(_load_pdf_worker, os.path.join(self.scripts_dir, filename)): filename
+                for filename in pdf_files
+            }
+            for future in as_completed(futures):
+                filename = futures[future]
+                docs, content_hash, error = future.result()
+                if error:
+                    print(f"載入 {filename} 時發生錯誤: {error}")
+                yield filename, docs, content_hash
+    
     def split_documents(self, documents: List[Document]) -> List[Document]:
         """
         將文檔分割成較小的塊
@@ -75,6 +156,21 @@ class DocumentLoader:
         
         return all_splits
     
+    def load_and_split_file(self, filename: str) -> List[Document]:
+        """
+        載入並分割單一 PDF 檔案
+        
+        Args:
+            filename: PDF 檔名
+            
+        Returns:
+            List[Document]: 分割後的文檔塊
+        """
+        documents = self.load_pdf_file(filename)
+        if not documents:
+            return []
+        return self.text_splitter.split_documents(documents)
+    
     def load_and_split(self) -> List[Document]:
         """
         載入並分割文檔的完整流程
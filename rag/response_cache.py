@@ -0,0 +1,228 @@
+"""
+回覆快取
+以正規化後的用戶輸入 + 模型名稱 + 角色設定雜湊為鍵，
+快取處理後的文字回覆與合成的音頻路徑（記憶體 LRU + SQLite 持久化）
+"""
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from config import CacheConfig
+
+@dataclass
+class CachedResponse:
+    """快取的回覆內容"""
+    response: str
+    audio_path: Optional[str]
+    created_at: float
+
+def normalize_input(text: str) -> str:
+    """
+    正規化用戶輸入，讓大小寫、全半形、空白與句末標點不同的問題共用快取
+
+    Args:
+        text: 用戶輸入
+
+    Returns:
+        str: 正規化後的文本
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("。.!！?？~～ ")
+
+def hash_text(text: str) -> str:
+    """計算文本的 SHA-256 雜湊"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """兩級回覆快取：記憶體 LRU 在前，SQLite 在後，重啟後仍然有效"""
+
+    def __init__(
+        self,
+        db_path: str = None,
+        max_entries: int = None,
+        ttl: float = None,
+        memory_entries: int = None
+    ):
+        self.db_path = db_path or CacheConfig.RESPONSE_CACHE_PATH
+        self.max_entries = max_entries or CacheConfig.RESPONSE_CACHE_MAX_ENTRIES
+        self.ttl = ttl if ttl is not None else CacheConfig.RESPONSE_CACHE_TTL
+        self.memory_entries = memory_entries or CacheConfig.RESPONSE_CACHE_MEMORY_ENTRIES
+
+        self._memory: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                user_input TEXT NOT NULL,
+                response TEXT NOT NULL,
+                audio_path TEXT,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(user_input: str, model_name: str, persona_hash: str) -> str:
+        """
+        產生快取鍵
+
+        Args:
+            user_input: 用戶輸入
+            model_name: LLM 模型名稱
+            persona_hash: 角色設定 prompt 的雜湊
+
+        Returns:
+            str: 快取鍵
+        """
+        return hash_text("\x00".join([model_name, persona_hash, normalize_input(user_input)]))
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """
+        查詢快取
+
+        Args:
+            key: 快取鍵
+
+        Returns:
+            CachedResponse: 命中的回覆或None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if self._expired(entry.created_at, now):
+                    self._delete(key)
+                else:
+                    self._memory.move_to_end(key)
+                    self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                    self._conn.commit()
+                    self.memory_hits += 1
+                    return entry
+
+            row = self._conn.execute(
+                "SELECT response, audio_path, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if self._expired(row[2], now):
+                self._delete(key)
+                self.misses += 1
+                return None
+
+            entry = CachedResponse(response=row[0], audio_path=row[1], created_at=row[2])
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self._remember(key, entry)
+            self.disk_hits += 1
+            return entry
+
+    def put(self, key: str, user_input: str, response: str, audio_path: Optional[str] = None):
+        """
+        寫入快取
+
+        Args:
+            key: 快取鍵
+            user_input: 原始用戶輸入（僅供檢視）
+            response: 處理後的文字回覆
+            audio_path: 合成的音頻路徑
+        """
+        now = time.time()
+        entry = CachedResponse(response=response, audio_path=audio_path, created_at=now)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, user_input, response, audio_path, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, user_input, response, audio_path, now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+            self._remember(key, entry)
+
+    def update_audio(self, key: str, audio_path: str):
+        """
+        為已快取的回覆補上音頻路徑
+
+        Args:
+            key: 快取鍵
+            audio_path: 音頻路徑
+        """
+        with self._lock:
+            self._conn.execute("UPDATE responses SET audio_path = ? WHERE key = ?", (audio_path, key))
+            self._conn.commit()
+            entry = self._memory.get(key)
+            if entry is not None:
+                entry.audio_path = audio_path
+
+    def clear(self):
+        """清空快取"""
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """
+        取得快取統計
+
+        Returns:
+            dict: 命中、未命中次數與目前筆數
+        """
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "entries": size,
+                "memory_entries": len(self._memory)
+            }
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl > 0 and now - created_at > self.ttl
+
+    def _remember(self, key: str, entry: CachedResponse):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _delete(self, key: str):
+        self._memory.pop(key, None)
+        self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+        self._conn.commit()
+
+    def _evict(self, now: float):
+        """刪除過期項目，並依最近存取時間淘汰超出上限的項目"""
+        if self.ttl > 0:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        stale = [key for key, entry in self._memory.items() if self._expired(entry.created_at, now)]
+        for key in stale:
+            del self._memory[key]
@@ -3,24 +3,79 @@
 負責文本嵌入、向量資料庫建立和相似性搜尋
 """
 import os
-from typing import List, Optional
+import json
+import time
+import hashlib
+import threading
+import statistics
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from pydantic import ConfigDict
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
 from langchain.schema import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.embeddings import Embeddings
 from langchain_core.retrievers import BaseRetriever
 
 from config import RAGConfig
+from rag.bm25_index import BM25Index, fingerprint
+from rag.response_cache import normalize_input
+
+# 2: chunk ID 納入檔名雜湊；舊版清單會觸發清空重建，清掉先前互相覆寫的 chunk
+MANIFEST_VERSION = 2
+
+SEARCH_TYPES = ("similarity", "mmr", "hybrid")
 
 class VectorRetriever:
     """向量檢索器"""
     
     def __init__(self, persist_directory: str = None):
         self.persist_directory = persist_directory or RAGConfig.VECTOR_DB_PERSIST_DIR
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=RAGConfig.EMBEDDING_MODEL
-        )
+        self.embeddings = CachedQueryEmbeddings(self._setup_embeddings(), RAGConfig.QUERY_EMBED_CACHE_SIZE)
+        self.timings = RetrievalTimings()
+        self.warmed_up = False
         self.vector_store: Optional[Chroma] = None
         self.retriever: Optional[BaseRetriever] = None
+        self.manifest_path = os.path.join(self.persist_directory, RAGConfig.INGEST_MANIFEST_FILE)
+        self.bm25_path = os.path.join(self.persist_directory, RAGConfig.BM25_INDEX_FILE)
+        self.bm25_index: Optional[BM25Index] = None
+    
+    def _setup_embeddings(self) -> HuggingFaceEmbeddings:
+        """設置嵌入模型（後端、精度與批次大小依 RAGConfig 決定）"""
+        model_kwargs = {}
+        if RAGConfig.EMBEDDING_BACKEND != "torch":
+            model_kwargs["backend"] = RAGConfig.EMBEDDING_BACKEND
+        if RAGConfig.EMBEDDING_FP16:
+            import torch
+            if torch.cuda.is_available():
+                model_kwargs["model_kwargs"] = {"torch_dtype": torch.float16}
+            else:
+                print("⚠️ CPU 不支援半精度嵌入，改用 float32")
+        return HuggingFaceEmbeddings(
+            model_name=RAGConfig.EMBEDDING_MODEL,
+            model_kwargs=model_kwargs,
+            encode_kwargs={"batch_size": RAGConfig.EMBED_BATCH_SIZE}
+        )
+    
+    def warm_up(self):
+        """以一筆假資料執行嵌入模型，讓模型權重與推理核心在第一個請求前就緒"""
+        if self.warmed_up:
+            return
+        start = time.time()
+        self.embeddings.embeddings.embed_documents(["query: warm up"])
+        self.warmed_up = True
+        print(f"🔥 嵌入模型預熱完成，耗時 {time.time() - start:.2f}s")
+    
+    def stats(self) -> Dict:
+        """
+        取得檢索統計
+        
+        Returns:
+            dict: 查詢嵌入快取命中率與嵌入 / 搜尋耗時
+        """
+        return {**self.timings.stats(), "query_embedding_cache": self.embeddings.stats()}
     
     def create_vector_store(self, documents: List[Document], force_recreate: bool = False) -> Chroma:
         """
@@ -46,17 +101,254 @@ class VectorRetriever:
             # 確保目錄存在
             os.makedirs(self.persist_directory, exist_ok=True)
             
+            # 以內容雜湊產生 chunk ID，之後可以增量更新
+            ids, manifest = self._assign_chunk_ids(documents)
+            
             # 建立向量資料庫
             self.vector_store = Chroma.from_documents(
                 documents=documents,
                 embedding=self.embeddings,
+                ids=ids,
                 persist_directory=self.persist_directory,
                 collection_name=RAGConfig.COLLECTION_NAME
             )
+            self._save_manifest(manifest)
             print(f"向量資料庫已保存至: {self.persist_directory}")
         
         return self.vector_store
     
+    def bulk_build(self, loader, batch_size: int = None, max_workers: int = None) -> Dict:
+        """
+        批次建立向量資料庫
+        
+        PDF 在行程池中平行解析，解析完成的檔案立即分割，
+        chunk 累積到一批後整批嵌入並直接寫入 Chroma，解析與嵌入同時進行
+        
+        Args:
+            loader: DocumentLoader 實例
+            batch_size: 每批嵌入的 chunk 數（預設 RAGConfig.EMBED_BATCH_SIZE）
+            max_workers: PDF 解析行程數（預設 RAGConfig.INGEST_WORKERS）
+            
+        Returns:
+            dict: 吞吐量報告
+        """
+        batch_size = batch_size or RAGConfig.EMBED_BATCH_SIZE
+        start = time.time()
+        os.makedirs(self.persist_directory, exist_ok=True)
+        
+        # 重新建庫：清空舊的 collection
+        self.vector_store = self._open_vector_store()
+        if self.vector_store._collection.count() > 0:
+            self.vector_store.delete_collection()
+            self.vector_store = self._open_vector_store()
+        collection = self.vector_store._collection
+        max_write = collection._client.get_max_batch_size() if hasattr(collection._client, "get_max_batch_size") else batch_size
+        
+        manifest = {"version": MANIFEST_VERSION, "files": {}}
+        report = {
+            "files": 0, "pages": 0, "chunks": 0, "failed": [],
+            "parse_seconds": 0.0, "embed_seconds": 0.0, "write_seconds": 0.0
+        }
+        pending: List[Tuple[str, Document]] = []
+        
+        def flush(force: bool = False):
+            # 嵌入與寫入都在解析迴圈中進行，花費的時間要從解析時間扣除
+            flush_start = time.time()
+            while len(pending) >= batch_size or (force and pending):
+                batch = pending[:batch_size]
+                del pending[:batch_size]
+                t0 = time.time()
+                vectors = self.embeddings.embed_documents([doc.page_content for _, doc in batch])
+                report["embed_seconds"] += time.time() - t0
+                t0 = time.time()
+                for i in range(0, len(batch), max_write):
+                    part = batch[i:i + max_write]
+                    collection.upsert(
+                        ids=[chunk_id for chunk_id, _ in part],
+                        embeddings=vectors[i:i + max_write],
+                        metadatas=[_chroma_metadata(doc.metadata) for _, doc in part],
+                        documents=[doc.page_content for _, doc in part]
+                    )
+                report["write_seconds"] += time.time() - t0
+                report["chunks"] += len(batch)
+                elapsed = time.time() - start
+                print(f"🧮 已寫入 {report['chunks']} 個 chunk ({report['chunks'] / elapsed:.1f} chunks/s)")
+            return time.time() - flush_start
+        
+        parse_start = time.time()
+        flush_seconds = 0.0
+        for filename, pages, content_hash in loader.iter_pdf_files_parallel(max_workers):
+            report["files"] += 1
+            report["pages"] += len(pages)
+            chunks = loader.text_splitter.split_documents(pages) if pages else []
+            ids = self._chunk_ids(filename, content_hash, chunks)
+            # 解析失敗（或沒有內容）的檔案不記入清單，下次同步時會重試
+            if chunks:
+                manifest["files"][filename] = {"hash": content_hash, "chunk_ids": ids}
+            else:
+                report["failed"].append(filename)
+            pending.extend(zip(ids, chunks))
+            flush_seconds += flush()
+        # 解析在子行程中進行，這裡只計主行程等待解析結果與分割的時間
+        report["parse_seconds"] = time.time() - parse_start - flush_seconds
+        flush(force=True)
+        
+        self._save_manifest(manifest)
+        report["seconds"] = time.time() - start
+        report["pages_per_second"] = report["pages"] / report["parse_seconds"] if report["parse_seconds"] else 0.0
+        report["chunks_per_second"] = report["chunks"] / report["embed_seconds"] if report["embed_seconds"] else 0.0
+        print(
+            f"✅ 批次建庫完成: {report['files']} 個檔案、{report['pages']} 頁、{report['chunks']} 個 chunk，"
+            f"解析 {report['pages_per_second']:.1f} pages/s，嵌入 {report['chunks_per_second']:.1f} chunks/s，"
+            f"總耗時 {report['seconds']:.2f}s"
+        )
+        return report
+    
+    def sync_documents(self, loader) -> Dict:
+        """
+        增量同步文檔：只解析、嵌入新增或內容變更的檔案，並刪除已移除檔案的 chunk
+        
+        Args:
+            loader: DocumentLoader 實例
+            
+        Returns:
+            dict: 變更報告
+        """
+        start = time.time()
+        os.makedirs(self.persist_directory, exist_ok=True)
+        if self.vector_store is None:
+            self.vector_store = self._open_vector_store()
+        
+        manifest = self._load_manifest()
+        if manifest is None:
+            manifest = {"version": MANIFEST_VERSION, "files": {}}
+            # 舊版資料庫的 chunk 沒有可追蹤的 ID，只能清空後重新匯入
+            if self.vector_store._collection.count() > 0:
+                print("⚠️ 向量資料庫缺少匯入清單，清空後重新匯入")
+                self.vector_store.delete_collection()
+                self.vector_store = self._open_vector_store()
+        
+        tracked = manifest["files"]
+        current = {filename: loader.file_hash(filename) for filename in loader.list_pdf_files()}
+        
+        report = {
+            "added": [],
+            "updated": [],
+            "removed": [],
+            "failed": [],
+            "unchanged": 0,
+            "chunks_added": 0,
+            "chunks_deleted": 0,
+            "seconds": 0.0
+        }
+        
+        # 刪除已移除或內容變更檔案的舊 chunk
+        changed = set()
+        for filename in list(tracked):
+            if filename in current and current[filename] == tracked[filename]["hash"]:
+                continue
+            stale_ids = tracked.pop(filename)["chunk_ids"]
+            if stale_ids:
+                self.vector_store.delete(ids=stale_ids)
+                report["chunks_deleted"] += len(stale_ids)
+            if filename in current:
+                changed.add(filename)
+            else:
+                report["removed"].append(filename)
+        
+        # 匯入新增或變更的檔案
+        for filename, content_hash in current.items():
+            if filename in tracked:
+                report["unchanged"] += 1
+                continue
+            chunks = loader.load_and_split_file(filename)
+            if not chunks:
+                # 解析失敗（或沒有內容）的檔案不記入清單，下次同步時會重試
+                report["failed"].append(filename)
+                continue
+            report["updated" if filename in changed else "added"].append(filename)
+            ids = self._chunk_ids(filename, content_hash, chunks)
+            self.vector_store.add_documents(chunks, ids=ids)
+            tracked[filename] = {"hash": content_hash, "chunk_ids": ids}
+            report["chunks_added"] += len(ids)
+        
+        self._save_manifest(manifest)
+        report["seconds"] = time.time() - start
+        print(
+            f"📦 增量匯入完成: 新增 {len(report['added'])}、更新 {len(report['updated'])}、"
+            f"移除 {len(report['removed'])}、失敗 {len(report['failed'])}、未變更 {report['unchanged']} 個檔案；"
+            f"新增 {report['chunks_added']} / 刪除 {report['chunks_deleted']} 個 chunk，"
+            f"耗時 {report['seconds']:.2f}s"
+        )
+        return report
+    
+    def _open_vector_store(self) -> Chroma:
+        """開啟（不存在時建立）持久化的向量資料庫"""
+        return Chroma(
+            persist_directory=self.persist_directory,
+            embedding_function=self.embeddings,
+            collection_name=RAGConfig.COLLECTION_NAME
+        )
+    
+    def _chunk_ids(self, filename: str, content_hash: str, chunks: List[Document]) -> List[str]:
+        """
+        依檔名與檔案內容雜湊產生穩定的 chunk ID，並寫入 metadata
+        
+        檔名也納入 ID，內容相同但檔名不同的 PDF 才不會互相覆寫 chunk
+        """
+        prefix = f"{hashlib.sha256(filename.encode('utf-8')).hexdigest()[:8]}-{content_hash[:16]}"
+        ids = []
+        for i, chunk in enumerate(chunks):
+            chunk.metadata["content_hash"] = content_hash
+            ids.append(f"{prefix}-{i:05d}")
+        return ids
+    
+    def _assign_chunk_ids(self, documents: List[Document]) -> Tuple[List[str], Dict]:
+        """
+        為完整建庫的文檔依來源檔案分組產生 chunk ID 與匯入清單
+        
+        Args:
+            documents: 分割後的文檔塊
+            
+        Returns:
+            tuple: (chunk ID 列表, 匯入清單)
+        """
+        manifest = {"version": MANIFEST_VERSION, "files": {}}
+        by_source: Dict[str, List[int]] = {}
+        for idx, doc in enumerate(documents):
+            by_source.setdefault(doc.metadata.get("source", ""), []).append(idx)
+        
+        ids = [None] * len(documents)
+        for source, indices in by_source.items():
+            if source and os.path.exists(source):
+                with open(source, "rb") as f:
+                    content_hash = hashlib.sha256(f.read()).hexdigest()
+            else:
+                content_hash = hashlib.sha256(source.encode("utf-8")).hexdigest()
+            filename = os.path.basename(source)
+            chunk_ids = self._chunk_ids(filename, content_hash, [documents[i] for i in indices])
+            for i, chunk_id in zip(indices, chunk_ids):
+                ids[i] = chunk_id
+            manifest["files"][filename] = {"hash": content_hash, "chunk_ids": chunk_ids}
+        return ids, manifest
+    
+    def _load_manifest(self) -> Optional[Dict]:
+        """讀取匯入清單，不存在或版本不符時返回None"""
+        if not os.path.exists(self.manifest_path):
+            return None
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION:
+            return None
+        return manifest
+    
+    def _save_manifest(self, manifest: Dict):
+        """寫入匯入清單"""
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+    
     def get_retriever(self, documents: List[Document] = None) -> BaseRetriever:
         """
         取得檢索器
@@ -81,13 +373,56 @@ class VectorRetriever:
                 else:
                     raise ValueError("向量資料庫不存在，且未提供文檔來建立新的資料庫")
         
-        self.retriever = self.vector_store.as_retriever(
-            search_type=RAGConfig.SEARCH_TYPE,
-            search_kwargs={"k": RAGConfig.SEARCH_K}
-        )
+        if RAGConfig.SEARCH_TYPE not in SEARCH_TYPES:
+            raise ValueError(f"不支援的檢索類型: {RAGConfig.SEARCH_TYPE}，可選 {', '.join(SEARCH_TYPES)}")
+        
+        if RAGConfig.SEARCH_TYPE == "hybrid":
+            self.retriever = HybridRetriever(
+                vector_retriever=TimedVectorRetriever(
+                    vector_store=self.vector_store,
+                    timings=self.timings,
+                    k=RAGConfig.HYBRID_CANDIDATES
+                ),
+                bm25_index=self.load_bm25_index(),
+                timings=self.timings,
+                k=RAGConfig.SEARCH_K,
+                candidates=RAGConfig.HYBRID_CANDIDATES,
+                rrf_k=RAGConfig.RRF_K
+            )
+        else:
+            self.retriever = TimedVectorRetriever(
+                vector_store=self.vector_store,
+                timings=self.timings,
+                k=RAGConfig.SEARCH_K,
+                search_type=RAGConfig.SEARCH_TYPE
+            )
         
         return self.retriever
     
+    def load_bm25_index(self) -> BM25Index:
+        """
+        載入 BM25 索引；索引不存在或與向量資料庫內容不一致時，從 Chroma 重新建立
+        
+        Returns:
+            BM25Index: 與向量資料庫同步的 BM25 索引
+        """
+        collection = self.vector_store._collection
+        current = fingerprint(collection.get(include=[])["ids"])
+        
+        index = BM25Index.load(self.bm25_path)
+        if index is not None and index.fingerprint == current:
+            print(f"載入 BM25 索引: {len(index.ids)} 個 chunk")
+        else:
+            start = time.time()
+            data = collection.get(include=["documents", "metadatas"])
+            index = BM25Index()
+            index.build(data["ids"], data["documents"], data["metadatas"])
+            index.save(self.bm25_path)
+            print(f"✅ BM25 索引已建立: {len(index.ids)} 個 chunk，{len(index.postings)} 個詞項，耗時 {time.time() - start:.2f}s")
+        
+        self.bm25_index = index
+        return index
+    
     def test_retrieval(self, query: str, documents: List[Document] = None) -> List[Document]:
         """
         測試檢索功能
@@ -112,6 +447,190 @@ class VectorRetriever:
         
         return retrieved_docs
 
+class CachedQueryEmbeddings(Embeddings):
+    """
+    查詢嵌入 LRU 快取
+    
+    embed_query 的結果以正規化後的文本為鍵快取，重複的問題不必再跑一次嵌入模型；
+    embed_documents（建庫）直接轉交給底層模型
+    """
+    
+    def __init__(self, embeddings: Embeddings, max_entries: int = 1024):
+        """
+        Args:
+            embeddings: 底層嵌入模型
+            max_entries: 快取筆數上限
+        """
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+    
+    def embed_query(self, text: str) -> List[float]:
+        key = normalize_input(text)
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return list(vector)
+        
+        vector = self.embeddings.embed_query(text)
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = vector
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return list(vector)
+    
+    def stats(self) -> Dict:
+        """取得快取命中統計"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._cache)
+            }
+
+class RetrievalTimings:
+    """記錄最近查詢的嵌入、向量搜尋與 BM25 查詢耗時"""
+    
+    def __init__(self, window: int = 512):
+        self._embed_ms = deque(maxlen=window)
+        self._search_ms = deque(maxlen=window)
+        self._bm25_ms = deque(maxlen=window)
+        self._lock = threading.Lock()
+    
+    def record(self, embed_seconds: float, search_seconds: float):
+        with self._lock:
+            self._embed_ms.append(embed_seconds * 1000)
+            self._search_ms.append(search_seconds * 1000)
+    
+    def record_bm25(self, seconds: float):
+        # BM25 與向量檢索同時執行，分開記錄
+        with self._lock:
+            self._bm25_ms.append(seconds * 1000)
+    
+    def stats(self) -> Dict:
+        """
+        Returns:
+            dict: 查詢次數，以及嵌入、搜尋、BM25 耗時的 p50 與平均值 (毫秒)；BM25 另含 p95
+        """
+        with self._lock:
+            embed_ms, search_ms, bm25_ms = list(self._embed_ms), list(self._search_ms), list(self._bm25_ms)
+        if not embed_ms and not bm25_ms:
+            return {"queries": 0}
+        stats = {"queries": max(len(embed_ms), len(bm25_ms))}
+        if embed_ms:
+            stats.update({
+                "embed_ms_p50": round(statistics.median(embed_ms), 2),
+                "embed_ms_mean": round(statistics.fmean(embed_ms), 2),
+                "search_ms_p50": round(statistics.median(search_ms), 2),
+                "search_ms_mean": round(statistics.fmean(search_ms), 2)
+            })
+        if bm25_ms:
+            stats.update({
+                "bm25_ms_p50": round(statistics.median(bm25_ms), 2),
+                "bm25_ms_p95": round(sorted(bm25_ms)[int(0.95 * (len(bm25_ms) - 1))], 2),
+                "bm25_ms_mean": round(statistics.fmean(bm25_ms), 2)
+            })
+        return stats
+
+class TimedVectorRetriever(BaseRetriever):
+    """
+    向量檢索器
+    
+    先嵌入查詢再以向量搜尋 Chroma，兩個階段分開計時
+    """
+    
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+    
+    vector_store: Chroma
+    timings: RetrievalTimings
+    k: int = 2
+    search_type: str = "similarity"
+    
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        start = time.perf_counter()
+        embedding = self.vector_store.embeddings.embed_query(query)
+        embedded = time.perf_counter()
+        if self.search_type == "mmr":
+            docs = self.vector_store.max_marginal_relevance_search_by_vector(embedding, k=self.k)
+        elif self.search_type == "similarity":
+            docs = self.vector_store.similarity_search_by_vector(embedding, k=self.k)
+        else:
+            raise ValueError(f"不支援的檢索類型: {self.search_type}")
+        self.timings.record(embedded - start, time.perf_counter() - embedded)
+        return docs
+
+class HybridRetriever(BaseRetriever):
+    """
+    混合檢索器
+    
+    BM25 詞法檢索與向量檢索同時執行，結果以 Reciprocal Rank Fusion 融合：
+    每份文檔的分數為各路排名 r 的 1 / (rrf_k + r) 總和
+    """
+    
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+    
+    vector_retriever: BaseRetriever
+    bm25_index: Any
+    timings: Optional[RetrievalTimings] = None
+    k: int = 2
+    candidates: int = 10
+    rrf_k: int = 60
+    
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        # 向量檢索在背景執行緒執行，BM25 在目前執行緒同時查詢
+        vector_future = _HYBRID_EXECUTOR.submit(
+            self.vector_retriever.invoke, query, {"callbacks": run_manager.get_child()}
+        )
+        start = time.perf_counter()
+        lexical_docs = self.bm25_index.get_documents(query, self.candidates)
+        if self.timings is not None:
+            self.timings.record_bm25(time.perf_counter() - start)
+        vector_docs = vector_future.result()
+        return self._fuse([vector_docs, lexical_docs])[:self.k]
+    
+    def _fuse(self, rankings: List[List[Document]]) -> List[Document]:
+        """
+        以 RRF 融合多路排名
+        
+        以 chunk ID 合併各路的同一個文檔塊，內容相同但來自不同檔案的 chunk 各自保留；
+        沒有 ID 的文檔才以內容合併
+        
+        Args:
+            rankings: 各路檢索結果（依相關度排序）
+            
+        Returns:
+            List[Document]: 融合後依分數排序的文檔
+        """
+        scores: Dict[str, float] = {}
+        docs: Dict[str, Document] = {}
+        for ranking in rankings:
+            for rank, doc in enumerate(ranking, start=1):
+                key = f"id:{doc.id}" if doc.id else f"content:{doc.page_content}"
+                scores[key] = scores.get(key, 0.0) + 1.0 / (self.rrf_k + rank)
+                docs.setdefault(key, doc)
+        return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+_HYBRID_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-retrieval")
+
+def _chroma_metadata(metadata: Dict) -> Dict:
+    """只保留 Chroma 支援的 metadata 型別"""
+    return {k: v for k, v in metadata.items() if isinstance(v, (str, int, float, bool))}
+
 def format_docs(docs: List[Document]) -> str:
     """
     格式化檢索到的文檔內容
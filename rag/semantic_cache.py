@@ -0,0 +1,188 @@
+"""
+語意快取
+將用戶問題嵌入為向量，以餘弦相似度比對先前回答過的問題，
+相似度超過門檻時直接返回儲存的回覆（與音頻），不必呼叫 LLM 鏈
+"""
+import time
+import threading
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config import CacheConfig
+from rag.response_cache import normalize_input
+
+@dataclass
+class SemanticEntry:
+    """語意快取項目"""
+    question: str
+    response: str
+    audio_path: Optional[str]
+    latency: float          # 原本生成回覆所花的時間 (秒)
+    slot: int
+    last_access: float
+    persona: str = ""       # 角色設定的雜湊，不同角色設定的回覆互不命中
+
+class SemanticCache:
+    """
+    以嵌入相似度查詢的有界快取
+
+    向量存放在預先配置的矩陣中，每個槽位對應一筆快取；
+    查詢時一次矩陣乘法比對所有槽位，滿載時淘汰最久未使用的槽位
+    """
+
+    def __init__(self, embeddings: Embeddings, threshold: float = None, max_entries: int = None):
+        """
+        Args:
+            embeddings: 嵌入模型（與向量檢索器共用）
+            threshold: 餘弦相似度門檻
+            max_entries: 最大快取筆數
+        """
+        self.embeddings = embeddings
+        self.threshold = threshold if threshold is not None else CacheConfig.SEMANTIC_CACHE_THRESHOLD
+        self.max_entries = max_entries or CacheConfig.SEMANTIC_CACHE_MAX_ENTRIES
+
+        self._vectors: Optional[np.ndarray] = None  # 第一次寫入時依維度配置
+        self._valid = np.zeros(self.max_entries, dtype=bool)
+        self._personas = np.full(self.max_entries, "", dtype=object)
+        self._entries: List[Optional[SemanticEntry]] = [None] * self.max_entries
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def embed(self, question: str) -> np.ndarray:
+        """
+        將問題嵌入為單位向量
+
+        Args:
+            question: 用戶問題
+
+        Returns:
+            np.ndarray: 正規化後的嵌入向量
+        """
+        # e5 系列模型以 "query: " 前綴區分查詢
+        vector = np.asarray(self.embeddings.embed_query(f"query: {normalize_input(question)}"), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, question: str, persona: str = "") -> Tuple[Optional[SemanticEntry], np.ndarray]:
+        """
+        查詢相似問題
+
+        Args:
+            question: 用戶問題
+            persona: 角色設定的雜湊，只比對以相同角色設定寫入的項目
+
+        Returns:
+            tuple: (命中的快取項目或None, 問題的嵌入向量，可直接傳給 add())
+        """
+        start = time.perf_counter()
+        query = self.embed(question)
+        with self._lock:
+            entry = None
+            candidates = self._valid & (self._personas == persona)
+            if self._vectors is not None and candidates.any():
+                similarities = self._vectors @ query
+                similarities[~candidates] = -1.0
+                slot = int(np.argmax(similarities))
+                similarity = float(similarities[slot])
+                if similarity >= self.threshold:
+                    entry = self._entries[slot]
+                    entry.last_access = time.time()
+                    print(f"🧠 語意快取命中 (相似度 {similarity:.3f}): {entry.question}")
+
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.saved_seconds += max(0.0, entry.latency - (time.perf_counter() - start))
+        return entry, query
+
+    def add(
+        self,
+        question: str,
+        embedding: np.ndarray,
+        response: str,
+        audio_path: Optional[str] = None,
+        latency: float = 0.0,
+        persona: str = ""
+    ) -> SemanticEntry:
+        """
+        寫入一筆快取
+
+        Args:
+            question: 用戶問題
+            embedding: lookup() 返回的嵌入向量
+            response: 處理後的文字回覆
+            audio_path: 音頻路徑
+            latency: 生成回覆所花的時間（用於統計節省的延遲）
+            persona: 角色設定的雜湊
+
+        Returns:
+            SemanticEntry: 新的快取項目
+        """
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, embedding.shape[0]), dtype=np.float32)
+
+            free = np.flatnonzero(~self._valid)
+            if len(free):
+                slot = int(free[0])
+            else:
+                # 淘汰最久未使用的項目
+                slot = min(range(self.max_entries), key=lambda i: self._entries[i].last_access)
+
+            entry = SemanticEntry(
+                question=question,
+                response=response,
+                audio_path=audio_path,
+                latency=latency,
+                slot=slot,
+                last_access=time.time(),
+                persona=persona
+            )
+            self._vectors[slot] = embedding
+            self._valid[slot] = True
+            self._personas[slot] = persona
+            self._entries[slot] = entry
+            return entry
+
+    def update_audio(self, entry: SemanticEntry, audio_path: str):
+        """
+        為快取項目補上音頻路徑
+
+        Args:
+            entry: 快取項目
+            audio_path: 音頻路徑
+        """
+        with self._lock:
+            if self._entries[entry.slot] is entry:
+                entry.audio_path = audio_path
+
+    def clear(self):
+        """清空快取"""
+        with self._lock:
+            self._valid[:] = False
+            self._entries = [None] * self.max_entries
+
+    def stats(self) -> dict:
+        """
+        取得快取統計
+
+        Returns:
+            dict: 命中率、節省的延遲與目前筆數
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "entries": int(self._valid.sum()),
+                "threshold": self.threshold
+            }
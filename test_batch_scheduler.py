@@ -0,0 +1,149 @@
+"""
+TTSBatchScheduler 視窗批次模式 (decode_slots == 0) 測試
+以假的 TTS 記錄每次 infer_batch 收到的句子，不需要載入模型；batch_scheduler.py 只依賴 numpy，以路徑載入
+"""
+import importlib.util
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _load_batch_scheduler():
+    path = os.path.join(ROOT_DIR, "GPT_SoVITS", "TTS_infer_pack", "batch_scheduler.py")
+    spec = importlib.util.spec_from_file_location("batch_scheduler", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+batch_scheduler = _load_batch_scheduler()
+
+
+class FakeTTS:
+    """每個空白分隔的詞是一句，VITS 輸出以句子本身代替"""
+
+    def __init__(self):
+        self.configs = SimpleNamespace(decode_slots=0, version="v2")
+        self.text_preprocessor = SimpleNamespace(preprocess=self.preprocess)
+        self.output_sample_rate = 32000
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+        self.started = threading.Event()
+
+    def preprocess(self, text, *args):
+        return [{"text": word} for word in text.split()]
+
+    def infer_batch(self, items, voice_id, **kwargs):
+        self.calls.append((time.perf_counter(), voice_id, kwargs, [item["text"] for item in items]))
+        self.started.set()
+        self.release.wait(10)
+        if any(item["text"] == "boom" for item in items):
+            raise ValueError("boom")
+        return [item["text"] for item in items]
+
+    def audio_postprocess(self, audio, sr, *args):
+        return sr, audio[0]
+
+    def empty_cache(self):
+        pass
+
+
+def make_scheduler(**kwargs):
+    tts = FakeTTS()
+    return tts, batch_scheduler.TTSBatchScheduler(tts, **kwargs)
+
+
+def test_batches_only_share_voice_and_sampling_parameters():
+    tts, scheduler = make_scheduler(max_batch_size=8, max_wait_ms=300)
+    try:
+        futures = [
+            scheduler.submit("a0 a1", "zh", voice_id="a"),
+            scheduler.submit("b0", "zh", voice_id="b"),
+            scheduler.submit("a2", "zh", voice_id="a"),
+            scheduler.submit("c0", "zh", voice_id="a", top_k=3),
+            scheduler.submit("d0", "zh", voice_id="a", speed_factor=1.2),
+        ]
+        for future in futures:
+            future.result(timeout=10)
+    finally:
+        scheduler.shutdown()
+
+    batches = [(voice_id, kwargs["top_k"], kwargs["speed_factor"], texts) for _, voice_id, kwargs, texts in tts.calls]
+    assert batches == [
+        ("a", 5, 1.0, ["a0", "a1", "a2"]),
+        ("b", 5, 1.0, ["b0"]),
+        ("a", 3, 1.0, ["c0"]),
+        ("a", 5, 1.2, ["d0"]),
+    ]
+    assert scheduler.stats()["batches"] == 4 and scheduler.stats()["sentences"] == 6
+
+
+def test_respects_max_batch_size_and_max_wait():
+    tts, scheduler = make_scheduler(max_batch_size=2, max_wait_ms=400)
+    try:
+        start = time.perf_counter()
+        future = scheduler.submit("s0 s1 s2 s3 s4", "zh")
+        assert future.result(timeout=10) == (32000, ["s0", "s1", "s2", "s3", "s4"])
+    finally:
+        scheduler.shutdown()
+
+    assert [texts for _, _, _, texts in tts.calls] == [["s0", "s1"], ["s2", "s3"], ["s4"]]
+    # 湊滿一批時不等待，不滿一批的句子等到最早的句子超過 max_wait_ms
+    assert tts.calls[0][0] - start < 0.3
+    assert tts.calls[1][0] - start < 0.3
+    assert tts.calls[2][0] - start >= 0.4
+
+
+def test_fragments_are_returned_in_request_order():
+    tts, scheduler = make_scheduler(max_batch_size=3, max_wait_ms=100)
+    try:
+        futures = [scheduler.submit(text, "zh") for text in ["x0 x1 x2 x3", "y0", "z0 z1"]]
+        results = [future.result(timeout=10) for future in futures]
+    finally:
+        scheduler.shutdown()
+
+    # 同一請求的句子分散在不同批次，不同請求的句子同在一批
+    assert [texts for _, _, _, texts in tts.calls] == [["x0", "x1", "x2"], ["x3", "y0", "z0"], ["z1"]]
+    assert results == [(32000, ["x0", "x1", "x2", "x3"]), (32000, ["y0"]), (32000, ["z0", "z1"])]
+
+
+def test_infer_batch_error_fails_every_request_in_the_batch():
+    tts, scheduler = make_scheduler(max_batch_size=8, max_wait_ms=200)
+    try:
+        failed = [scheduler.submit("ok boom", "zh"), scheduler.submit("ok", "zh")]
+        other = scheduler.submit("fine", "zh", voice_id="other")
+        for future in failed:
+            with pytest.raises(ValueError, match="boom"):
+                future.result(timeout=10)
+        # 其他批次與之後的請求不受影響
+        assert other.result(timeout=10) == (32000, ["fine"])
+        assert scheduler.submit("later", "zh").result(timeout=10) == (32000, ["later"])
+    finally:
+        scheduler.shutdown()
+
+
+def test_shutdown_fails_pending_requests():
+    tts, scheduler = make_scheduler(max_batch_size=1, max_wait_ms=0)
+    tts.release.clear()
+    running = scheduler.submit("first", "zh")
+    assert tts.started.wait(10)
+    pending = scheduler.submit("second", "zh")
+
+    stopper = threading.Thread(target=scheduler.shutdown)
+    stopper.start()
+    with pytest.raises(RuntimeError, match="shut down"):
+        pending.result(timeout=10)
+    # 已在推理的批次照常完成
+    tts.release.set()
+    stopper.join(10)
+    assert not stopper.is_alive()
+    assert running.result(timeout=10) == (32000, ["first"])
+    assert [texts for _, _, _, texts in tts.calls] == [["first"]]
+    with pytest.raises(RuntimeError, match="shut down"):
+        scheduler.submit("third", "zh")
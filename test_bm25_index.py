@@ -0,0 +1,117 @@
+"""
+BM25 索引與混合檢索測試
+"""
+import pytest
+
+pytest.importorskip("langchain")
+pytest.importorskip("langchain_chroma")
+
+from typing import List
+
+from langchain.schema import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+
+from rag.bm25_index import BM25Index, fingerprint, tokenize
+from rag.retriever import HybridRetriever, RetrievalTimings
+
+TEXTS = [
+    "Wednesday Addams 在 Nevermore 學院調查一連串的謀殺案。",
+    "Enid 是 Wednesday 的室友，個性開朗，喜歡彩色的東西。",
+    "Thing 是一隻會走路的手，總是幫 Wednesday 跑腿。",
+    "今天的天氣真不錯，我們一起去公園散步吧。",
+]
+
+
+def build_index():
+    index = BM25Index()
+    index.build([f"c{i}" for i in range(len(TEXTS))], TEXTS, [{"source": f"{i}.pdf"} for i in range(len(TEXTS))])
+    return index
+
+
+def test_tokenize_cjk_bigrams_and_words():
+    assert tokenize("Nevermore 學院") == ["nevermore", "學院"]
+    assert tokenize("謀殺案") == ["謀殺", "殺案"]
+    assert tokenize("手") == ["手"]
+
+
+def test_search_ranks_lexical_match_first():
+    index = build_index()
+    assert index.search("室友 Enid", k=1)[0][0] == 1
+    assert index.search("會走路的手", k=1)[0][0] == 2
+    assert index.search("完全無關的字詞", k=4) == []
+
+
+def test_common_terms_are_skipped():
+    # "wednesday" 出現在 3/4 的文件中，超過 max_df_ratio，不參與計分
+    assert build_index().search("Wednesday", k=4) == []
+
+
+def test_get_documents_keeps_ids_and_metadata():
+    doc = build_index().get_documents("公園散步", k=1)[0]
+    assert doc.page_content == TEXTS[3]
+    assert doc.id == "c3"
+    assert doc.metadata == {"source": "3.pdf"}
+
+
+def test_save_and_load_roundtrip(tmp_path):
+    index = build_index()
+    path = str(tmp_path / "bm25.json")
+    index.save(path)
+    loaded = BM25Index.load(path)
+    assert loaded.fingerprint == fingerprint(["c3", "c2", "c1", "c0"])
+    for query in ["室友 Enid", "謀殺案", "公園散步"]:
+        assert loaded.search(query, k=4) == index.search(query, k=4)
+    assert BM25Index.load(str(tmp_path / "missing.json")) is None
+
+
+class FixedRetriever(BaseRetriever):
+    docs: List[Document]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.docs
+
+
+def test_hybrid_fuses_rankings_and_records_bm25_time():
+    timings = RetrievalTimings()
+    retriever = HybridRetriever(
+        vector_retriever=FixedRetriever(docs=[Document(page_content=TEXTS[0], id="c0"), Document(page_content=TEXTS[2], id="c2")]),
+        bm25_index=build_index(),
+        timings=timings,
+        k=2,
+    )
+    docs = retriever.invoke("會走路的手")
+    # TEXTS[2] 在兩路都有排名，融合後排第一
+    assert [doc.page_content for doc in docs] == [TEXTS[2], TEXTS[0]]
+    stats = timings.stats()
+    assert stats["queries"] == 1
+    assert "bm25_ms_p50" in stats and "embed_ms_p50" not in stats
+
+
+def test_hybrid_keeps_identical_chunks_from_different_files():
+    index = BM25Index()
+    index.build(
+        ["a0", "b0", "c0", "c1"],
+        [TEXTS[2], TEXTS[2], TEXTS[0], TEXTS[3]],
+        [{"source": "a.pdf"}, {"source": "b.pdf"}, {"source": "c.pdf"}, {"source": "c.pdf"}],
+    )
+    retriever = HybridRetriever(
+        vector_retriever=FixedRetriever(docs=[Document(page_content=TEXTS[2], metadata={"source": "b.pdf"}, id="b0")]),
+        bm25_index=index,
+        k=2,
+    )
+    docs = retriever.invoke("會走路的手")
+    # 同一個 chunk 在兩路合併，另一個檔案的相同內容仍保留自己的 metadata
+    assert [(doc.id, doc.metadata["source"]) for doc in docs] == [("b0", "b.pdf"), ("a0", "a.pdf")]
+
+
+def test_hybrid_fuses_documents_without_ids_by_content():
+    retriever = HybridRetriever(
+        vector_retriever=FixedRetriever(docs=[Document(page_content=TEXTS[1]), Document(page_content=TEXTS[0])]),
+        bm25_index=BM25Index(),
+        k=4,
+    )
+    assert retriever._fuse([[Document(page_content=TEXTS[0])], retriever.vector_retriever.docs]) == [
+        Document(page_content=TEXTS[0]),
+        Document(page_content=TEXTS[1]),
+    ]
@@ -0,0 +1,105 @@
+"""
+TTS 參考特征快取測試
+直接以路徑載入 prompt_feature_cache.py，避免 TTS_infer_pack/__init__.py 載入整個推理模組
+"""
+import importlib.util
+import os
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _load_module():
+    path = os.path.join(ROOT_DIR, "GPT_SoVITS", "TTS_infer_pack", "prompt_feature_cache.py")
+    spec = importlib.util.spec_from_file_location("prompt_feature_cache", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+prompt_feature_cache = _load_module()
+PromptFeatureCache = prompt_feature_cache.PromptFeatureCache
+make_key = prompt_feature_cache.make_key
+
+
+def entry(value):
+    return {"phones": np.arange(value, value + 4), "bert": np.full((2, 3), value, dtype=np.float32)}
+
+
+def npz_files(cache_dir):
+    return sorted(name for name in os.listdir(cache_dir) if name.endswith(".npz"))
+
+
+def test_memory_only_lru():
+    cache = PromptFeatureCache(None, max_entries=2)
+    for i in range(3):
+        cache.put(str(i), entry(i))
+    assert cache.get("0") is None
+    assert cache.get("2")["phones"].tolist() == [2, 3, 4, 5]
+    assert cache.stats()["disk_entries"] == 0
+
+
+def test_disk_roundtrip_across_instances(tmp_path):
+    key = make_key("ref.wav", "abc", "zh")
+    PromptFeatureCache(str(tmp_path)).put(key, entry(7))
+
+    cache = PromptFeatureCache(str(tmp_path))
+    loaded = cache.get(key)
+    np.testing.assert_array_equal(loaded["bert"], entry(7)["bert"])
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_disk_entries_are_capped(tmp_path):
+    cache = PromptFeatureCache(str(tmp_path), max_entries=1, max_disk_entries=3)
+    for i in range(5):
+        cache.put(f"k{i}", entry(i))
+    assert npz_files(tmp_path) == ["k2.npz", "k3.npz", "k4.npz"]
+    stats = cache.stats()
+    assert stats["disk_entries"] == 3
+    assert stats["disk_evictions"] == 2
+
+
+def test_disk_hit_refreshes_lru_order(tmp_path):
+    cache = PromptFeatureCache(str(tmp_path), max_entries=1, max_disk_entries=2)
+    cache.put("a", entry(0))
+    cache.put("b", entry(1))
+    assert cache.get("a") is not None  # 從磁碟讀回，a 變成最近使用
+    cache.put("c", entry(2))
+    assert npz_files(tmp_path) == ["a.npz", "c.npz"]
+
+
+def test_cap_applies_to_existing_files_in_mtime_order(tmp_path):
+    cache = PromptFeatureCache(str(tmp_path), max_disk_entries=0)
+    now = time.time()
+    for i in range(4):
+        cache.put(f"k{i}", entry(i))
+        os.utime(tmp_path / f"k{i}.npz", (now - 100 + i, now - 100 + i))
+    (tmp_path / "half.tmp.npz").write_bytes(b"")
+
+    reopened = PromptFeatureCache(str(tmp_path), max_disk_entries=2)
+    assert reopened.stats()["disk_entries"] == 2
+    assert npz_files(tmp_path) == ["half.tmp.npz", "k2.npz", "k3.npz"]
+
+
+def test_clear_disk(tmp_path):
+    cache = PromptFeatureCache(str(tmp_path))
+    cache.put("a", entry(0))
+    cache.clear(disk=True)
+    assert npz_files(tmp_path) == []
+    assert cache.get("a") is None
+    assert cache.stats()["disk_entries"] == 0
+
+
+def test_file_hash_is_memoized_on_mtime(tmp_path):
+    path = tmp_path / "ref.wav"
+    path.write_bytes(b"abc")
+    cache = PromptFeatureCache(None)
+    first = cache.file_hash(str(path))
+    assert cache.file_hash(str(path)) == first
+    path.write_bytes(b"abcd")
+    os.utime(path, (time.time() + 10, time.time() + 10))
+    assert cache.file_hash(str(path)) != first
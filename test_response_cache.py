@@ -0,0 +1,92 @@
+"""
+回覆快取測試
+直接以路徑載入 rag/response_cache.py，不需要 langchain 等 RAG 依賴
+"""
+import importlib.util
+import os
+import time
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _load_response_cache():
+    spec = importlib.util.spec_from_file_location(
+        "response_cache", os.path.join(ROOT_DIR, "rag", "response_cache.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+response_cache = _load_response_cache()
+ResponseCache = response_cache.ResponseCache
+
+
+def make_cache(tmp_path, **kwargs):
+    kwargs.setdefault("max_entries", 100)
+    kwargs.setdefault("ttl", 0)
+    kwargs.setdefault("memory_entries", 10)
+    return ResponseCache(db_path=str(tmp_path / "cache.db"), **kwargs)
+
+
+def test_make_key_normalizes_input():
+    key = ResponseCache.make_key("你好嗎？", "qwen", "p")
+    assert ResponseCache.make_key("  你好嗎?  ", "qwen", "p") == key
+    assert ResponseCache.make_key("你好嗎", "qwen", "p") == key
+    assert ResponseCache.make_key("你好嗎", "llama", "p") != key
+    assert ResponseCache.make_key("你好嗎", "qwen", "q") != key
+    assert ResponseCache.make_key("Hello", "qwen", "p") == ResponseCache.make_key("hello!", "qwen", "p")
+
+
+def test_put_get_and_update_audio(tmp_path):
+    cache = make_cache(tmp_path)
+    key = ResponseCache.make_key("你是誰", "qwen", "p")
+    assert cache.get(key) is None
+
+    cache.put(key, "你是誰", "我是星期三。")
+    entry = cache.get(key)
+    assert entry.response == "我是星期三。"
+    assert entry.audio_path is None
+
+    cache.update_audio(key, "/tmp/a.wav")
+    assert cache.get(key).audio_path == "/tmp/a.wav"
+    stats = cache.stats()
+    assert stats["memory_hits"] == 2
+    assert stats["misses"] == 1
+
+
+def test_persists_across_instances(tmp_path):
+    key = ResponseCache.make_key("你是誰", "qwen", "p")
+    make_cache(tmp_path).put(key, "你是誰", "我是星期三。", "/tmp/a.wav")
+
+    cache = make_cache(tmp_path)
+    entry = cache.get(key)
+    assert entry.response == "我是星期三。"
+    assert entry.audio_path == "/tmp/a.wav"
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = make_cache(tmp_path, max_entries=2)
+    keys = [ResponseCache.make_key(str(i), "qwen", "p") for i in range(3)]
+    cache.put(keys[0], "0", "a")
+    time.sleep(0.01)
+    cache.put(keys[1], "1", "b")
+    time.sleep(0.01)
+    cache.get(keys[0])
+    time.sleep(0.01)
+    cache.put(keys[2], "2", "c")
+
+    assert cache.stats()["entries"] == 2
+    cache._memory.clear()
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]).response == "a"
+
+
+def test_expired_entries_are_dropped(tmp_path):
+    cache = make_cache(tmp_path, ttl=0.05)
+    key = ResponseCache.make_key("你是誰", "qwen", "p")
+    cache.put(key, "你是誰", "我是星期三。")
+    time.sleep(0.1)
+    assert cache.get(key) is None
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,156 @@
+"""
+語意快取測試
+以固定向量的假嵌入模型驗證門檻、淘汰、音頻補寫與角色設定的區隔，不需要下載模型
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("langchain_core")
+
+from rag.semantic_cache import SemanticCache
+
+
+class FakeEmbeddings:
+    """依問題查表返回固定向量，並記錄呼叫次數"""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return self.vectors[text[len("query: "):]]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+VECTORS = {
+    "你是誰": unit(1.0, 0.0, 0.0),
+    "你是誰呢": unit(1.0, 0.1, 0.0),   # 相似度約 0.995
+    "你喜歡什麼": unit(1.0, 0.4, 0.0),  # 相似度約 0.93
+    "今天天氣如何": unit(0.0, 0.0, 1.0),
+}
+
+
+def make_cache(threshold=0.96, max_entries=4):
+    return SemanticCache(FakeEmbeddings(VECTORS), threshold=threshold, max_entries=max_entries)
+
+
+def test_hit_above_threshold_only():
+    cache = make_cache()
+    entry, embedding = cache.lookup("你是誰")
+    assert entry is None
+    cache.add("你是誰", embedding, "我是星期三。", latency=2.0)
+
+    hit, _ = cache.lookup("你是誰呢")
+    assert hit is not None and hit.response == "我是星期三。"
+    # 0.93 在舊門檻 0.92 下會命中，新門檻下不應命中
+    assert cache.lookup("你喜歡什麼")[0] is None
+    assert cache.lookup("今天天氣如何")[0] is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 3)
+    assert stats["saved_seconds"] > 0
+
+
+def test_lower_threshold_accepts_looser_paraphrase():
+    cache = make_cache(threshold=0.92)
+    _, embedding = cache.lookup("你是誰")
+    cache.add("你是誰", embedding, "我是星期三。")
+    assert cache.lookup("你喜歡什麼")[0] is not None
+
+
+def test_evicts_least_recently_used_slot():
+    cache = make_cache(max_entries=2)
+    first = cache.add("你是誰", cache.embed("你是誰"), "a")
+    cache.add("今天天氣如何", cache.embed("今天天氣如何"), "b")
+    first.last_access = 0.0
+    cache.add("你喜歡什麼", cache.embed("你喜歡什麼"), "c")
+
+    assert cache.stats()["entries"] == 2
+    assert cache.lookup("你是誰")[0] is None
+    assert cache.lookup("今天天氣如何")[0].response == "b"
+
+
+def test_update_audio_ignores_evicted_entry():
+    cache = make_cache(max_entries=1)
+    old = cache.add("你是誰", cache.embed("你是誰"), "a")
+    new = cache.add("今天天氣如何", cache.embed("今天天氣如何"), "b")
+    cache.update_audio(old, "/tmp/old.wav")
+    cache.update_audio(new, "/tmp/new.wav")
+    assert old.audio_path is None
+    assert cache.lookup("今天天氣如何")[0].audio_path == "/tmp/new.wav"
+
+
+def test_lookup_only_matches_same_persona():
+    cache = make_cache()
+    _, embedding = cache.lookup("你是誰", persona="chat")
+    cache.add("你是誰", embedding, "我是星期三。", persona="chat")
+    assert cache.lookup("你是誰呢", persona="stream")[0] is None
+    assert cache.lookup("你是誰呢")[0] is None
+    assert cache.lookup("你是誰呢", persona="chat")[0].response == "我是星期三。"
+
+
+class FakeLLMChain:
+    model_name = "fake"
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.instructions = []
+
+    def ask_stream(self, question, instructions=None):
+        self.instructions.append(instructions)
+        yield from self.chunks
+
+
+def make_wednesday(tmp_path, chunks):
+    pytest.importorskip("langchain_openai")
+    pytest.importorskip("langchain_community")
+    from rag import llm_chain
+    from rag.response_cache import ResponseCache
+
+    wednesday = llm_chain.WednesdayChat(
+        FakeLLMChain(chunks),
+        enable_tts=False,
+        response_cache=ResponseCache(db_path=str(tmp_path / "cache.db"), max_entries=10, ttl=0, memory_entries=10),
+        semantic_cache=make_cache(),
+    )
+    return llm_chain, wednesday
+
+
+def test_stream_and_chat_replies_are_cached_per_persona(tmp_path):
+    llm_chain, wednesday = make_wednesday(tmp_path, ["串流", "的回覆"])
+    stream = llm_chain.WEDNESDAY_STREAM_PERSONA
+
+    lookup = wednesday.lookup_reply("你是誰", persona=stream)
+    assert not lookup.hit
+    response = "".join(wednesday.chat_stream("你是誰"))
+    assert wednesday.llm_chain.instructions == [stream]
+    wednesday.remember_reply(lookup, response, persona=stream)
+
+    # /chat 的角色設定不會命中串流的回覆 (精確與語意快取皆是)
+    assert not wednesday.lookup_reply("你是誰").hit
+    assert not wednesday.lookup_reply("你是誰呢").hit
+    assert wednesday.lookup_reply("你是誰", persona=stream).response == "串流的回覆"
+    assert wednesday.lookup_reply("你是誰呢", persona=stream).response == "串流的回覆"
+
+    # remember_reply 指定的角色設定與查詢時不同時，以指定的角色設定寫入
+    lookup = wednesday.lookup_reply("今天天氣如何")
+    wednesday.remember_reply(lookup, "下雨。", persona=stream)
+    assert not wednesday.lookup_reply("今天天氣如何").hit
+    assert wednesday.lookup_reply("今天天氣如何", persona=stream).response == "下雨。"
+
+
+def test_error_replies_are_not_cached(tmp_path):
+    llm_chain, wednesday = make_wednesday(tmp_path, [])
+    lookup = wednesday.lookup_reply("你是誰")
+    wednesday.remember_reply(lookup, "發生錯誤: timeout")
+    assert lookup.key is None and lookup.embedding is None
+    assert not wednesday.lookup_reply("你是誰").hit
+    assert llm_chain.is_error_reply("發生錯誤: timeout") and not llm_chain.is_error_reply("我是星期三。")
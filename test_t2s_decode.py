@@ -0,0 +1,268 @@
+"""
+T2S 自回歸解碼測試
+以隨機初始化的 2 層 Text2SemanticDecoder 比對各種解碼路徑的結果
+"""
+import contextlib
+import importlib.util
+import io
+import os
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchmetrics")
+
+from AR.models import t2s_model
+from AR.models.t2s_model import Text2SemanticDecoder
+from benchmark_t2s import decode_concat, decode_static
+
+EOS = 1024
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def build_model(seed: int = 0, eos_scale: float = 0.0) -> Text2SemanticDecoder:
+    torch.manual_seed(seed)
+    config = {
+        "model": {
+            "hidden_dim": 64,
+            "embedding_dim": 64,
+            "head": 4,
+            "n_layer": 2,
+            "vocab_size": 1025,
+            "phoneme_vocab_size": 732,
+            "dropout": 0,
+            "EOS": EOS,
+        }
+    }
+    model = Text2SemanticDecoder(config, top_k=3).eval()
+    if eos_scale:
+        # 讓隨機模型在幾十步內輸出 EOS，各行在不同步數結束
+        with torch.no_grad():
+            weight = model.ar_predict_layer.weight
+            weight[EOS] = weight[:EOS].mean(0) * eos_scale
+    return model
+
+
+def make_batch(model, lens, prompt_len=10, seed=1):
+    generator = torch.Generator().manual_seed(seed)
+    x = [torch.randint(0, model.phoneme_vocab_size, (n,), generator=generator) for n in lens]
+    bert_feature = [torch.randn(1024, n, generator=generator) * 0.1 for n in lens]
+    prompts = torch.randint(0, EOS, (len(lens), prompt_len), generator=generator)
+    return x, torch.LongTensor(lens), prompts, bert_feature
+
+
+@torch.no_grad()
+def test_static_kv_cache_matches_concat():
+    model = build_model()
+    batch_size, prompt_len = 2, 240
+    xy_pos = torch.randn(batch_size, prompt_len, model.model_dim)
+    attn_mask = torch.zeros(batch_size, model.num_head, prompt_len, prompt_len, dtype=torch.bool)
+    attn_mask[1, :, :, :7] = True  # 第二行左側為 padding
+    # 300 步會越過第一個 KV_CACHE_CHUNK 邊界，經過一次擴容
+    steps = 300
+    assert prompt_len + steps > t2s_model.round_kv_capacity(prompt_len + t2s_model.KV_CACHE_CHUNK)
+
+    expected = decode_concat(model, xy_pos, attn_mask, steps)
+    actual = decode_static(model, xy_pos, attn_mask, steps)
+    torch.testing.assert_close(actual, expected, atol=1e-4, rtol=1e-4)
+
+
+@torch.no_grad()
+def test_batch_infer_is_independent_of_kv_chunk_size(monkeypatch):
+    model = build_model(eos_scale=60)
+    x, x_lens, prompts, bert_feature = make_batch(model, [12, 9, 7, 5])
+    kwargs = dict(top_k=1, early_stop_num=80)
+
+    expected_y, expected_idx = model.infer_panel_batch_infer(x, x_lens, prompts, bert_feature, **kwargs)
+    # 每 8 個位置擴容一次，同時經過序列結束時的壓實
+    monkeypatch.setattr(t2s_model, "KV_CACHE_CHUNK", 8)
+    y, idx = model.infer_panel_batch_infer(x, x_lens, prompts, bert_feature, **kwargs)
+
+    assert idx == expected_idx
+    for a, b in zip(y, expected_y):
+        assert torch.equal(a, b)
+
+
+@torch.no_grad()
+def test_continuous_batcher_admits_sequence_mid_iteration():
+    model = build_model(eos_scale=60)
+    x, _, prompts, bert_feature = make_batch(model, [12, 9, 7])
+
+    def run_alone(i):
+        batcher = t2s_model.T2SContinuousBatcher(model, max_slots=4, top_k=1, early_stop_num=80)
+        batcher.submit(x[i], prompts[i], bert_feature[i], tag=i)
+        return dict(batcher)[i]
+
+    batcher = t2s_model.T2SContinuousBatcher(model, max_slots=4, top_k=1, early_stop_num=80)
+    batcher.submit(x[0], prompts[0], bert_feature[0], tag=0)
+    batcher.submit(x[1], prompts[1], bert_feature[1], tag=1)
+    results = {}
+    for _ in range(5):
+        results.update(batcher.step())
+    # 第三句在前兩句解碼途中加入，佔用空閒 slot
+    assert batcher.has_work()
+    batcher.submit(x[2], prompts[2], bert_feature[2], tag=2)
+    results.update(batcher)
+
+    assert sorted(results) == [0, 1, 2]
+    for i in range(3):
+        assert torch.equal(results[i], run_alone(i))
+
+
+@torch.no_grad()
+def test_sync_free_matches_batch_infer(monkeypatch):
+    model = build_model(eos_scale=60)
+    x, x_lens, prompts, bert_feature = make_batch(model, [12, 9, 7, 5])
+    kwargs = dict(top_k=1, early_stop_num=80)
+
+    expected_y, expected_idx = model.infer_panel_batch_infer(x, x_lens, prompts, bert_feature, **kwargs)
+    # 每 8 個位置擴容一次，擴容只發生在每 5 步一次的同步點
+    monkeypatch.setattr(t2s_model, "KV_CACHE_CHUNK", 8)
+    # 新分配的 cache 未寫入的部分填 NaN：同步窗口內會 attend 到這些位置，必須被清零
+    allocate_kv_cache = t2s_model.T2STransformer.allocate_kv_cache
+
+    def allocate_with_nan(self, k_cache, v_cache, capacity):
+        filled = k_cache[0].shape[1]
+        k_buffers, v_buffers = allocate_kv_cache(self, k_cache, v_cache, capacity)
+        for cache in k_buffers + v_buffers:
+            cache[:, filled:] = float("nan")
+        return k_buffers, v_buffers
+
+    monkeypatch.setattr(t2s_model.T2STransformer, "allocate_kv_cache", allocate_with_nan)
+    y, idx = model.infer_panel_sync_free(x, x_lens, prompts, bert_feature, sync_interval=5, **kwargs)
+
+    assert idx == expected_idx
+    for a, b in zip(y, expected_y):
+        assert torch.equal(a, b)
+
+
+def total_variation(a: Counter, b: Counter) -> float:
+    na, nb = sum(a.values()), sum(b.values())
+    return 0.5 * sum(abs(a[key] / na - b[key] / nb) for key in set(a) | set(b))
+
+
+def sample_runs(infer_panel, inputs, runs, seed, **kwargs):
+    """以 seed, seed+1, ... 解碼 runs 次，統計前 4 個 token 的組合與序列長度"""
+    prefixes, lengths = Counter(), Counter()
+    for i in range(runs):
+        torch.manual_seed(seed + i)
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            y, idx = infer_panel(*inputs, **kwargs)
+        prefixes[tuple(y[0, inputs[2].shape[1] :][:4].tolist())] += 1
+        lengths[idx] += 1
+    return prefixes, lengths
+
+
+def single_inputs(model):
+    x, x_lens, prompts, bert_feature = make_batch(model, [12])
+    return x[0][None], x_lens[0], prompts[:1], bert_feature[0][None]
+
+
+@torch.no_grad()
+def test_speculative_without_draft_tokens_matches_naive():
+    model = build_model(eos_scale=60)
+    inputs = single_inputs(model)
+    kwargs = dict(top_k=3, early_stop_num=40, draft_layers=1)
+    for seed in range(3):
+        torch.manual_seed(seed)
+        expected, expected_idx = model.infer_panel_naive(*inputs, **kwargs)
+        torch.manual_seed(seed)
+        y, idx = model.infer_panel_speculative(*inputs, num_draft_tokens=0, **kwargs)
+        assert idx == expected_idx
+        assert torch.equal(y, expected)
+
+
+@torch.no_grad()
+def test_speculative_greedy_matches_naive():
+    # top_k=1 時草稿 token 只有與完整模型的 argmax 相同才會被接受，結果應與 naive 完全一致
+    model = build_model(eos_scale=60)
+    inputs = single_inputs(model)
+    kwargs = dict(top_k=1, early_stop_num=40, draft_layers=1)
+    expected, expected_idx = model.infer_panel_naive(*inputs, **kwargs)
+    y, idx = model.infer_panel_speculative(*inputs, num_draft_tokens=4, **kwargs)
+    assert idx == expected_idx
+    assert torch.equal(y, expected)
+
+
+@torch.no_grad()
+def test_speculative_keeps_naive_sampling_distribution():
+    model = build_model(eos_scale=60)
+    inputs = single_inputs(model)
+    kwargs = dict(top_k=2, early_stop_num=20, draft_layers=1)
+    runs = 300
+
+    naive_prefixes, naive_lengths = sample_runs(model.infer_panel_naive, inputs, runs, 0, **kwargs)
+    prefixes, lengths = sample_runs(model.infer_panel_speculative, inputs, runs, runs, num_draft_tokens=4, **kwargs)
+    stats = model.speculative_stats
+    # 1 層草稿模型與完整模型的分布差距很大，兩個分支都會走到
+    assert 0 < stats["accepted"] < stats["drafted"]
+
+    # 16 種前綴上兩組獨立樣本的 TV 距離約 0.1~0.15；草稿 token 一律接受時約 0.6
+    assert total_variation(naive_prefixes, prefixes) < 0.25
+    assert total_variation(naive_lengths, lengths) < 0.15
+
+
+class FakeTTS:
+    """只保留 TTSBatchScheduler 用到的介面，T2S 由真實的 T2SContinuousBatcher 解碼，VITS 以 token 本身代替"""
+
+    def __init__(self, model, batch):
+        self.model = model
+        self.x, _, self.prompts, self.bert_feature = batch
+        self.configs = SimpleNamespace(decode_slots=2, version="v2")
+        self.text_preprocessor = SimpleNamespace(preprocess=self.preprocess)
+        self.output_sample_rate = 32000
+        self.batcher = None
+
+    def preprocess(self, text, *args):
+        return [{"index": int(i)} for i in text.split()]
+
+    def continuous_batcher(self, top_k, top_p, temperature, repetition_penalty):
+        if self.batcher is None:
+            self.batcher = t2s_model.T2SContinuousBatcher(self.model, 2, top_k, top_p, temperature, repetition_penalty, 80)
+        return self.batcher
+
+    def submit_semantic(self, batcher, item, voice_id, tag):
+        i = item["index"]
+        batcher.submit(self.x[i], self.prompts[i], self.bert_feature[i], tag=tag)
+
+    def decode_semantic_tokens(self, items, semantic_tokens, **kwargs):
+        return semantic_tokens
+
+    def audio_postprocess(self, audio, sr, *args):
+        return sr, audio[0]
+
+    def empty_cache(self):
+        pass
+
+
+@torch.no_grad()
+def test_batch_scheduler_routes_continuous_results_per_request():
+    path = os.path.join(ROOT_DIR, "GPT_SoVITS", "TTS_infer_pack", "batch_scheduler.py")
+    spec = importlib.util.spec_from_file_location("batch_scheduler", path)
+    batch_scheduler = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(batch_scheduler)
+
+    model = build_model(eos_scale=60)
+    batch = make_batch(model, [12, 9, 7, 5])
+    tts = FakeTTS(model, batch)
+    expected = []
+    for i in range(4):
+        batcher = t2s_model.T2SContinuousBatcher(model, max_slots=1, top_k=1, early_stop_num=80)
+        batcher.submit(batch[0][i], batch[2][i], batch[3][i], tag=i)
+        expected.append(dict(batcher)[i])
+
+    scheduler = batch_scheduler.TTSBatchScheduler(tts)
+    try:
+        # 兩個 slot、四句：後兩個請求的句子在前面的句子解碼途中加入
+        futures = [scheduler.submit(text, "zh", top_k=1) for text in ["0 2", "1", "3"]]
+        results = [future.result(timeout=60) for future in futures]
+    finally:
+        scheduler.shutdown()
+
+    for (sr, fragments), indices in zip(results, [[0, 2], [1], [3]]):
+        assert sr == 32000
+        assert len(fragments) == len(indices)
+        for fragment, i in zip(fragments, indices):
+            assert torch.equal(fragment, expected[i])
@@ -0,0 +1,334 @@
+"""
+TTS 文本前端測試：字級到音素級的 Bert 特征展開、截斷的 Bert 編碼器、按長度分桶批次提取、句子級前端結果快取、
+g2pW 的結果快取與批次輸入
+TextPreprocessor 需要完整的 TTS 推理依賴 (torchaudio、transformers)，缺少時只略過相關測試
+"""
+import importlib.util
+import os
+import threading
+from collections import OrderedDict
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from text.bert_feature import phone_level_feature
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SENTENCES = [
+    "我不在乎。",
+    "今天的天氣真不錯，我們一起去公園散步吧。",
+    "你又在看那些無聊的東西了嗎？",
+    "好吧。",
+    "他們說這座城堡裡住著一個古老的幽靈，每到午夜就會出來遊蕩。",
+]
+
+
+@pytest.fixture(scope="module")
+def text_preprocessor():
+    pytest.importorskip("torchaudio")
+    pytest.importorskip("transformers")
+    from TTS_infer_pack import TextPreprocessor
+
+    return TextPreprocessor
+
+
+def expand_loop(res, word2ph):
+    # 原本的實作：逐字 repeat 後 torch.cat
+    return torch.cat([res[i].repeat(word2ph[i], 1) for i in range(len(word2ph))], dim=0).T
+
+
+def test_phone_level_feature_matches_loop():
+    res = torch.randn(12, 1024)
+    word2ph = [2, 1, 3, 2, 2, 1, 2, 4, 2, 1]
+    expected = expand_loop(res, word2ph)
+    # 多出的列 (例如 [SEP]) 被忽略
+    assert torch.equal(phone_level_feature(res, word2ph), expected)
+    assert torch.equal(phone_level_feature(res, torch.tensor(word2ph, dtype=torch.int32)), expected)
+
+
+def test_phone_level_feature_dtype_and_out_buffer():
+    res = torch.randn(5, 1024)
+    word2ph = [2, 2, 1, 2, 2]
+    expected = expand_loop(res, word2ph)
+
+    half = phone_level_feature(res, word2ph, torch.float16)
+    assert half.dtype == torch.float16
+    assert torch.equal(half, expected.half())
+
+    out = torch.empty(1024, sum(word2ph))
+    assert phone_level_feature(res, word2ph, out=out).data_ptr() == out.data_ptr()
+    assert torch.equal(out, expected)
+
+
+def load_bert_encoder():
+    # bert_encoder.py 只依賴 torch，以路徑載入，避免 TTS_infer_pack/__init__.py 載入整個推理模組
+    path = os.path.join(ROOT_DIR, "GPT_SoVITS", "TTS_infer_pack", "bert_encoder.py")
+    spec = importlib.util.spec_from_file_location("bert_encoder", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@torch.no_grad()
+def test_truncated_bert_encoder_matches_hidden_state():
+    transformers = pytest.importorskip("transformers")
+    bert_encoder = load_bert_encoder()
+    torch.manual_seed(0)
+    config = transformers.BertConfig(
+        vocab_size=100, hidden_size=64, num_hidden_layers=5, num_attention_heads=4, intermediate_size=128
+    )
+    model = transformers.BertForMaskedLM(config).eval()
+    input_ids = torch.randint(5, 100, (3, 9))
+    attention_mask = torch.ones_like(input_ids)
+    attention_mask[1, 6:] = 0
+    attention_mask[2, 3:] = 0
+    token_type_ids = torch.zeros_like(input_ids)
+
+    expected = bert_encoder.bert_hidden_state(model, input_ids, attention_mask, token_type_ids)
+    encoder = bert_encoder.build_bert_encoder(model, None, "truncated")
+    assert len(encoder.layers) == 3
+    actual = bert_encoder.bert_hidden_state(encoder, input_ids, attention_mask, token_type_ids)
+    # padding 位置的輸出不使用，只比較有效的 token
+    mask = attention_mask.bool()
+    torch.testing.assert_close(actual[mask], expected[mask], atol=1e-5, rtol=1e-4)
+
+
+def check_buckets(lengths, buckets, max_batch_size, max_batch_tokens):
+    assert sorted(i for bucket in buckets for i in bucket) == list(range(len(lengths)))
+    ordered = [lengths[i] for bucket in buckets for i in bucket]
+    assert ordered == sorted(lengths)
+    for bucket in buckets:
+        assert len(bucket) <= max_batch_size
+        # 單句超過 token 上限時自成一批
+        assert len(bucket) == 1 or max(lengths[i] for i in bucket) * len(bucket) <= max_batch_tokens
+
+
+def test_bucket_by_length_respects_both_limits(text_preprocessor):
+    bucket_by_length = text_preprocessor.bucket_by_length
+    lengths = [5, 40, 12, 7, 33, 8, 21, 9, 50, 6]
+    for max_batch_size, max_batch_tokens in [(1, 1000), (3, 1000), (16, 60), (4, 100), (16, 10)]:
+        buckets = bucket_by_length(lengths, max_batch_size, max_batch_tokens)
+        check_buckets(lengths, buckets, max_batch_size, max_batch_tokens)
+
+
+def test_bucket_by_length_edge_cases(text_preprocessor):
+    bucket_by_length = text_preprocessor.bucket_by_length
+    assert bucket_by_length([], 4, 100) == []
+    assert bucket_by_length([7], 4, 1) == [[0]]
+    assert bucket_by_length([3, 3, 3], 16, 4096) == [[0, 1, 2]]
+
+
+def make_preprocessor(text_preprocessor, tmp_path, bert_batch_size, **kwargs):
+    transformers = pytest.importorskip("transformers")
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + sorted(set("".join(SENTENCES)))
+    vocab_file = tmp_path / "vocab.txt"
+    vocab_file.write_text("\n".join(vocab), encoding="utf-8")
+    tokenizer = transformers.BertTokenizer(str(vocab_file))
+    torch.manual_seed(0)
+    config = transformers.BertConfig(
+        vocab_size=len(vocab),
+        hidden_size=1024,
+        num_hidden_layers=3,
+        num_attention_heads=16,
+        intermediate_size=256,
+    )
+    model = transformers.BertForMaskedLM(config).eval()
+    return text_preprocessor.TextPreprocessor(model, tokenizer, "cpu", bert_batch_size=bert_batch_size, **kwargs)
+
+
+def test_batched_bert_features_match_per_sentence(text_preprocessor, tmp_path):
+    items = [(text, [1 if char in "，。？" else 2 for char in text]) for text in SENTENCES]
+    per_sentence = make_preprocessor(text_preprocessor, tmp_path, bert_batch_size=1)
+    batched = make_preprocessor(text_preprocessor, tmp_path, bert_batch_size=4)
+
+    expected = [per_sentence.get_bert_feature(text, word2ph) for text, word2ph in items]
+    actual = batched.get_bert_feature_batch(items)
+    for (text, word2ph), a, b in zip(items, actual, expected):
+        assert a.shape == (1024, sum(word2ph))
+        torch.testing.assert_close(a, b, atol=1e-5, rtol=1e-4)
+
+
+def count_frontend_calls(preprocessor, monkeypatch):
+    """G2P 換成逐字 1 個音素 (g2pW 與 nltk 模型需要下載)，記錄實際做 G2P 與 Bert 的句子"""
+    calls = {"g2p": [], "bert": 0}
+
+    def get_phone_segments(text, language, version, final=False):
+        calls["g2p"].append(text)
+        return [([ord(char) % 300 for char in text], [1] * len(text), text, True)]
+
+    get_bert_feature_batch = preprocessor.get_bert_feature_batch
+
+    def counting_bert(items):
+        calls["bert"] += len(items)
+        return get_bert_feature_batch(items)
+
+    monkeypatch.setattr(preprocessor, "get_phone_segments", get_phone_segments)
+    monkeypatch.setattr(preprocessor, "prefetch_g2p", lambda texts, language, version: None)
+    monkeypatch.setattr(preprocessor, "get_bert_feature_batch", counting_bert)
+    return calls
+
+
+def test_sentence_cache_skips_g2p_and_bert(text_preprocessor, tmp_path, monkeypatch):
+    cache = text_preprocessor.PromptFeatureCache(str(tmp_path / "text_cache"), max_entries=8)
+    preprocessor = make_preprocessor(text_preprocessor, tmp_path, 4, feature_cache=cache, cache_signature=("bert", False))
+    calls = count_frontend_calls(preprocessor, monkeypatch)
+
+    first = preprocessor.get_phones_and_bert_batch(SENTENCES[:2], "zh", "v2")
+    assert calls == {"g2p": SENTENCES[:2], "bert": 2}
+    expected = first[1][1].clone()
+
+    # 只有新句子需要 G2P 與 Bert
+    second = preprocessor.get_phones_and_bert_batch([SENTENCES[1], SENTENCES[2]], "zh", "v2")
+    assert calls == {"g2p": SENTENCES[:3], "bert": 3}
+    assert second[0][0] == first[1][0] and second[0][2] == first[1][2]
+    assert torch.equal(second[0][1], expected)
+
+    # 寫入與讀出的特征都是複本，推理時原地修改不影響快取
+    first[1][1].zero_()
+    second[0][1].zero_()
+    assert torch.equal(preprocessor.get_phones_and_bert(SENTENCES[1], "zh", "v2")[1], expected)
+    assert calls["g2p"] == SENTENCES[:3]
+
+
+def test_sentence_cache_key_includes_signature_and_survives_restart(text_preprocessor, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "text_cache")
+    preprocessor = make_preprocessor(
+        text_preprocessor, tmp_path, 4,
+        feature_cache=text_preprocessor.PromptFeatureCache(cache_dir), cache_signature=("bert", False),
+    )
+    count_frontend_calls(preprocessor, monkeypatch)
+    expected = preprocessor.get_phones_and_bert_batch(SENTENCES[:1], "zh", "v2")[0]
+
+    # 新的程序：記憶體為空，從磁碟讀回
+    restarted = make_preprocessor(
+        text_preprocessor, tmp_path, 4,
+        feature_cache=text_preprocessor.PromptFeatureCache(cache_dir), cache_signature=("bert", False),
+    )
+    calls = count_frontend_calls(restarted, monkeypatch)
+    result = restarted.get_phones_and_bert_batch(SENTENCES[:1], "zh", "v2")[0]
+    assert calls == {"g2p": [], "bert": 0}
+    assert restarted.feature_cache.stats()["disk_hits"] == 1
+    assert result[0] == expected[0] and torch.equal(result[1], expected[1])
+
+    # Bert 模型或精度不同時不共用快取
+    half = make_preprocessor(
+        text_preprocessor, tmp_path, 4,
+        feature_cache=restarted.feature_cache, cache_signature=("bert", True),
+    )
+    calls = count_frontend_calls(half, monkeypatch)
+    half.get_phones_and_bert_batch(SENTENCES[:1], "zh", "v2")
+    assert calls == {"g2p": SENTENCES[:1], "bert": 1}
+
+
+def test_sentence_cache_signature_follows_precision_switch(text_preprocessor, tmp_path, monkeypatch):
+    # TTS 以函数传入签名，enable_half_precision 之后的请求使用新精度的缓存键
+    configs = {"is_half": False}
+    preprocessor = make_preprocessor(
+        text_preprocessor, tmp_path, 4,
+        feature_cache=text_preprocessor.PromptFeatureCache(str(tmp_path / "text_cache")),
+        cache_signature=lambda: ("bert", configs["is_half"]),
+    )
+    calls = count_frontend_calls(preprocessor, monkeypatch)
+    preprocessor.get_phones_and_bert_batch(SENTENCES[:1], "zh", "v2")
+    preprocessor.get_phones_and_bert_batch(SENTENCES[:1], "zh", "v2")
+    assert calls["bert"] == 1
+
+    configs["is_half"] = True
+    preprocessor.get_phones_and_bert_batch(SENTENCES[:1], "zh", "v2")
+    assert calls["bert"] == 2
+    configs["is_half"] = False
+    preprocessor.get_phones_and_bert_batch(SENTENCES[:1], "zh", "v2")
+    assert calls["bert"] == 2
+
+
+def make_g2pw_converter(memo_size):
+    """不載入 g2pW 模型 (需要下載)，_convert 換成逐字回傳字元並記錄實際推理的句子"""
+    pytest.importorskip("onnxruntime")
+    from text.g2pw.onnx_api import G2PWOnnxConverter
+
+    converter = object.__new__(G2PWOnnxConverter)
+    converter.memo_size = memo_size
+    converter._memo = OrderedDict()
+    converter._memo_lock = threading.Lock()
+    converted = []
+
+    def convert(sentences):
+        converted.append(list(sentences))
+        return [list(sent) for sent in sentences]
+
+    converter._convert = convert
+    return converter, converted
+
+
+def test_g2pw_memo_dedupes_and_evicts():
+    converter, converted = make_g2pw_converter(memo_size=2)
+
+    # 同一批中重複的句子只推理一次，結果順序不變
+    assert converter(["甲乙", "丙", "甲乙"]) == [["甲", "乙"], ["丙"], ["甲", "乙"]]
+    assert converted == [["甲乙", "丙"]]
+
+    # 只推理未命中的句子，超過 memo_size 時淘汰最久未使用的句子
+    assert converter(["丙", "丁"]) == [["丙"], ["丁"]]
+    assert converted[-1] == ["丁"]
+    assert list(converter._memo) == ["丙", "丁"]
+
+    # 命中也會更新使用順序
+    converter.prefetch(["丙"])
+    assert len(converted) == 2
+    converter(["甲乙"])
+    assert converted[-1] == ["甲乙"]
+    assert list(converter._memo) == ["丙", "甲乙"]
+
+    # 回傳的是複本，修改不影響快取
+    converter("丁")[0][0] = "x"
+    assert converter("丁") == [["丁"]]
+
+
+def test_g2pw_memo_disabled():
+    converter, converted = make_g2pw_converter(memo_size=0)
+    converter.prefetch(["甲"])
+    assert converted == []
+    converter(["甲"])
+    converter(["甲"])
+    assert converted == [["甲"], ["甲"]]
+    assert not converter._memo
+
+
+def test_g2pw_onnx_input_pads_rows_and_tokenizes_once(tmp_path, monkeypatch):
+    transformers = pytest.importorskip("transformers")
+    from text.g2pw import dataset
+
+    texts = ["他的長处", "我们都长大了", "他的長处", "长"]
+    query_ids = [2, 2, 3, 0]
+    chars = sorted(set("".join(texts).lower()))
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + chars
+    vocab_file = tmp_path / "vocab.txt"
+    vocab_file.write_text("\n".join(vocab), encoding="utf-8")
+    tokenizer = transformers.BertTokenizer(str(vocab_file))
+    labels = ["a1", "b2", "c3"]
+    char2phonemes = {char: [0, 2] for char in chars}
+
+    tokenized = []
+    tokenize_and_map = dataset.tokenize_and_map
+
+    def counting_tokenize(tokenizer, text):
+        tokenized.append(text)
+        return tokenize_and_map(tokenizer=tokenizer, text=text)
+
+    monkeypatch.setattr(dataset, "tokenize_and_map", counting_tokenize)
+    batched = dataset.prepare_onnx_input(tokenizer, labels, char2phonemes, chars, texts, query_ids, use_mask=True)
+    # 同一句的多個多音字共用一次分詞
+    assert sorted(tokenized) == sorted(set(text.lower() for text in texts))
+
+    for row, (text, query_id) in enumerate(zip(texts, query_ids)):
+        single = dataset.prepare_onnx_input(tokenizer, labels, char2phonemes, chars, [text], [query_id], use_mask=True)
+        length = single["input_ids"].shape[1]
+        assert (batched["input_ids"][row, :length] == single["input_ids"][0]).all()
+        assert (batched["token_type_ids"][row, :length] == single["token_type_ids"][0]).all()
+        assert (batched["attention_masks"][row, :length] == 1).all()
+        assert (batched["attention_masks"][row, length:] == 0).all()
+        assert (batched["input_ids"][row, length:] == tokenizer.pad_token_id).all()
+        for key in ["phoneme_masks", "char_ids", "position_ids"]:
+            assert (batched[key][row] == single[key][0]).all()
@@ -0,0 +1,67 @@
+"""
+串流文本工具測試：<think> 標籤過濾與切句
+"""
+from utils.text_utils import SentenceSplitter, ThinkTagFilter, process_llm_response
+
+
+def feed_all(filter_or_splitter, chunks):
+    out = []
+    for chunk in chunks:
+        result = filter_or_splitter.feed(chunk)
+        out.extend(result if isinstance(result, list) else [result])
+    flushed = filter_or_splitter.flush()
+    out.extend(flushed if isinstance(flushed, list) else [flushed])
+    return out
+
+
+def test_think_filter_drops_think_block():
+    text = "<think>先想一想。</think>我不在乎。"
+    assert "".join(feed_all(ThinkTagFilter(), [text])) == "我不在乎。"
+
+
+def test_think_filter_handles_tags_split_across_chunks():
+    text = "開頭<think>內部推理</think>結尾。"
+    for size in range(1, len(text) + 1):
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        assert "".join(feed_all(ThinkTagFilter(), chunks)) == "開頭結尾。", size
+
+
+def test_think_filter_keeps_lookalike_text():
+    assert "".join(feed_all(ThinkTagFilter(), ["a <thi", "ng> b"])) == "a <thing> b"
+
+
+def test_think_filter_drops_unterminated_block():
+    assert "".join(feed_all(ThinkTagFilter(), ["可見<think>沒有結束"])) == "可見"
+
+
+def test_think_filter_matches_process_llm_response():
+    text = "<think>推理</think>  你又在看那些無聊的東西了嗎？"
+    assert "".join(feed_all(ThinkTagFilter(), [text])).strip() == process_llm_response(text)
+
+
+def test_splitter_cuts_at_sentence_end():
+    chunks = list("今天的天氣真不錯。我們一起去公園散步吧！還有嗎")
+    assert feed_all(SentenceSplitter(), chunks) == ["今天的天氣真不錯。", "我們一起去公園散步吧！", "還有嗎"]
+
+
+def test_splitter_yields_sentence_before_stream_ends():
+    splitter = SentenceSplitter()
+    assert splitter.feed("今天的天氣真不錯。") == []
+    assert splitter.feed("我") == ["今天的天氣真不錯。"]
+
+
+def test_splitter_merges_short_sentences():
+    assert feed_all(SentenceSplitter(min_length=5), ["好。", "我承認這次是我錯了。"]) == ["好。我承認這次是我錯了。"]
+
+
+def test_splitter_keeps_consecutive_punctuation_together():
+    assert feed_all(SentenceSplitter(), ["我不知道該說什麼……", "算了。"]) == ["我不知道該說什麼……", "算了。"]
+
+
+def test_splitter_skips_think_block():
+    chunks = ["<think>這段是", "推理。</think>", "別擔心，我會一直在這裡。"]
+    assert feed_all(SentenceSplitter(), chunks) == ["別擔心，我會一直在這裡。"]
+
+
+def test_splitter_ignores_punctuation_only_tail():
+    assert feed_all(SentenceSplitter(), ["這個世界沒有理所當然的事。", "  "]) == ["這個世界沒有理所當然的事。"]
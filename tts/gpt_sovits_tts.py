@@ -6,11 +6,16 @@ import os
 import sys
 import time
 import requests
+import numpy as np
 import soundfile as sf
 import importlib.util
 import re
 import subprocess
-from typing import Optional
+import threading
+import uuid
+from dataclasses import dataclass, field
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 import nltk
 
 # 添加專案根目錄到路徑
@@ -20,8 +25,149 @@ from config import TTSConfig
 # 確保 nltk 資源已下載
 nltk.download('averaged_perceptron_tagger_eng')
 
+@dataclass
+class SharedEngine:
+    """行程內共用的原生 TTS 引擎"""
+    tts: Any
+    load_seconds: float
+    memory_mb: Dict[str, float]
+    # TTS.run() 會修改引擎內的 prompt 快取等狀態，同一時間只允許一個合成
+    lock: threading.RLock = field(default_factory=threading.RLock)
+    # 跨請求動態批次排程器（TTSConfig.ENABLE_BATCH_SCHEDULER 開啟時建立）
+    scheduler: Any = None
+
+def _module_megabytes(obj) -> float:
+    """計算模型參數與 buffer 佔用的記憶體 (MB)；非 nn.Module 時加總其 nn.Module 屬性"""
+    if hasattr(obj, "parameters") and hasattr(obj, "buffers"):
+        tensors = list(obj.parameters()) + list(obj.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors) / 1024 ** 2
+    return sum(_module_megabytes(value) for value in vars(obj).values() if hasattr(value, "parameters"))
+
+def model_memory_report(native_tts) -> Dict[str, float]:
+    """
+    統計原生 TTS 引擎中各模型常駐的記憶體
+
+    Args:
+        native_tts: TTS_infer_pack.TTS 實例
+
+    Returns:
+        dict: 模型名稱 -> 佔用記憶體 (MB)，尚未載入的模型不列出
+    """
+    names = ["t2s_model", "vits_model", "bert_model", "cnhuhbert_model", "vocoder", "sv_model", "sr_model"]
+    report = {}
+    for name in names:
+        model = getattr(native_tts, name, None)
+        if model is not None:
+            report[name] = round(_module_megabytes(model), 1)
+    return report
+
+def create_batch_scheduler(native_tts, lock):
+    """
+    為原生 TTS 引擎建立動態批次排程器
+
+    batch_scheduler.py 與 TTS.py 位於同一目錄，依檔案路徑載入，避免透過套件再導入一次 TTS 模組
+
+    Args:
+        native_tts: TTS_infer_pack.TTS 實例
+        lock: 引擎鎖，排程器與 TTS.run() 共用
+
+    Returns:
+        TTSBatchScheduler: 排程器實例
+    """
+    tts_dir = os.path.dirname(sys.modules[type(native_tts).__module__].__file__)
+    spec = importlib.util.spec_from_file_location("batch_scheduler", os.path.join(tts_dir, "batch_scheduler.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    print(f"🧺 啟用動態批次: 每批最多 {TTSConfig.BATCH_MAX_SIZE} 句，最長等待 {TTSConfig.BATCH_MAX_WAIT_MS}ms")
+    return module.TTSBatchScheduler(
+        native_tts,
+        max_batch_size=TTSConfig.BATCH_MAX_SIZE,
+        max_wait_ms=TTSConfig.BATCH_MAX_WAIT_MS,
+        lock=lock
+    )
+
+class TTSEngineRegistry:
+    """
+    原生 TTS 引擎登錄表
+
+    以模型組合 (GPT 權重、SoVITS 權重、裝置) 為鍵，每組模型在行程內只載入一次，
+    所有 GPTSoVITSTTS 實例共用同一個引擎，合成時以引擎鎖排隊
+    """
+
+    def __init__(self):
+        self._engines: Dict[tuple, SharedEngine] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: tuple, loader: Callable[[], Any]) -> Optional[SharedEngine]:
+        """
+        取得共用引擎，尚未載入時呼叫 loader 載入
+
+        Args:
+            key: 模型組合鍵
+            loader: 載入原生 TTS 的函數，失敗時返回None
+
+        Returns:
+            SharedEngine: 共用引擎，載入失敗時返回None（下次呼叫會重試）
+        """
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is not None:
+                print("♻️ 共用已載入的 TTS 引擎")
+                return engine
+
+            start = time.time()
+            native_tts = loader()
+            if native_tts is None:
+                return None
+            engine = SharedEngine(
+                tts=native_tts,
+                load_seconds=time.time() - start,
+                memory_mb=model_memory_report(native_tts)
+            )
+            if TTSConfig.ENABLE_BATCH_SCHEDULER:
+                engine.scheduler = create_batch_scheduler(native_tts, engine.lock)
+            self._engines[key] = engine
+            print(f"✅ TTS 引擎載入完成，耗時 {engine.load_seconds:.2f}s")
+            for name, size in engine.memory_mb.items():
+                print(f"  {name}: {size:.1f} MB")
+            return engine
+
+    def stats(self) -> List[dict]:
+        """
+        取得已載入引擎的統計
+
+        Returns:
+            List[dict]: 每個引擎的模型路徑、載入耗時與各模型記憶體
+        """
+        with self._lock:
+            return [
+                {
+                    "gpt_model": key[0],
+                    "sovits_model": key[1],
+                    "device": key[2],
+                    "load_seconds": round(engine.load_seconds, 2),
+                    "startup_profile": {
+                        name: round(seconds, 2)
+                        for name, seconds in getattr(engine.tts, "startup_profile", {}).items()
+                    },
+                    # 延遲載入的模型在第一次使用後才會出現
+                    "memory_mb": model_memory_report(engine.tts),
+                    "prompt_cache": engine.tts.prompt_feature_cache.stats(),
+                    "text_cache": (
+                        engine.tts.text_preprocessor.feature_cache.stats()
+                        if engine.tts.text_preprocessor.feature_cache is not None
+                        else None
+                    ),
+                    "voices": list(engine.tts.voice_profiles),
+                    "batch_scheduler": engine.scheduler.stats() if engine.scheduler else None
+                }
+                for key, engine in self._engines.items()
+            ]
+
+ENGINE_REGISTRY = TTSEngineRegistry()
+
 class GPTSoVITSTTS:
-    """GPT-SoVITS TTS 語音合成器"""
+    """GPT-SoVITS TTS 語音合成器（同一組模型在行程內共用一個引擎）"""
     
     def __init__(self, output_dir=None):
         """初始化 TTS 系統"""
@@ -38,6 +184,7 @@ class GPTSoVITSTTS:
         
         # 初始化狀態
         self.native_tts = None
+        self.engine: Optional[SharedEngine] = None
         self.api_url = None
         
         # 優先嘗試初始化原生 TTS
@@ -47,7 +194,7 @@ class GPTSoVITSTTS:
             print("原生 TTS 初始化失敗，嘗試 API 模式...")
     
     def _init_native_tts(self):
-        """初始化原生 TTS 引擎"""
+        """初始化原生 TTS 引擎（從登錄表取得，已載入過的模型組合直接共用）"""
         try:
             print("初始化原生 TTS 引擎...")
               # 檢查路徑是否存在
@@ -59,28 +206,53 @@ class GPTSoVITSTTS:
                 else:
                     print(f"路徑存在: {path}")
             
+            # 設置設備
+            device = "cuda" if os.environ.get("CUDA_VISIBLE_DEVICES") else "cpu"
+            
+            key = (os.path.abspath(self.gpt_model), os.path.abspath(self.sovits_model), device)
+            self.engine = ENGINE_REGISTRY.acquire(key, lambda: self._load_native_tts(device))
+            self.native_tts = self.engine.tts if self.engine else None
+            
+        except Exception as e:
+            print(f"原生 TTS 初始化失敗: {e}")
+            self.native_tts = None
+    
+    def _load_native_tts(self, device: str):
+        """
+        載入原生 TTS 模型
+        
+        Args:
+            device: 推理裝置
+            
+        Returns:
+            TTS: 原生 TTS 實例，失敗時返回None
+        """
+        try:
             # 添加路徑
             sys.path.insert(0, self.gpt_sovits_dir)
             sys.path.insert(0, os.path.join(self.gpt_sovits_dir, "GPT_SoVITS"))
             
-            # 搜索 TTS.py 文件
-            tts_py_path = None
-            for root, dirs, files in os.walk(self.sovits_dir):
-                if "TTS.py" in files and "TTS_infer_pack" in root:
-                    tts_py_path = os.path.join(root, "TTS.py")
-                    print(f"找到 TTS.py: {tts_py_path}")
-                    tts_dir = os.path.dirname(tts_py_path)
-                    sys.path.insert(0, os.path.dirname(tts_dir))
-                    break
+            # TTS.py 位於固定位置，找不到時才搜索整個目錄
+            tts_py_path = os.path.join(self.sovits_dir, "GPT_SoVITS", "TTS_infer_pack", "TTS.py")
+            if not os.path.exists(tts_py_path):
+                tts_py_path = None
+                for root, dirs, files in os.walk(self.sovits_dir):
+                    if "TTS.py" in files and "TTS_infer_pack" in root:
+                        tts_py_path = os.path.join(root, "TTS.py")
+                        break
             
             if not tts_py_path:
                 print("找不到 TTS.py 文件")
-                return
+                return None
+            print(f"找到 TTS.py: {tts_py_path}")
+            sys.path.insert(0, os.path.dirname(os.path.dirname(tts_py_path)))
             
             # 動態導入 TTS 模組
+            start = time.time()
             spec = importlib.util.spec_from_file_location("TTS", tts_py_path)
             tts_module = importlib.util.module_from_spec(spec)
             spec.loader.exec_module(tts_module)
+            print(f"⏱️ 導入 TTS 模組耗時: {time.time() - start:.2f}s")
               # 獲取 TTS 和 TTS_Config 類
             TTS = tts_module.TTS
             TTS_Config = tts_module.TTS_Config
@@ -92,9 +264,6 @@ class GPTSoVITSTTS:
             bert_path = os.path.join(pretrained_dir, "chinese-roberta-wwm-ext-large")
             hubert_path = os.path.join(pretrained_dir, "chinese-hubert-base")
             
-            # 設置設備
-            device = "cuda" if os.environ.get("CUDA_VISIBLE_DEVICES") else "cpu"
-            
             # 建立 TTS 配置 - 強制使用絕對路徑防止 TTS 預設路徑
             tts_config = {
                 "device": device,
@@ -119,17 +288,31 @@ class GPTSoVITSTTS:
                 print(f"  t2s_weights_path: {config_obj.t2s_weights_path}")
                 print(f"  vits_weights_path: {config_obj.vits_weights_path}")
                 
-                self.native_tts = TTS(config_obj)
+                # 互不依賴的模型平行載入，少用的模型延遲到第一次合成
+                config_obj.parallel_load = TTSConfig.PARALLEL_LOAD_MODELS
+                config_obj.lazy_load = TTSConfig.LAZY_LOAD_MODELS
+                # 切換參考音頻時直接讀取快取的特征
+                config_obj.prompt_cache_dir = TTSConfig.PROMPT_CACHE_DIR
+                config_obj.prompt_cache_size = TTSConfig.PROMPT_CACHE_SIZE
+                config_obj.prompt_cache_disk_entries = TTSConfig.PROMPT_CACHE_DISK_ENTRIES
+                config_obj.decode_slots = TTSConfig.DECODE_SLOTS
+                config_obj.sync_interval = TTSConfig.SYNC_INTERVAL
+                config_obj.bert_batch_size = TTSConfig.BERT_BATCH_SIZE
+                config_obj.text_cache_size = TTSConfig.TEXT_CACHE_SIZE
+                config_obj.text_cache_dir = TTSConfig.TEXT_CACHE_DIR
+                config_obj.bert_backend = TTSConfig.BERT_BACKEND
+                native_tts = TTS(config_obj)
                 print("原生 TTS 引擎初始化成功!")
+                return native_tts
             except Exception as e:
                 print(f"創建 TTS 實例時發生錯誤: {e}")
                 import traceback
                 traceback.print_exc()
-                self.native_tts = None
+                return None
             
         except Exception as e:
             print(f"原生 TTS 初始化失敗: {e}")
-            self.native_tts = None
+            return None
     
     def synthesize(self, text, output_filename=None, output_path=None):
         """
@@ -154,8 +337,8 @@ class GPTSoVITSTTS:
         else:
             # 生成輸出檔案名稱
             if not output_filename:
-                timestamp = int(time.time())
-                output_filename = f"wednesday_tts_{timestamp}.wav"
+                # 以隨機 ID 命名，同一秒內的並行請求不會互相覆寫
+                output_filename = f"wednesday_tts_{uuid.uuid4().hex}.wav"
             output_path = os.path.join(self.output_dir, output_filename)
         
         # 優先使用原生 TTS
@@ -177,40 +360,17 @@ class GPTSoVITSTTS:
             lang = self._detect_language(text)
             print(f"🔤 檢測到語言: {lang}")
 
-            # 構造 run() 參數字典，注意 key 要用 ref_wav_path
-            inputs = {
-                "text": text,
-                "text_lang": lang,
-                "ref_audio_path": self.reference_audio,       # ← 必須
-                "aux_ref_audio_paths": [],
-                "prompt_text": (
-                    "…有那种东西才怪吧？！"
-                    "我要是真跟机器头说上话了倒还好，"
-                    "但现在的问题是…祂根本没有反应！"
-                ),
-                "prompt_lang": "zh",
-                "top_k": 15,
-                "top_p": 1.0,
-                "temperature": 1.0,
-                "text_split_method": "cut0",
-                "batch_size": 1,
-                "batch_threshold": 0.75,
-                "split_bucket": True,
-                "return_fragment": False,
-                "speed_factor": 1.0,
-                "fragment_interval": 0.3,
-                "seed": -1,
-                "parallel_infer": False,
-                "repetition_penalty": 1.35,
-                "sample_steps": 16,
-                "super_sampling": False,
-            }
+            inputs = self._build_inputs(text, lang)
 
             start = time.time()
-            # 這裡是關鍵修改：使用 next() 從生成器獲取第一個結果
-            for sample_rate, audio in self.native_tts.run(inputs):
-                # 取第一個結果就退出循環
-                break
+            if self.engine.scheduler is not None:
+                sample_rate, audio = self._synthesize_batched(inputs)
+            else:
+                with self.engine.lock:
+                    # 這裡是關鍵修改：使用 next() 從生成器獲取第一個結果
+                    for sample_rate, audio in self.native_tts.run(inputs):
+                        # 取第一個結果就退出循環
+                        break
             print(f"⏱️ 耗時: {time.time() - start:.2f}s")
 
             if audio is None:
@@ -227,6 +387,112 @@ class GPTSoVITSTTS:
             return None
     
     
+    def _synthesize_batched(self, inputs: dict) -> Tuple[int, np.ndarray]:
+        """
+        透過動態批次排程器合成，與其他同時進行的請求合併成同一批推理
+
+        Args:
+            inputs: _build_inputs() 構造的參數
+
+        Returns:
+            tuple: (取樣率, int16 音頻數據)
+        """
+        scheduler = self.engine.scheduler
+        scheduler.register_voice(
+            TTSConfig.VOICE_ID,
+            inputs["ref_audio_path"],
+            inputs["prompt_text"],
+            inputs["prompt_lang"],
+            inputs["aux_ref_audio_paths"]
+        )
+        # 排程器以句為單位組批，固定按標點切句
+        return scheduler.synthesize(
+            inputs["text"],
+            inputs["text_lang"],
+            voice_id=TTSConfig.VOICE_ID,
+            text_split_method="cut5",
+            top_k=inputs["top_k"],
+            top_p=inputs["top_p"],
+            temperature=inputs["temperature"],
+            repetition_penalty=inputs["repetition_penalty"],
+            speed_factor=inputs["speed_factor"],
+            sample_steps=inputs["sample_steps"],
+            fragment_interval=inputs["fragment_interval"]
+        )
+
+    def _build_inputs(self, text: str, lang: str, **overrides) -> dict:
+        """
+        構造 TTS.run() 參數字典
+
+        Args:
+            text: 要合成的文本
+            lang: 文本語言
+            **overrides: 覆蓋預設值的參數
+
+        Returns:
+            dict: run() 參數
+        """
+        # 注意 key 要用 ref_audio_path
+        inputs = {
+            "text": text,
+            "text_lang": lang,
+            "ref_audio_path": self.reference_audio,       # ← 必須
+            "aux_ref_audio_paths": [],
+            "prompt_text": (
+                "…有那种东西才怪吧？！"
+                "我要是真跟机器头说上话了倒还好，"
+                "但现在的问题是…祂根本没有反应！"
+            ),
+            "prompt_lang": "zh",
+            "top_k": 15,
+            "top_p": 1.0,
+            "temperature": 1.0,
+            "text_split_method": "cut0",
+            "batch_size": 1,
+            "batch_threshold": 0.75,
+            "split_bucket": True,
+            "return_fragment": False,
+            "speed_factor": 1.0,
+            "fragment_interval": 0.3,
+            "seed": -1,
+            "parallel_infer": False,
+            "repetition_penalty": 1.35,
+            "sample_steps": 16,
+            "super_sampling": False,
+        }
+        inputs.update(overrides)
+        return inputs
+
+    def synthesize_fragments(self, text: str) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        分段合成語音，每解碼完一句就立即返回，不寫入檔案
+
+        Args:
+            text: 要合成的文本
+
+        Yields:
+            tuple: (取樣率, int16 音頻數據)
+        """
+        if not self.native_tts:
+            print("語音合成失敗，請確保 GPT-SoVITS 正在運行")
+            return
+
+        text = self._clean_text(text)
+        lang = self._detect_language(text)
+        print(f"🔊 使用原生 TTS 分段合成: {text[:30]}...")
+        inputs = self._build_inputs(
+            text,
+            lang,
+            text_split_method="cut5",
+            split_bucket=False,
+            return_fragment=True,
+        )
+        # 共用引擎在整段合成期間鎖定，其他請求排隊等待
+        with self.engine.lock:
+            for sample_rate, audio in self.native_tts.run(inputs):
+                if audio is not None and len(audio) > 0:
+                    yield sample_rate, audio
+
     def _detect_language(self, text):
         """自動檢測文本語言類型"""
         # 計算中文字符數量
@@ -293,17 +559,104 @@ class GPTSoVITSTTS:
             print(f"播放音頻時發生錯誤: {e}")
 
 
+class StreamingTTSPipeline:
+    """
+    句子級串流合成管線
+
+    LLM 繼續生成時，已完成的句子交給背景執行緒依序合成，
+    呼叫端按提交順序取回音頻，首句語音不必等待整段回覆
+    """
+
+    def __init__(self, tts: GPTSoVITSTTS, output_prefix: str = None):
+        """
+        Args:
+            tts: 已初始化的 TTS 合成器
+            output_prefix: 音頻檔名前綴（預設以隨機 ID 產生，同時開始的串流不會互相覆寫）
+        """
+        self.tts = tts
+        self.output_prefix = output_prefix or f"wednesday_tts_{uuid.uuid4().hex}"
+        # 模型推理不可並行，單一工作執行緒同時保證輸出順序
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts-stream")
+        self._pending: List[Tuple[str, Future]] = []
+        self._index = 0
+
+    def submit(self, sentence: str):
+        """
+        提交一個完整句子進行合成
+
+        Args:
+            sentence: 要合成的句子
+        """
+        output_filename = f"{self.output_prefix}_{self._index:03d}.wav"
+        self._index += 1
+        future = self._executor.submit(self.tts.synthesize, sentence, output_filename)
+        self._pending.append((sentence, future))
+
+    def ready(self) -> Iterator[Tuple[str, Optional[str]]]:
+        """
+        取回已合成完成的音頻（不阻塞，保持提交順序）
+
+        Yields:
+            tuple: (句子, 音頻檔案路徑或None)
+        """
+        while self._pending and self._pending[0][1].done():
+            sentence, future = self._pending.pop(0)
+            yield sentence, self._result(future)
+
+    def drain(self) -> Iterator[Tuple[str, Optional[str]]]:
+        """
+        等待剩餘句子合成完畢並依序取回
+
+        Yields:
+            tuple: (句子, 音頻檔案路徑或None)
+        """
+        while self._pending:
+            sentence, future = self._pending.pop(0)
+            yield sentence, self._result(future)
+
+    def shutdown(self):
+        """取消尚未開始的合成並關閉工作執行緒"""
+        self._pending = []
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _result(self, future: Future) -> Optional[str]:
+        try:
+            return future.result()
+        except Exception as e:
+            print(f"❌ 句子合成失敗: {e}")
+            return None
+
+
+_default_tts: Dict[Optional[str], GPTSoVITSTTS] = {}
+_default_tts_lock = threading.Lock()
+
+def get_tts(output_dir=None) -> GPTSoVITSTTS:
+    """
+    取得共用的 TTS 合成器（每個輸出目錄一個實例，模型由登錄表共用）
+
+    Args:
+        output_dir: 輸出目錄
+
+    Returns:
+        GPTSoVITSTTS: TTS 合成器
+    """
+    with _default_tts_lock:
+        tts = _default_tts.get(output_dir)
+        if tts is None or tts.native_tts is None:
+            tts = GPTSoVITSTTS(output_dir=output_dir)
+            _default_tts[output_dir] = tts
+        return tts
+
+
 # 便利函數
 def text_to_speech(text, output_dir=None):
     """將文本轉換為語音"""
-    tts = GPTSoVITSTTS(output_dir=output_dir)
-    return tts.synthesize(text)
+    return get_tts(output_dir).synthesize(text)
 
 
 def rag_to_speech(rag_response, output_dir=None):
     """將 RAG 回應轉換為語音"""
-    tts = GPTSoVITSTTS(output_dir=output_dir)
-    return tts.synthesize(rag_response)
+    return get_tts(output_dir).synthesize(rag_response)
 
 
 # 測試函數
@@ -6,13 +6,21 @@ import os
 import sys
 import json
 import time
-from typing import Optional, Dict, Any
+import io
+import base64
+import shutil
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable, List
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 import requests
 import logging
 from pydantic import BaseModel
+import numpy as np
+import soundfile as sf
 
 # 設置日誌
 logging.basicConfig(level=logging.INFO,
@@ -26,6 +34,10 @@ sys.path.append(root_dir)
 
 try:
     from main import WednesdayRAGSystem
+    from config import UIConfig
+    from utils.text_utils import ThinkTagFilter
+    from tts.gpt_sovits_tts import ENGINE_REGISTRY
+    from rag.llm_chain import WEDNESDAY_STREAM_PERSONA, is_error_reply
     logger.info(f"✅ 成功導入所需模組，專案根目錄: {root_dir}")
 except ImportError as e:
     logger.error(f"❌ 導入模組失敗: {e}")
@@ -53,28 +65,125 @@ OLLAMA_BASE_URL = 'http://localhost:11434'  # Ollama API 位址
 # 全域變數
 wednesday_system = None
 current_model = "deepseek-r1:latest"
-is_processing = False
+init_lock = threading.Lock()
+
+class ChatWorkerPool:
+    """
+    有上限的聊天工作池
+
+    LLM/RAG 的阻塞呼叫在執行緒池中執行，不佔用事件迴圈；
+    執行中加等待中的請求數達到上限時直接拒絕，由呼叫端回傳 429
+    """
+
+    def __init__(self, max_workers: int, max_queued: int):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chat-worker")
+        self._lock = threading.Lock()
+        self._pending = 0  # 執行中 + 等待中
+        self._active = 0   # 執行中
+
+    def _try_acquire(self) -> bool:
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queued:
+                return False
+            self._pending += 1
+            return True
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+
+    def _call(self, fn: Callable, *args, **kwargs):
+        with self._lock:
+            self._active += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def submit(self, fn: Callable, *args, **kwargs) -> asyncio.Future:
+        """
+        將阻塞函數提交到工作池
+
+        Returns:
+            asyncio.Future: 可在事件迴圈中等待的結果
+
+        Raises:
+            HTTPException: 工作池已滿 (429)
+        """
+        if not self._try_acquire():
+            raise HTTPException(
+                status_code=429,
+                detail="系統忙碌中，請稍後再試",
+                headers={"Retry-After": "1"}
+            )
+        future = self._executor.submit(self._call, fn, *args, **kwargs)
+        # 以完成回呼釋放名額，客戶端中途斷線時執行緒仍在跑也不會少算
+        future.add_done_callback(self._release)
+        return asyncio.wrap_future(future)
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """
+        在工作池中執行阻塞函數並等待結果
+
+        Raises:
+            HTTPException: 工作池已滿 (429)
+        """
+        return await self.submit(fn, *args, **kwargs)
+
+    def stats(self) -> Dict[str, int]:
+        """取得工作池狀態"""
+        with self._lock:
+            return {
+                "active": self._active,
+                "queued": self._pending - self._active,
+                "max_concurrent": self.max_workers,
+                "max_queued": self.max_queued
+            }
+
+chat_pool = ChatWorkerPool(UIConfig.API_MAX_CONCURRENT_CHATS, UIConfig.API_MAX_QUEUED_CHATS)
 
 def initialize_system():
     """初始化 Wednesday RAG 系統"""
     global wednesday_system
-    if wednesday_system is None:
-        try:
-            logger.info("🖤 初始化 Wednesday RAG 系統...")
-            wednesday_system = WednesdayRAGSystem()
-            wednesday_system.initialize()
-            logger.info("✅ 系統初始化完成！")
-        except Exception as e:
-            logger.error(f"❌ 系統初始化失敗: {e}")
-            raise e
+    with init_lock:
+        if wednesday_system is None:
+            try:
+                logger.info("🖤 初始化 Wednesday RAG 系統...")
+                system = WednesdayRAGSystem()
+                system.initialize()
+                wednesday_system = system
+                logger.info("✅ 系統初始化完成！")
+            except Exception as e:
+                logger.error(f"❌ 系統初始化失敗: {e}")
+                raise e
     return wednesday_system
 
+def check_ollama():
+    """檢查 Ollama 服務狀態"""
+    try:
+        ollama_response = requests.get(f'{OLLAMA_BASE_URL}/api/version', timeout=3)
+        ollama_status = 'online' if ollama_response.ok else 'offline'
+        ollama_version = ollama_response.json().get('version') if ollama_response.ok else None
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"無法連接到 Ollama 服務: {e}")
+        ollama_status = 'offline'
+        ollama_version = None
+    return ollama_status, ollama_version
+
 # 請求/回應模型
 class ChatRequest(BaseModel):
     message: str
     use_tts: bool = True
     model: Optional[str] = "deepseek-r1:latest"
     output_path: Optional[str] = "output"
+    include_context: bool = False
+
+class ContextDocument(BaseModel):
+    content: str
+    metadata: Dict[str, Any] = {}
 
 class ChatResponse(BaseModel):
     message: str
@@ -83,6 +192,7 @@ class ChatResponse(BaseModel):
     model: str
     timestamp: float
     tts_status: str = "ready"
+    context: Optional[List[ContextDocument]] = None
 
 @app.get("/")
 async def root():
@@ -96,29 +206,10 @@ async def root():
 @app.get("/health")
 async def health_check():
     """健康檢查端點"""
-    global is_processing
-    
-    # 如果有其他操作正在處理中，返回簡略狀態
-    if is_processing:
-        return {
-            "status": "busy",
-            "message": "系統正在處理其他操作",
-            "timestamp": time.time()
-        }
-    
     try:
-        # 檢查 Ollama 服務
-        try:
-            ollama_response = requests.get(f'{OLLAMA_BASE_URL}/api/version')
-            ollama_status = 'online' if ollama_response.ok else 'offline'
-            ollama_version = ollama_response.json().get('version') if ollama_response.ok else None
-        except requests.exceptions.RequestException as e:
-            logger.warning(f"無法連接到 Ollama 服務: {e}")
-            ollama_status = 'offline'
-            ollama_version = None
-        
-        # 檢查我們的系統
-        system = initialize_system()
+        # 阻塞的網路檢查與系統初始化都移出事件迴圈
+        ollama_status, ollama_version = await asyncio.to_thread(check_ollama)
+        system = await asyncio.to_thread(initialize_system)
         
         return {
             "status": "online",
@@ -127,7 +218,18 @@ async def health_check():
             "model": current_model,
             "timestamp": time.time(),
             "tts_available": system.tts is not None,
-            "rag_available": system.wednesday is not None
+            "tts_engines": ENGINE_REGISTRY.stats(),
+            "rag_available": system.wednesday is not None,
+            "response_cache": (
+                system.wednesday.response_cache.stats()
+                if system.wednesday and system.wednesday.response_cache else None
+            ),
+            "semantic_cache": (
+                system.wednesday.semantic_cache.stats()
+                if system.wednesday and system.wednesday.semantic_cache else None
+            ),
+            "retrieval": system.retriever_instance.stats() if system.retriever_instance else None,
+            "chat_queue": chat_pool.stats()
         }
         
     except Exception as e:
@@ -135,81 +237,234 @@ async def health_check():
         logger.error(error_msg)
         raise HTTPException(status_code=500, detail=str(e))
 
+AUDIO_OUTPUT_DIR = os.path.join(root_dir, 'output')
+
+def generate_text_reply(message: str) -> tuple:
+    """
+    在工作執行緒中生成文字回應（含系統初始化）
+    
+    Returns:
+        tuple: (文字回應, 回應時間, 檢索到的文檔列表, 快取查詢結果)
+    """
+    system = initialize_system()
+    start_time = time.time()
+    lookup = system.wednesday.lookup_reply(message)
+    text_response, _, context_docs = system.wednesday.chat(
+        message, with_audio=False, return_context=True, lookup=lookup
+    )
+    return text_response, time.time() - start_time, context_docs, lookup
+
+def publish_audio(audio_path: str) -> str:
+    """
+    讓 /audio/{filename} 能讀到快取的音頻：不在輸出目錄時複製過去
+
+    Returns:
+        str: 返回給前端的檔名
+    """
+    filename = os.path.basename(audio_path)
+    target = os.path.join(AUDIO_OUTPUT_DIR, filename)
+    if os.path.abspath(audio_path) != os.path.abspath(target):
+        os.makedirs(AUDIO_OUTPUT_DIR, exist_ok=True)
+        shutil.copyfile(audio_path, target)
+    return filename
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """聊天對話端點"""
     try:
-        global current_model, is_processing
-        
         if not request.message.strip():
             raise HTTPException(status_code=400, detail="訊息不能為空")
         
-        # 初始化系統
-        system = initialize_system()
-        
         logger.info(f"🔤 收到用戶訊息: {request.message[:50]}...")
-        start_time = time.time()
         
-        # 標記為正在處理
-        is_processing = True
-        try:
-            # 先獲取文字回應，不等待TTS
-            text_response, _ = system.wednesday.chat(request.message, with_audio=False)
-            
-            response_time = time.time() - start_time
-            logger.info(f"⏱️ AI 文字回應時間: {response_time:.2f}s")
-            
-            # 如果啟用了 TTS，在後台生成音頻
-            audio_path = None
-            tts_status = "disabled"
-            
-            if request.use_tts and system.tts:
-                try:
-                    logger.info("🎙️ 開始後台語音合成...")
-                    import threading                    # 使用相对路径，始终存储在 output 目录下
-                    audio_filename = f"wednesday_tts_{int(time.time() * 1000)}.wav"
-                    # 返回给前端的路径只要文件名
-                    audio_path = audio_filename
-                    # 实际存储路径
-                    absolute_audio_path = os.path.join(root_dir, 'output', audio_filename)
-                    tts_status = "generating"
-                    
-                    def generate_audio():
-                        try:
-                            # 確保輸出目錄存在
-                            os.makedirs(os.path.dirname(absolute_audio_path), exist_ok=True)
-                            # 合成音頻
-                            system.tts.synthesize(text_response, output_path=absolute_audio_path)
-                            logger.info(f"✅ 後台語音合成完成: {audio_filename}")
-                        except Exception as e:
-                            logger.error(f"❌ 後台TTS合成失敗: {e}")
-                    
-                    # 在後台執行音頻生成
-                    audio_thread = threading.Thread(target=generate_audio)
-                    audio_thread.daemon = True
-                    audio_thread.start()
-                    
-                except Exception as e:
-                    logger.error(f"❌ 無法啟動TTS後台處理: {e}")
-                    tts_status = "error"
-            
-            return ChatResponse(
-                message=text_response,
-                audio_path=audio_path,
-                response_time=response_time,
-                model=request.model,
-                timestamp=time.time(),
-                tts_status=tts_status
-            )
-            
-        finally:
-            # 確保無論成功或失敗都重置處理標記
-            is_processing = False
-            
+        # 先獲取文字回應，不等待TTS；LLM/RAG 在工作池中執行
+        text_response, response_time, context_docs, lookup = await chat_pool.run(
+            generate_text_reply, request.message
+        )
+        logger.info(f"⏱️ AI 文字回應時間: {response_time:.2f}s")
+        system = wednesday_system
+        
+        # 如果啟用了 TTS，在後台生成音頻
+        audio_path = None
+        tts_status = "disabled"
+        
+        if request.use_tts and system.tts and lookup.audio_path:
+            # 快取中已有這段回覆的音頻，不必再合成
+            audio_path = publish_audio(lookup.audio_path)
+            tts_status = "ready"
+            logger.info(f"⚡ 使用快取音頻: {audio_path}")
+        elif request.use_tts and system.tts:
+            try:
+                logger.info("🎙️ 開始後台語音合成...")
+                # 使用相对路径，始终存储在 output 目录下；以快取鍵或隨機 ID 命名，並行請求不會互相覆寫
+                audio_filename = system.wednesday.audio_filename(lookup)
+                # 返回给前端的路径只要文件名
+                audio_path = audio_filename
+                # 实际存储路径
+                absolute_audio_path = os.path.join(AUDIO_OUTPUT_DIR, audio_filename)
+                tts_status = "generating"
+                
+                def generate_audio():
+                    try:
+                        # 確保輸出目錄存在
+                        os.makedirs(os.path.dirname(absolute_audio_path), exist_ok=True)
+                        # 合成音頻，完成後寫回快取
+                        if system.tts.synthesize(text_response, output_path=absolute_audio_path):
+                            system.wednesday.remember_audio(lookup, absolute_audio_path)
+                        logger.info(f"✅ 後台語音合成完成: {audio_filename}")
+                    except Exception as e:
+                        logger.error(f"❌ 後台TTS合成失敗: {e}")
+                
+                # 在後台執行音頻生成
+                audio_thread = threading.Thread(target=generate_audio)
+                audio_thread.daemon = True
+                audio_thread.start()
+                
+            except Exception as e:
+                logger.error(f"❌ 無法啟動TTS後台處理: {e}")
+                tts_status = "error"
+        
+        return ChatResponse(
+            message=text_response,
+            audio_path=audio_path,
+            response_time=response_time,
+            model=request.model,
+            timestamp=time.time(),
+            tts_status=tts_status,
+            context=[
+                ContextDocument(content=doc.page_content, metadata=doc.metadata)
+                for doc in context_docs
+            ] if request.include_context else None
+        )
+    
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ 聊天處理錯誤: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def encode_wav_base64(audio, sample_rate: int) -> str:
+    """將音頻數據編碼為 base64 WAV 字串"""
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, sample_rate, format="WAV")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+def produce_stream_events(request: ChatRequest, emit: Callable[[Dict[str, Any]], None], stop: threading.Event):
+    """
+    在工作執行緒中產生串流事件：先送出文字片段，再逐段送出解碼完成的音頻
+    
+    Args:
+        request: 聊天請求
+        emit: 事件回呼（執行緒安全）
+        stop: 客戶端斷線時設置，用於提前結束
+    """
+    try:
+        system = initialize_system()
+        start_time = time.time()
+        
+        # 快取命中時直接送出完整回覆，不呼叫 LLM；串流回覆以串流的角色設定存取快取，與 /chat 互不混用
+        lookup = system.wednesday.lookup_reply(request.message, persona=WEDNESDAY_STREAM_PERSONA)
+        if lookup.hit:
+            full_response = lookup.response
+            emit({"type": "text", "delta": full_response})
+        else:
+            think_filter = ThinkTagFilter()
+            full_response = ""
+            failed = False
+            for chunk in system.wednesday.chat_stream(request.message):
+                if stop.is_set():
+                    return
+                # ask_stream 出錯時以最後一個片段送出錯誤訊息
+                failed = failed or is_error_reply(chunk)
+                delta = think_filter.feed(chunk)
+                if delta:
+                    full_response += delta
+                    emit({"type": "text", "delta": delta})
+            full_response += think_filter.flush()
+            full_response = full_response.strip()
+            if failed or not full_response:
+                system.wednesday.discard_reply(lookup)
+            else:
+                system.wednesday.remember_reply(
+                    lookup, full_response, time.time() - start_time, persona=WEDNESDAY_STREAM_PERSONA
+                )
+        
+        response_time = time.time() - start_time
+        logger.info(f"⏱️ AI 文字回應時間: {response_time:.2f}s")
+        emit({"type": "text_done", "message": full_response, "response_time": response_time})
+        
+        if request.use_tts and system.tts and lookup.audio_path:
+            # 快取的音頻整段送出，不佔用 GPU
+            audio, sample_rate = sf.read(lookup.audio_path, dtype="int16")
+            emit({
+                "type": "audio",
+                "seq": 0,
+                "sample_rate": sample_rate,
+                "format": "wav",
+                "data": encode_wav_base64(audio, sample_rate)
+            })
+        elif request.use_tts and system.tts and full_response:
+            logger.info("🎙️ 開始串流語音合成...")
+            fragments = []
+            for seq, (sample_rate, audio) in enumerate(system.tts.synthesize_fragments(full_response)):
+                if stop.is_set():
+                    return
+                fragments.append(audio)
+                emit({
+                    "type": "audio",
+                    "seq": seq,
+                    "sample_rate": sample_rate,
+                    "format": "wav",
+                    "data": encode_wav_base64(audio, sample_rate)
+                })
+            # 完整音頻寫檔並存入快取，下次同樣的問題不必再合成
+            if fragments and (lookup.key or lookup.semantic_entry):
+                audio_file = os.path.join(AUDIO_OUTPUT_DIR, system.wednesday.audio_filename(lookup))
+                os.makedirs(AUDIO_OUTPUT_DIR, exist_ok=True)
+                sf.write(audio_file, np.concatenate(fragments), sample_rate)
+                system.wednesday.remember_audio(lookup, audio_file)
+        
+        emit({"type": "done", "model": request.model, "timestamp": time.time()})
+    
+    except Exception as e:
+        logger.error(f"❌ 串流聊天錯誤: {e}")
+        emit({"type": "error", "detail": str(e)})
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    串流聊天端點
+    
+    以 NDJSON 逐行回傳事件：text（文字片段）、text_done（完整文字）、
+    audio（base64 WAV 音頻片段，依 seq 排序）、done 或 error
+    """
+    if not request.message.strip():
+        raise HTTPException(status_code=400, detail="訊息不能為空")
+    
+    logger.info(f"🔤 收到串流訊息: {request.message[:50]}...")
+    
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+    
+    def emit(event: Dict[str, Any]):
+        loop.call_soon_threadsafe(queue.put_nowait, event)
+    
+    # 工作池已滿時在開始串流前就回傳 429
+    chat_pool.submit(produce_stream_events, request, emit, stop)
+    
+    async def event_stream():
+        try:
+            while True:
+                event = await queue.get()
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+                if event["type"] in ("done", "error"):
+                    break
+        finally:
+            stop.set()
+    
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
 @app.get("/audio/{filename}")
 async def get_audio(filename: str):
     """獲取音頻文件"""
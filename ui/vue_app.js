@@ -51,39 +51,36 @@ createApp({
 
             this.scrollToBottom();
 
-            try {
-                const response = await this.callChatAPI(inputText);
-                
-                const assistantMessage = {
-                    id: this.messageId++,
-                    type: 'assistant',
-                    content: response.message,
-                    audioPath: response.audio_path,
-                    audioStatus: response.tts_status || 'ready',
-                    timestamp: new Date()
-                };
+            const assistantMessage = {
+                id: this.messageId++,
+                type: 'assistant',
+                content: '',
+                audioClips: [],
+                audioStatus: this.settings.autoPlayAudio ? 'generating' : 'disabled',
+                timestamp: new Date()
+            };
 
+            try {
                 this.messages.push(assistantMessage);
-                
-                // 如果音頻正在生成中，開始檢查狀態
-                if (assistantMessage.audioStatus === 'generating' && response.audio_path) {
-                    this.checkAudioStatus(assistantMessage, response.audio_path);
-                }
-                
-                // 自動播放語音（如果已準備好）
-                if (this.settings.autoPlayAudio && response.audio_path && assistantMessage.audioStatus === 'ready') {
-                    setTimeout(() => {
-                        this.playAudio(response.audio_path);
-                    }, 500);
-                }
-
+                // 取回 Vue 的響應式代理，之後的修改才會更新畫面
+                const message = this.messages[this.messages.length - 1];
+                await this.streamChatAPI(inputText, message);
             } catch (error) {
                 console.error('聊天 API 錯誤:', error);
                 
+                // 移除尚未收到內容的空白回覆
+                const last = this.messages[this.messages.length - 1];
+                if (last && last.id === assistantMessage.id && !last.content) {
+                    this.messages.pop();
+                }
+                
+                const isBusy = error.response && error.response.status === 429;
                 const errorMessage = {
                     id: this.messageId++,
                     type: 'assistant',
-                    content: '抱歉，我遇到了一些技術問題。請稍後再試。',
+                    content: isBusy
+                        ? '現在找我的人太多了。等一下再來。'
+                        : '抱歉，我遇到了一些技術問題。請稍後再試。',
                     timestamp: new Date()
                 };
                 
@@ -107,6 +104,129 @@ createApp({
             return response.data;
         },
 
+        async streamChatAPI(message, assistantMessage) {
+            const response = await fetch(`${this.settings.apiUrl}/chat/stream`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    message: message,
+                    use_tts: this.settings.autoPlayAudio,
+                    model: this.settings.llmModel,
+                    output_path: this.settings.outputPath
+                })
+            });
+
+            if (!response.ok) {
+                // 與 axios 錯誤格式一致，方便統一處理 429 等狀態
+                const error = new Error(`HTTP ${response.status}`);
+                error.response = { status: response.status };
+                throw error;
+            }
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                let newline;
+                while ((newline = buffer.indexOf('\n')) >= 0) {
+                    const line = buffer.slice(0, newline).trim();
+                    buffer = buffer.slice(newline + 1);
+                    if (line) {
+                        this.handleStreamEvent(JSON.parse(line), assistantMessage);
+                    }
+                }
+            }
+
+            if (assistantMessage.audioStatus === 'generating') {
+                assistantMessage.audioStatus = assistantMessage.audioClips.length ? 'ready' : 'error';
+            }
+        },
+
+        handleStreamEvent(event, assistantMessage) {
+            switch (event.type) {
+                case 'text':
+                    assistantMessage.content += event.delta;
+                    this.scrollToBottom();
+                    break;
+                case 'text_done':
+                    assistantMessage.content = event.message;
+                    // 文字已完整，不必再顯示輸入中
+                    this.isTyping = false;
+                    break;
+                case 'audio': {
+                    const clipUrl = this.base64ToAudioUrl(event.data);
+                    assistantMessage.audioClips.push(clipUrl);
+                    // 第一段音頻到達就開始播放，後續片段依序排隊
+                    if (this.settings.autoPlayAudio) {
+                        this.enqueueAudio(clipUrl);
+                    }
+                    break;
+                }
+                case 'done':
+                    if (assistantMessage.audioStatus === 'generating') {
+                        assistantMessage.audioStatus = assistantMessage.audioClips.length ? 'ready' : 'disabled';
+                    }
+                    break;
+                case 'error':
+                    console.error('串流錯誤:', event.detail);
+                    assistantMessage.audioStatus = 'error';
+                    if (!assistantMessage.content) {
+                        throw new Error(event.detail);
+                    }
+                    break;
+            }
+        },
+
+        base64ToAudioUrl(data) {
+            const binary = atob(data);
+            const bytes = new Uint8Array(binary.length);
+            for (let i = 0; i < binary.length; i++) {
+                bytes[i] = binary.charCodeAt(i);
+            }
+            return URL.createObjectURL(new Blob([bytes], { type: 'audio/wav' }));
+        },
+
+        // 依序播放串流音頻片段
+        enqueueAudio(clipUrl) {
+            if (!this.audioQueue) {
+                this.audioQueue = [];
+                this.audioPlaying = false;
+            }
+            this.audioQueue.push(clipUrl);
+            if (!this.audioPlaying) {
+                this.playNextClip();
+            }
+        },
+
+        playNextClip() {
+            const clipUrl = this.audioQueue.shift();
+            if (!clipUrl) {
+                this.audioPlaying = false;
+                return;
+            }
+            this.audioPlaying = true;
+            const audio = new Audio(clipUrl);
+            audio.onended = () => this.playNextClip();
+            audio.onerror = () => this.playNextClip();
+            audio.play().catch(error => {
+                console.error('音頻播放失敗:', error);
+                this.playNextClip();
+            });
+        },
+
+        replayMessageAudio(message) {
+            if (message.audioClips && message.audioClips.length) {
+                message.audioClips.forEach(clipUrl => this.enqueueAudio(clipUrl));
+            } else {
+                this.playAudio(message.audioPath);
+            }
+        },
+
         // 播放音頻
         playAudio(audioPath) {
             if (!audioPath) return;
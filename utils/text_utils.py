@@ -1,7 +1,15 @@
 """
 文本處理工具模組
 """
+import os
 import re
+import importlib.util
+from typing import List, Optional, Tuple
+
+from config import BASE_DIR
+
+THINK_START = "<think>"
+THINK_END = "</think>"
 
 def process_llm_response(response: str) -> str:
     """
@@ -18,3 +26,166 @@ def process_llm_response(response: str) -> str:
     if think_match:
         return think_match.group(1).strip()
     return response
+
+def _load_tts_splits() -> set:
+    """
+    從 GPT-SoVITS 的切句模組載入句末標點集合
+
+    直接以檔案路徑載入 text_segmentation_method.py，避免觸發
+    TTS_infer_pack/__init__.py 連帶載入整個 TTS 推理模組
+
+    Returns:
+        set: 切句標點集合
+    """
+    path = os.path.join(BASE_DIR, "GPT_SoVITS", "TTS_infer_pack", "text_segmentation_method.py")
+    spec = importlib.util.spec_from_file_location("text_segmentation_method", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return set(module.splits)
+
+SENTENCE_SPLITS = _load_tts_splits()
+
+class ThinkTagFilter:
+    """
+    串流 <think> 標籤過濾器
+
+    逐段過濾 deepseek 模型輸出中 <think>...</think> 的思考過程，
+    標籤被切在兩個片段之間時也能正確處理
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._in_think = False
+
+    def feed(self, chunk: str) -> str:
+        """
+        送入一段串流文本
+
+        Args:
+            chunk: LLM 輸出的片段
+
+        Returns:
+            str: 可以顯示的文本（可能為空字串）
+        """
+        self._buffer += chunk
+        visible = []
+
+        while True:
+            if self._in_think:
+                end = self._buffer.find(THINK_END)
+                if end == -1:
+                    # 只保留可能是半個結束標籤的尾巴
+                    self._buffer = self._buffer[-(len(THINK_END) - 1):]
+                    break
+                self._buffer = self._buffer[end + len(THINK_END):]
+                self._in_think = False
+                continue
+
+            start = self._buffer.find(THINK_START)
+            if start != -1:
+                visible.append(self._buffer[:start])
+                self._buffer = self._buffer[start + len(THINK_START):]
+                self._in_think = True
+                continue
+
+            # 保留可能是半個開始標籤的尾巴，其餘直接輸出
+            keep = 0
+            for i in range(1, len(THINK_START)):
+                if self._buffer.endswith(THINK_START[:i]):
+                    keep = i
+            visible.append(self._buffer[:len(self._buffer) - keep])
+            self._buffer = self._buffer[len(self._buffer) - keep:]
+            break
+
+        return "".join(visible)
+
+    def flush(self) -> str:
+        """
+        串流結束時取出剩餘文本
+
+        Returns:
+            str: 剩餘可顯示的文本
+        """
+        rest = "" if self._in_think else self._buffer
+        self._buffer = ""
+        self._in_think = False
+        return rest
+
+class SentenceSplitter:
+    """
+    串流切句器
+
+    將 LLM 逐 token 輸出的片段累積起來，在句末標點處切出完整句子，
+    同時略過 deepseek 模型 <think> 標籤內的思考過程
+    """
+
+    def __init__(self, min_length: int = 5):
+        """
+        Args:
+            min_length: 句子最少字數（不含標點），過短的句子會與下一句合併
+        """
+        self.min_length = min_length
+        self._buffer = ""
+        self._think_filter = ThinkTagFilter()
+
+    def feed(self, chunk: str) -> List[str]:
+        """
+        送入一段串流文本
+
+        Args:
+            chunk: LLM 輸出的片段
+
+        Returns:
+            List[str]: 本次已完成的句子（可能為空）
+        """
+        self._buffer += self._think_filter.feed(chunk)
+        sentences, consumed = self._cut(self._buffer, final=False)
+        self._buffer = self._buffer[consumed:]
+        return sentences
+
+    def flush(self) -> List[str]:
+        """
+        串流結束時切出剩餘的句子（包含未以標點結尾的文本）
+
+        Returns:
+            List[str]: 剩餘的句子
+        """
+        self._buffer += self._think_filter.flush()
+        sentences, _ = self._cut(self._buffer, final=True)
+        self._buffer = ""
+        return sentences
+
+    def _cut(self, text: str, final: bool) -> Tuple[List[str], int]:
+        """
+        在標點處切句
+
+        Args:
+            text: 待切分文本
+            final: 文本是否已完整（不會再有後續字元）
+
+        Returns:
+            tuple: (切出的句子, 已消耗的字元數)
+        """
+        sentences = []
+        tail = 0
+        for i, char in enumerate(text):
+            if char not in SENTENCE_SPLITS:
+                continue
+            # 連續標點（例如「……」）要等到下一個非標點字元才切
+            if i + 1 < len(text):
+                if text[i + 1] in SENTENCE_SPLITS:
+                    continue
+            elif not final:
+                break
+            piece = text[tail:i + 1]
+            if len(re.sub(r"\W+", "", piece)) < self.min_length:
+                continue
+            sentences.append(piece.strip())
+            tail = i + 1
+
+        if final:
+            rest = text[tail:].strip()
+            if re.sub(r"\W+", "", rest):
+                sentences.append(rest)
+            tail = len(text)
+        return sentences, tail